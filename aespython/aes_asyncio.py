@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+asyncio stream adapters.
+
+EncryptingWriter wraps an asyncio.StreamWriter and DecryptingReader wraps an asyncio.StreamReader,
+each keeping the CipherMode state of one connection. Chunks smaller than inline_limit are ciphered
+directly in the event loop, where the call is cheaper than a hand off. Larger chunks run in an
+executor so the loop keeps serving other connections. With a thread pool the cipher still holds
+the GIL, it only yields the loop between switch intervals; a process pool takes the work off the
+loop entirely, the mode is pickled to the worker and its updated state comes back with the result.
+Start a forking process pool before accepting connections, or its workers inherit the sockets.
+
+CTR streams pass every write straight through. Other modes hold back a trailing partial block
+until close(), and padded modes (CBC, ECB) are PKCS7 padded on close and unpadded at EOF.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import asyncio
+
+def _crypt_chunk(mode, data, decrypt):
+    #Module level so process pools can pickle it. Returns the mode, whose IV or counter moved on.
+    return (mode.decrypt(data) if decrypt else mode.encrypt(data)), mode
+
+class _AsyncCipher:
+    def __init__(self, mode, executor, inline_limit):
+        self._mode = mode
+        self._executor = executor
+        self._inline_limit = inline_limit
+
+    async def _crypt(self, data, decrypt):
+        if len(data) < self._inline_limit:
+            return _crypt_chunk(self._mode, data, decrypt)[0]
+        loop = asyncio.get_running_loop()
+        out, self._mode = await loop.run_in_executor(self._executor, _crypt_chunk, self._mode, bytes(data), decrypt)
+        return out
+
+class EncryptingWriter(_AsyncCipher):
+    """Encrypt data written to an asyncio.StreamWriter"""
+
+    def __init__(self, writer, mode, executor=None, inline_limit=1 << 14):
+        """
+            mode is a keyed CipherMode with its IV set, used only by this writer.
+            executor is a concurrent.futures executor, None for the loop's default thread pool.
+        """
+        _AsyncCipher.__init__(self, mode, executor, inline_limit)
+        self._writer = writer
+        self._buffer = bytearray()
+
+    async def write(self, data):
+        """Encrypt data, write it and wait for the transport to drain"""
+        self._buffer += data
+        n = len(self._buffer)
+        if not hasattr(self._mode, 'seek'):
+            n -= n % 16
+        if n:
+            out = await self._crypt(bytes(self._buffer[:n]), False)
+            del self._buffer[:n]
+            self._writer.write(out)
+        await self._writer.drain()
+
+    async def close(self):
+        """Encrypt what is left, padding it if the mode needs whole blocks, and close the writer"""
+        if self._mode.padded:
+            pad = 16 - len(self._buffer) % 16
+            self._buffer += bytearray([pad] * pad)
+        if self._buffer:
+            self._writer.write(await self._crypt(bytes(self._buffer), False))
+            self._buffer = bytearray()
+        self._writer.close()
+        await self._writer.wait_closed()
+
+class DecryptingReader(_AsyncCipher):
+    """Decrypt data read from an asyncio.StreamReader"""
+
+    def __init__(self, reader, mode, executor=None, inline_limit=1 << 14, chunk_size=1 << 16):
+        """mode is a keyed CipherMode with its IV set, used only by this reader"""
+        _AsyncCipher.__init__(self, mode, executor, inline_limit)
+        self._reader = reader
+        self._chunk_size = chunk_size
+        self._pending = bytearray()
+        self._eof = False
+
+    async def read(self):
+        """Return the plaintext of the next ciphertext received, b'' at EOF"""
+        while not self._eof:
+            data = await self._reader.read(self._chunk_size)
+            self._pending += data
+            self._eof = not data
+            n = len(self._pending)
+            if self._eof:
+                if self._mode.padded and n % 16:
+                    raise ValueError('ciphertext length is not a multiple of 16')
+            elif not hasattr(self._mode, 'seek'):
+                #Hold back the partial block, and padded modes the last whole block, until EOF
+                n -= n % 16
+                if self._mode.padded and n == len(self._pending):
+                    n -= 16
+            if not n:
+                continue
+            plaintext = await self._crypt(bytes(self._pending[:n]), True)
+            del self._pending[:n]
+            if self._eof and self._mode.padded:
+                pad = bytearray(plaintext[-1:])[0]
+                if not 0 < pad <= 16 or plaintext[-pad:] != bytes(bytearray([pad] * pad)):
+                    raise ValueError('invalid padding')
+                plaintext = plaintext[:-pad]
+            if plaintext:
+                return plaintext
+        return b''
+
+    async def read_all(self):
+        """Read and decrypt to EOF"""
+        chunks = []
+        while True:
+            plaintext = await self.read()
+            if not plaintext:
+                return b''.join(chunks)
+            chunks.append(plaintext)
+
+import unittest
+class TestAsyncStreams(unittest.TestCase):
+    def get_mode(self, mode_class, iv):
+        try:
+            from aespython import key_expander, aes_ttable_cipher
+            from aespython.test_keys import TestKeys
+        except:
+            import key_expander, aes_ttable_cipher
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        mode = mode_class(aes_ttable_cipher.AESTTableCipher(expanded_key), 16)
+        mode.set_iv(iv)
+        return mode
+
+    def round_trip(self, mode_class, pieces, executor=None, inline_limit=1 << 14):
+        #Send pieces through a connected socket pair, returns the decrypted plaintext
+        import socket
+
+        async def run():
+            a, b = socket.socketpair()
+            out_reader, out_writer = await asyncio.open_connection(sock=a)
+            in_reader, in_writer = await asyncio.open_connection(sock=b)
+            writer = EncryptingWriter(out_writer, self.get_mode(mode_class, [3] * 16), executor, inline_limit)
+            reader = DecryptingReader(in_reader, self.get_mode(mode_class, [3] * 16), executor, inline_limit, 64)
+            read_task = asyncio.ensure_future(reader.read_all())
+            for piece in pieces:
+                await writer.write(piece)
+            await writer.close()
+            plaintext = await read_task
+            in_writer.close()
+            return plaintext
+
+        return asyncio.run(run())
+
+    def test_streams(self):
+        """Test CTR and CBC streams decrypt back to what was written, inline and in a thread pool"""
+        import os
+        try:
+            from aespython import ctr_mode, cbc_mode
+        except:
+            import ctr_mode, cbc_mode
+
+        pieces = [os.urandom(n) for n in (1, 15, 100, 0, 33, 500)]
+        for mode_class in ctr_mode.CTRMode, cbc_mode.CBCMode:
+            for inline_limit in 1 << 14, 0:
+                self.assertEqual(self.round_trip(mode_class, pieces, None, inline_limit), b''.join(pieces),
+                    msg=mode_class.name + ' inline_limit ' + str(inline_limit))
+
+    def test_process_pool(self):
+        """Test mode state survives the round trip through a process pool"""
+        import concurrent.futures
+        import os
+        try:
+            from aespython import cbc_mode
+        except:
+            import cbc_mode
+
+        pieces = [os.urandom(n) for n in (64, 48, 200)]
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            #Start the worker first, a worker forked later would hold the sockets open past close()
+            executor.submit(int).result()
+            self.assertEqual(self.round_trip(cbc_mode.CBCMode, pieces, executor, 0), b''.join(pieces))
+
+if __name__ == "__main__":
+    unittest.main()
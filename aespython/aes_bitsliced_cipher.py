@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+AES Block Cipher bitsliced over Python integers.
+
+A batch of N blocks is transposed so that each Python integer holds one bit position of one
+state byte for every block: bit b of slice (i, j) is bit j of byte i of block b. A round is then
+the same few thousand integer AND/XOR operations whatever N is, each working on all N blocks.
+SubBytes is the Boyar-Peralta boolean circuit of the sbox, InvSubBytes wraps it in the inverse
+affine transform, ShiftRows is a renaming of the byte slices and MixColumns is XORs between them.
+AddRoundKey XORs every slice with all ones or all zeros, as its round key bit is set or not.
+
+No table is indexed by key or data, so there are no secret dependent memory accesses, and every
+slice goes through the same operations whatever the key. Only useful
+where blocks do not depend on each other, e.g. ECB, counter keystreams and CBC/CFB decryption.
+Single block calls work, but are much slower than AESTTableCipher.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST FIPS-197 http://csrc.nist.gov/publications/fips/fips197/fips-197.pdf
+Sbox circuit per Boyar and Peralta, A depth-16 circuit for the AES S-box, http://eprint.iacr.org/2011/332
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+#Normally use relative import. In test mode use local import.
+try:
+    from . import key_expander
+except ValueError:
+    import key_expander
+
+#State byte 4*c+r is row r of column c. Byte slices feeding output byte i after ShiftRows or InvShiftRows
+_shift_rows = [i % 4 + 4 * ((i // 4 + i % 4) % 4) for i in range(16)]
+_i_shift_rows = [i % 4 + 4 * ((i // 4 - i % 4) % 4) for i in range(16)]
+
+def _sub_bytes (b, ones):
+    #Boyar-Peralta sbox circuit on the eight bit slices of one byte, least significant first.
+    #The circuit numbers bits from the most significant, x0 is bit 7 and s0 is output bit 7.
+    x7, x6, x5, x4, x3, x2, x1, x0 = b
+
+    #Top linear transformation
+    y14 = x3 ^ x5; y13 = x0 ^ x6; y9 = x0 ^ x3; y8 = x0 ^ x5
+    t0 = x1 ^ x2; y1 = t0 ^ x7; y4 = y1 ^ x3; y12 = y13 ^ y14
+    y2 = y1 ^ x0; y5 = y1 ^ x6; y3 = y5 ^ y8; t1 = x4 ^ y12
+    y15 = t1 ^ x5; y20 = t1 ^ x1; y6 = y15 ^ x7; y10 = y15 ^ t0
+    y11 = y20 ^ y9; y7 = x7 ^ y11; y17 = y10 ^ y11; y19 = y10 ^ y8
+    y16 = t0 ^ y11; y21 = y13 ^ y16; y18 = x0 ^ y16
+
+    #Shared nonlinear middle, inversion in GF(2^4)
+    t2 = y12 & y15; t3 = y3 & y6; t4 = t3 ^ t2; t5 = y4 & x7; t6 = t5 ^ t2
+    t7 = y13 & y16; t8 = y5 & y1; t9 = t8 ^ t7; t10 = y2 & y7; t11 = t10 ^ t7
+    t12 = y9 & y11; t13 = y14 & y17; t14 = t13 ^ t12; t15 = y8 & y10; t16 = t15 ^ t12
+    t17 = t4 ^ t14; t18 = t6 ^ t16; t19 = t9 ^ t14; t20 = t11 ^ t16
+    t21 = t17 ^ y20; t22 = t18 ^ y19; t23 = t19 ^ y21; t24 = t20 ^ y18
+    t25 = t21 ^ t22; t26 = t21 & t23; t27 = t24 ^ t26; t28 = t25 & t27; t29 = t28 ^ t22
+    t30 = t23 ^ t24; t31 = t22 ^ t26; t32 = t31 & t30; t33 = t32 ^ t24; t34 = t23 ^ t33
+    t35 = t27 ^ t33; t36 = t24 & t35; t37 = t36 ^ t34; t38 = t27 ^ t36; t39 = t29 & t38
+    t40 = t25 ^ t39; t41 = t40 ^ t37; t42 = t29 ^ t33; t43 = t29 ^ t40; t44 = t33 ^ t37; t45 = t42 ^ t41
+    z0 = t44 & y15; z1 = t37 & y6; z2 = t33 & x7; z3 = t43 & y16; z4 = t40 & y1; z5 = t29 & y7
+    z6 = t42 & y11; z7 = t45 & y17; z8 = t41 & y10; z9 = t44 & y12; z10 = t37 & y3; z11 = t33 & y4
+    z12 = t43 & y13; z13 = t40 & y5; z14 = t29 & y2; z15 = t42 & y9; z16 = t45 & y14; z17 = t41 & y8
+
+    #Bottom linear transformation, NOT is XOR with all ones
+    t46 = z15 ^ z16; t47 = z10 ^ z11; t48 = z5 ^ z13; t49 = z9 ^ z10; t50 = z2 ^ z12; t51 = z2 ^ z5
+    t52 = z7 ^ z8; t53 = z0 ^ z3; t54 = z6 ^ z7; t55 = z16 ^ z17; t56 = z12 ^ t48; t57 = t50 ^ t53
+    t58 = z4 ^ t46; t59 = z3 ^ t54; t60 = t46 ^ t57; t61 = z14 ^ t57; t62 = t52 ^ t58; t63 = t49 ^ t58
+    t64 = z4 ^ t59; t65 = t61 ^ t62; t66 = z1 ^ t63
+    s0 = t59 ^ t63; s6 = t56 ^ t62 ^ ones; s7 = t48 ^ t60 ^ ones; t67 = t64 ^ t65
+    s3 = t53 ^ t66; s4 = t51 ^ t66; s5 = t47 ^ t65; s1 = t64 ^ s3 ^ ones; s2 = t55 ^ t67 ^ ones
+    return [s7, s6, s5, s4, s3, s2, s1, s0]
+
+def _i_affine (b, ones):
+    #Inverse of the sbox affine transform, bit i is b(i+2) ^ b(i+5) ^ b(i+7) ^ bit i of 0x05
+    b0, b1, b2, b3, b4, b5, b6, b7 = b
+    return [b2 ^ b5 ^ b7 ^ ones, b3 ^ b6 ^ b0, b4 ^ b7 ^ b1 ^ ones, b5 ^ b0 ^ b2,
+        b6 ^ b1 ^ b3, b7 ^ b2 ^ b4, b0 ^ b3 ^ b5, b1 ^ b4 ^ b6]
+
+def _i_sub_bytes (b, ones):
+    #The sbox is an affine transform of field inversion, which is its own inverse,
+    #so the inverse sbox is the sbox between two inverse affine transforms
+    return _i_affine(_sub_bytes(_i_affine(b, ones), ones), ones)
+
+def _xtime (b):
+    #Multiply by x in GF(2^8), a shift with reduction by 0x1b
+    b0, b1, b2, b3, b4, b5, b6, b7 = b
+    return [b7, b0 ^ b7, b1, b2 ^ b7, b3 ^ b7, b4, b5, b6]
+
+def _mix_columns (state):
+    #Row r of a column becomes 2*a(r) ^ 3*a(r+1) ^ a(r+2) ^ a(r+3) = a(r) ^ total ^ xtime(a(r) ^ a(r+1))
+    result = []
+    for c in range(0, 16, 4):
+        column = state[c:c+4]
+        total = [w ^ x ^ y ^ z for w, x, y, z in zip(*column)]
+        for r in range(4):
+            a = column[r]
+            u = _xtime([x ^ y for x, y in zip(a, column[(r + 1) % 4])])
+            result.append([x ^ y ^ z for x, y, z in zip(a, total, u)])
+    return result
+
+def _i_mix_columns (state):
+    #InvMixColumns is MixColumns after multiplying each column by 4x^2 + 5:
+    #rows 0 and 2 gain 4*(a0 ^ a2), rows 1 and 3 gain 4*(a1 ^ a3)
+    result = []
+    for c in range(0, 16, 4):
+        a0, a1, a2, a3 = state[c:c+4]
+        u = _xtime(_xtime([x ^ y for x, y in zip(a0, a2)]))
+        v = _xtime(_xtime([x ^ y for x, y in zip(a1, a3)]))
+        result.append([x ^ y for x, y in zip(a0, u)])
+        result.append([x ^ y for x, y in zip(a1, v)])
+        result.append([x ^ y for x, y in zip(a2, u)])
+        result.append([x ^ y for x, y in zip(a3, v)])
+    return _mix_columns(result)
+
+def _transpose_masks (words):
+    #Masks for the three swap steps of _transpose, repeated for each 64 bit word
+    return tuple(int.from_bytes(pattern * (words * 8 // len(pattern)), 'little') for pattern in
+        (b'\xaa\x00', b'\xcc\xcc\x00\x00', b'\xf0\xf0\xf0\xf0\x00\x00\x00\x00'))
+
+def _transpose (x, masks):
+    #Transpose the 8x8 bit matrix in every 64 bit word of x at once, byte k bit j swaps with byte j bit k.
+    #Swaps 2x2 blocks, then 4x4 blocks of 2x2, then 8x8 of 4x4, per Hacker's Delight section 7-3.
+    m1, m2, m3 = masks
+    t = ((x >> 7) ^ x) & m1
+    x ^= t ^ (t << 7)
+    t = ((x >> 14) ^ x) & m2
+    x ^= t ^ (t << 14)
+    t = ((x >> 28) ^ x) & m3
+    return x ^ t ^ (t << 28)
+
+def _round_key_bits (expanded_key):
+    #For each round, bit j of byte i of its round key as 0 or -1, the AND mask selecting the slice
+    return tuple(tuple(tuple(-(expanded_key[16 * r + i] >> j & 1) for j in range(8)) for i in range(16))
+        for r in range(len(expanded_key) // 16))
+
+class AESBitslicedCipher:
+    """Perform AES cipher/decipher on batches of blocks bitsliced across Python integers"""
+
+    #Bytes processed per bitsliced pass, each slice integer holds batch_size // 16 bits
+    batch_size = 1 << 18
+
+    def __init__ (self, expanded_key):
+        #Store expanded key, and the bits of each round key as masks for AddRoundKey
+        #Bit positions are cached with the key schedule, so hot keys only pay for them once
+        self._expanded_key = expanded_key
+        self._round_keys = key_expander.schedule_cache.derived(expanded_key, 'bitsliced',
+            lambda: _round_key_bits(expanded_key))
+
+        #Number of rounds determined by expanded key length
+        self._Nr = int(len(expanded_key) / 16) - 1
+
+    def _add_round_key (self, state, r, ones):
+        #Every slice is XORed, with all ones where the key bit is set and zero otherwise
+        for byte, masks in zip(state, self._round_keys[r]):
+            for j in range(8):
+                byte[j] ^= ones & masks[j]
+
+    def _encrypt_state (self, state, ones):
+        self._add_round_key(state, 0, ones)
+        for r in range(1, self._Nr + 1):
+            state = [_sub_bytes(state[i], ones) for i in _shift_rows]
+            if r < self._Nr:
+                state = _mix_columns(state)
+            self._add_round_key(state, r, ones)
+        return state
+
+    def _decrypt_state (self, state, ones):
+        self._add_round_key(state, self._Nr, ones)
+        for r in range(self._Nr - 1, -1, -1):
+            state = [_i_sub_bytes(state[i], ones) for i in _i_shift_rows]
+            self._add_round_key(state, r, ones)
+            if r:
+                state = _i_mix_columns(state)
+        return state
+
+    def _crypt (self, data, function):
+        if len(data) % 16:
+            raise RuntimeError('data length ' + str(len(data)) + ' is not a multiple of 16')
+
+        from_bytes = int.from_bytes
+        out = bytearray()
+        for off in range(0, len(data), self.batch_size):
+            #Zero blocks pad the batch to a multiple of 8 blocks
+            chunk = bytes(data[off:off+self.batch_size])
+            chunk += bytes(-len(chunk) % 128)
+            blocks = len(chunk) // 16
+            masks = _transpose_masks(blocks // 8)
+            ones = (1 << blocks) - 1
+
+            #Byte i of every block, 8 blocks to a 64 bit word, transposed so byte j of each
+            #word holds bit j of its 8 blocks. Gathering byte j of every word gives the slice.
+            state = []
+            for i in range(16):
+                words = _transpose(from_bytes(chunk[i::16], 'little'), masks).to_bytes(blocks, 'little')
+                state.append([from_bytes(words[j::8], 'little') for j in range(8)])
+
+            state = function(state, ones)
+
+            #The transpose is its own inverse, the padding blocks fall off the end
+            result = bytearray(len(chunk))
+            words = bytearray(blocks)
+            for i in range(16):
+                for j, s in enumerate(state[i]):
+                    words[j::8] = s.to_bytes(blocks // 8, 'little')
+                result[i::16] = _transpose(from_bytes(words, 'little'), masks).to_bytes(blocks, 'little')
+            out += result[:min(self.batch_size, len(data) - off)]
+        return bytes(out)
+
+    def cipher_blocks (self, data):
+        """Perform AES block cipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        return self._crypt(data, self._encrypt_state)
+
+    def decipher_blocks (self, data):
+        """Perform AES block decipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        return self._crypt(data, self._decrypt_state)
+
+    def cipher_block (self, state):
+        """Perform AES block cipher on input"""
+        #PKCS7 Padding
+        state=state+[16-len(state)]*(16-len(state))
+        return list(bytearray(self.cipher_blocks(bytearray(state))))
+
+    def decipher_block (self, state):
+        """Perform AES block decipher on input"""
+        #null padding. Padding actually should not be needed here with valid input.
+        state=state+[0]*(16-len(state))
+        return list(bytearray(self.decipher_blocks(bytearray(state))))
+
+    def cipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block cipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.cipher_blocks(src[src_off:src_off+16])
+
+    def decipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block decipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.decipher_blocks(src[src_off:src_off+16])
+
+import unittest
+class TestBitslicedCipher(unittest.TestCase):
+    def test_sbox(self):
+        """Test the sbox circuits on all 256 byte values at once"""
+        try:
+            from . import aes_tables
+        except:
+            import aes_tables
+
+        #Slice j holds bit j of every byte value v at bit v
+        ones = (1 << 256) - 1
+        bits = [sum(((v >> j) & 1) << v for v in range(256)) for j in range(8)]
+        for circuit, table in (_sub_bytes, aes_tables.sbox), (_i_sub_bytes, aes_tables.i_sbox):
+            out = circuit(bits, ones)
+            self.assertEqual([sum(((out[j] >> v) & 1) << j for j in range(8)) for v in range(256)], list(table))
+
+    def test_cipher(self):
+        """Test bitsliced AES cipher with all key lengths"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+
+        for key_size in 128, 192, 256:
+            test_expanded_key = key_expander.KeyExpander(key_size).expand(test_data.test_key[key_size])
+            test_cipher = AESBitslicedCipher(test_expanded_key)
+            self.assertEqual(test_cipher.cipher_block(test_data.test_block_plaintext),
+                test_data.test_block_ciphertext_validated[key_size],
+                msg='Test %d bit cipher'%key_size)
+            self.assertEqual(test_cipher.decipher_block(test_data.test_block_ciphertext_validated[key_size]),
+                test_data.test_block_plaintext,
+                msg='Test %d bit decipher'%key_size)
+
+    def test_batch(self):
+        """Test bitsliced batches against the single block cipher"""
+        import os
+        try:
+            from . import test_keys, key_expander, aes_cipher
+        except:
+            import test_keys, key_expander, aes_cipher
+
+        test_data = test_keys.TestKeys()
+        test_expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        test_cipher = AESBitslicedCipher(test_expanded_key)
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, []))) + os.urandom(16 * 13)
+        ciphertext = test_cipher.cipher_blocks(plaintext)
+        self.assertEqual(ciphertext, aes_cipher.AESCipher(test_expanded_key).cipher_blocks(plaintext))
+        self.assertEqual(test_cipher.decipher_blocks(memoryview(ciphertext)), plaintext)
+        self.assertEqual(test_cipher.cipher_blocks(b''), b'')
+        self.assertRaises(RuntimeError, test_cipher.cipher_blocks, plaintext[:20])
+
+        #Inputs larger than one batch are split without changing the result
+        test_cipher.batch_size = 48
+        self.assertEqual(test_cipher.cipher_blocks(plaintext), ciphertext)
+        self.assertEqual(test_cipher.decipher_blocks(ciphertext), plaintext)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -122,6 +122,32 @@ class AESCipher:
         self._add_round_key(state, 0)
         return state
 
+    def cipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block cipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = bytearray(self.cipher_block(list(bytearray(src[src_off:src_off+16]))))
+
+    def decipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block decipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = bytearray(self.decipher_block(list(bytearray(src[src_off:src_off+16]))))
+
+    def cipher_blocks (self, data):
+        """Perform AES block cipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        if len(data) % 16:
+            raise RuntimeError('cipher_blocks(): data length ' + str(len(data)) + ' is not a multiple of 16')
+        out = bytearray(len(data))
+        for off in range(0, len(data), 16):
+            self.cipher_block_into(data, off, out, off)
+        return bytes(out)
+
+    def decipher_blocks (self, data):
+        """Perform AES block decipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        if len(data) % 16:
+            raise RuntimeError('decipher_blocks(): data length ' + str(len(data)) + ' is not a multiple of 16')
+        out = bytearray(len(data))
+        for off in range(0, len(data), 16):
+            self.decipher_block_into(data, off, out, off)
+        return bytes(out)
+
 import unittest
 class TestCipher(unittest.TestCase):
     def test_cipher(self):
@@ -147,5 +173,20 @@ class TestCipher(unittest.TestCase):
                 16,
                 msg='Test %d bit decipher'%key_size)
 
+    def test_cipher_into(self):
+        """Test AES cipher into bytes like buffers"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+        test_cipher = AESCipher(key_expander.KeyExpander(128).expand(test_data.test_key[128]))
+        out = bytearray(20)
+        test_cipher.cipher_block_into(bytes(bytearray(test_data.test_block_plaintext)), 0, memoryview(out), 4)
+        self.assertEqual(list(out[4:]), test_data.test_block_ciphertext_validated[128])
+        test_cipher.decipher_block_into(out, 4, out, 0)
+        self.assertEqual(list(out[:16]), test_data.test_block_plaintext)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
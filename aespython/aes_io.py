@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+"""
+io.RawIOBase wrappers that encrypt or decrypt a binary file object.
+
+AESWriter encrypts everything written to it, AESReader decrypts everything read from it. Both
+buffer internally and hand the mode whole chunks, so callers such as io.BufferedReader,
+shutil.copyfileobj, tarfile, gzip and zipfile stream through encryption in any sized pieces.
+Padded block modes (CBC, ECB) are PKCS7 padded on close and unpadded at end of file. CTR
+streams are seekable in both directions.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import io
+
+def _crypt(function, buf, n):
+    #Call function on the first n bytes of buf without copying them
+    view = memoryview(buf)[:n]
+    try:
+        return function(view)
+    finally:
+        view.release()
+
+class AESWriter(io.RawIOBase):
+    """Encrypt everything written into the binary file object raw"""
+
+    def __init__(self, raw, mode, chunk_size=1 << 16, close_raw=False):
+        """
+            mode is a keyed CipherMode with its IV set. Data is encrypted chunk_size bytes at a time.
+            The final partial block is encrypted, and padded for padded modes, when the writer is closed.
+        """
+        io.RawIOBase.__init__(self)
+        if chunk_size <= 0 or chunk_size % 16:
+            raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+        self._raw = raw
+        self._mode = mode
+        self._chunk_size = chunk_size
+        self._close_raw = close_raw
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return hasattr(self._mode, 'seek') and self._raw.seekable()
+
+    def _encrypt(self, n):
+        if n:
+            self._raw.write(_crypt(self._mode.encrypt, self._buffer, n))
+            del self._buffer[:n]
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError('write to closed file')
+        self._buffer += b
+        if len(self._buffer) >= self._chunk_size:
+            self._encrypt(len(self._buffer) - len(self._buffer) % 16)
+        n = len(memoryview(b).cast('B'))
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move to a plaintext offset, only for modes that can seek such as CTR"""
+        if not self.seekable():
+            raise io.UnsupportedOperation('seek')
+        #CTR encrypts any length, so everything buffered can go out now
+        self._encrypt(len(self._buffer))
+        base = self._raw.tell() - self._position
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._raw.seek(0, io.SEEK_END) - base
+        self._raw.seek(base + offset)
+        self._mode.seek(offset)
+        self._position = offset
+        return offset
+
+    def close(self):
+        """Encrypt what is left, padding it if the mode needs whole blocks, and close"""
+        if self.closed:
+            return
+        try:
+            if self._mode.padded:
+                pad = 16 - len(self._buffer) % 16
+                self._buffer += bytearray([pad] * pad)
+            self._encrypt(len(self._buffer))
+            self._raw.flush()
+            if self._close_raw:
+                self._raw.close()
+        finally:
+            io.RawIOBase.close(self)
+
+class AESReader(io.RawIOBase):
+    """Decrypt everything read from the binary file object raw"""
+
+    def __init__(self, raw, mode, chunk_size=1 << 16, close_raw=False):
+        """
+            mode is a keyed CipherMode with its IV set. Ciphertext starts at the current position of raw
+            and is decrypted chunk_size bytes at a time. Padded modes are unpadded at end of file.
+        """
+        io.RawIOBase.__init__(self)
+        if chunk_size <= 0 or chunk_size % 16:
+            raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+        self._raw = raw
+        self._mode = mode
+        self._chunk_size = chunk_size
+        self._close_raw = close_raw
+        self._base = raw.tell() if hasattr(mode, 'seek') and raw.seekable() else 0
+        self._pending = bytearray()
+        self._plaintext = b''
+        self._offset = 0
+        self._position = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return hasattr(self._mode, 'seek') and self._raw.seekable()
+
+    def _read_chunk(self):
+        #Fill a whole chunk so only the last one can be short, even on pipes and sockets
+        data = self._raw.read(self._chunk_size)
+        while data and len(data) < self._chunk_size:
+            more = self._raw.read(self._chunk_size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    def _fill(self):
+        #Decrypt the next chunk. Padded modes hold back the last block until end of file.
+        while not self._eof and self._offset >= len(self._plaintext):
+            data = self._read_chunk()
+            self._pending += data
+            self._eof = len(data) < self._chunk_size
+            if self._eof:
+                n = len(self._pending)
+                if self._mode.padded and n % 16:
+                    raise ValueError('ciphertext length ' + str(n) + ' is not a multiple of 16')
+            else:
+                n = len(self._pending) - len(self._pending) % 16
+                if self._mode.padded and n == len(self._pending):
+                    n -= 16
+            plaintext = _crypt(self._mode.decrypt, self._pending, n) if n else b''
+            del self._pending[:n]
+            if self._eof and self._mode.padded and plaintext:
+                pad = bytearray(plaintext[-1:])[0]
+                if not 0 < pad <= 16 or plaintext[-pad:] != bytes(bytearray([pad] * pad)):
+                    raise ValueError('invalid padding')
+                plaintext = plaintext[:-pad]
+            self._plaintext = plaintext
+            self._offset = 0
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('read from closed file')
+        #Fill b across chunk boundaries, so only a read at end of file comes up short
+        out = memoryview(b).cast('B')
+        n = 0
+        while n < len(out):
+            self._fill()
+            count = min(len(out) - n, len(self._plaintext) - self._offset)
+            if not count:
+                break
+            out[n:n+count] = self._plaintext[self._offset:self._offset+count]
+            self._offset += count
+            n += count
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move to a plaintext offset, only for modes that can seek such as CTR"""
+        if not self.seekable():
+            raise io.UnsupportedOperation('seek')
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._raw.seek(0, io.SEEK_END) - self._base
+        if offset < 0:
+            raise ValueError('negative seek position ' + str(offset))
+        self._raw.seek(self._base + offset)
+        self._mode.seek(offset)
+        self._pending = bytearray()
+        self._plaintext = b''
+        self._offset = 0
+        self._position = offset
+        self._eof = False
+        return offset
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._close_raw:
+                self._raw.close()
+        finally:
+            io.RawIOBase.close(self)
+
+import unittest
+class TestAESIO(unittest.TestCase):
+    def get_mode(self, mode_class, iv):
+        try:
+            from aespython import key_expander, aes_ttable_cipher
+            from aespython.test_keys import TestKeys
+        except:
+            import key_expander, aes_ttable_cipher
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        mode = mode_class(aes_ttable_cipher.AESTTableCipher(expanded_key), 16)
+        mode.set_iv(iv)
+        return mode
+
+    def test_padded(self):
+        """Test CBC writer pads with PKCS7 and reader strips it, through copyfileobj and BufferedReader"""
+        import os
+        import shutil
+        try:
+            from aespython import cbc_mode
+        except:
+            import cbc_mode
+
+        iv = [7] * 16
+        for size in 0, 15, 16, 100, 1000:
+            plaintext = os.urandom(size)
+            padded = plaintext + bytes(bytearray([16 - size % 16] * (16 - size % 16)))
+            expected = self.get_mode(cbc_mode.CBCMode, iv).encrypt(padded)
+
+            out_file = io.BytesIO()
+            with AESWriter(out_file, self.get_mode(cbc_mode.CBCMode, iv), chunk_size=64) as writer:
+                shutil.copyfileobj(io.BytesIO(plaintext), writer, 7)
+            self.assertEqual(out_file.getvalue(), expected, msg='AESWriter size ' + str(size))
+
+            reader = io.BufferedReader(AESReader(io.BytesIO(expected), self.get_mode(cbc_mode.CBCMode, iv), chunk_size=32), 48)
+            self.assertEqual(reader.read(), plaintext, msg='AESReader size ' + str(size))
+
+        reader = AESReader(io.BytesIO(expected[:-1]), self.get_mode(cbc_mode.CBCMode, iv))
+        self.assertRaises(ValueError, reader.read)
+
+    def test_gzip(self):
+        """Test gzip streams through the wrappers"""
+        import gzip
+        try:
+            from aespython import ofb_mode
+        except:
+            import ofb_mode
+
+        plaintext = b'pythonaes ' * 500
+        out_file = io.BytesIO()
+        with AESWriter(out_file, self.get_mode(ofb_mode.OFBMode, [1] * 16), chunk_size=32) as writer:
+            with gzip.GzipFile(fileobj=writer, mode='wb') as gz:
+                gz.write(plaintext)
+
+        reader = AESReader(io.BytesIO(out_file.getvalue()), self.get_mode(ofb_mode.OFBMode, [1] * 16), chunk_size=32)
+        with gzip.GzipFile(fileobj=io.BufferedReader(reader), mode='rb') as gz:
+            self.assertEqual(gz.read(), plaintext)
+
+    def test_seek(self):
+        """Test CTR reader and writer seek to arbitrary offsets"""
+        import os
+        try:
+            from aespython import ctr_mode
+        except:
+            import ctr_mode
+
+        iv = [0xf0] * 16
+        plaintext = os.urandom(300)
+        expected = self.get_mode(ctr_mode.CTRMode, iv).encrypt(plaintext)
+
+        out_file = io.BytesIO()
+        out_file.write(b'HDR')
+        writer = AESWriter(out_file, self.get_mode(ctr_mode.CTRMode, iv), chunk_size=32)
+        writer.write(plaintext[:100])
+        writer.write(b'\0' * 200)
+        self.assertEqual(writer.seek(100), 100)
+        writer.write(plaintext[100:])
+        writer.close()
+        self.assertEqual(out_file.getvalue(), b'HDR' + expected)
+
+        in_file = io.BytesIO(b'HDR' + expected)
+        in_file.seek(3)
+        reader = AESReader(in_file, self.get_mode(ctr_mode.CTRMode, iv), chunk_size=32)
+        for offset in 250, 17, 0, 299:
+            reader.seek(offset)
+            self.assertEqual(reader.read(40), plaintext[offset:offset+40], msg='CTR seek ' + str(offset))
+        self.assertEqual(reader.seek(-10, io.SEEK_END), 290)
+        self.assertEqual(reader.read(), plaintext[290:])
+        self.assertEqual(reader.tell(), 300)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+AES Block Cipher vectorized with NumPy.
+
+Treats N independent blocks as an (N,4) array of 32 bit column words and runs every round
+once for the whole batch. ShiftRows is a fixed byte permutation, SubBytes and MixColumns are
+lookups into the T-tables built from the sbox and galois tables, and AddRoundKey is a broadcast
+XOR against the expanded key. Decryption uses the equivalent inverse cipher and Td tables.
+Only useful where blocks do not depend on each other, e.g. ECB, counter keystreams and
+CBC/CFB decryption. Single block calls work, but are slower than AESTTableCipher.
+
+Requires NumPy. Importing this module without NumPy works, creating an AESNumpyCipher does not.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST FIPS-197 http://csrc.nist.gov/publications/fips/fips197/fips-197.pdf
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#Normally use relative import. In test mode use local import.
+try:
+    from . import aes_tables, key_expander
+except ValueError:
+    import aes_tables, key_expander
+
+#Between rounds each block is four column words stored little endian, so row r of column c is byte 4*c+3-r.
+#Bytes feeding row k of output column c, after ShiftRows or InvShiftRows
+_shift_rows = [[4*((c+k) % 4) + 3-k for c in range(4)] for k in range(4)]
+_i_shift_rows = [[4*((c-k) % 4) + 3-k for c in range(4)] for k in range(4)]
+#Final round output in FIPS-197 byte order, byte 4*c+r
+_final_shift_rows = [4*((i//4 + i%4) % 4) + 3-i%4 for i in range(16)]
+_final_i_shift_rows = [4*((i//4 - i%4) % 4) + 3-i%4 for i in range(16)]
+
+def _schedules (expanded_key):
+    #Encryption and equivalent inverse cipher round keys as column word arrays, plus the final round keys as bytes
+    key_length = (len(expanded_key) // 16 - 7) * 32
+    inverse_key = key_expander.KeyExpander(key_length).expand_inverse(expanded_key)
+    return (numpy.frombuffer(bytes(bytearray(expanded_key)), dtype='>u4').astype('<u4').reshape(-1, 4),
+        numpy.frombuffer(bytes(bytearray(inverse_key)), dtype='>u4').astype('<u4').reshape(-1, 4),
+        numpy.array(expanded_key[-16:], dtype=numpy.uint8),
+        numpy.array(inverse_key[-16:], dtype=numpy.uint8))
+
+class AESNumpyCipher:
+    """Perform AES cipher/decipher on batches of blocks with NumPy"""
+
+    #Bytes processed per vectorized pass
+    batch_size = 1 << 18
+
+    def __init__ (self, expanded_key):
+        if numpy is None:
+            raise ImportError('AESNumpyCipher requires NumPy')
+
+        #Store expanded key, and both schedules as column words for broadcast XOR
+        #Arrays are cached with the key schedule, so hot keys only pay for them once
+        self._expanded_key = expanded_key
+        self._ek, self._dk, self._last_ek, self._last_dk = key_expander.schedule_cache.derived(
+            expanded_key, 'numpy', lambda: _schedules(expanded_key))
+
+        #Number of rounds determined by expanded key length
+        self._Nr = int(len(expanded_key) / 16) - 1
+
+        self._sbox = numpy.array(aes_tables.sbox, dtype=numpy.uint8)
+        self._i_sbox = numpy.array(aes_tables.i_sbox, dtype=numpy.uint8)
+        self._Te = [numpy.array(t, dtype='<u4') for t in (aes_tables.Te0, aes_tables.Te1, aes_tables.Te2, aes_tables.Te3)]
+        self._Td = [numpy.array(t, dtype='<u4') for t in (aes_tables.Td0, aes_tables.Td1, aes_tables.Td2, aes_tables.Td3)]
+
+    def _crypt (self, data, round_keys, tables, shift_rows, sbox, final_shift_rows, last_key):
+        if len(data) % 16:
+            raise RuntimeError('data length ' + str(len(data)) + ' is not a multiple of 16')
+
+        take = numpy.take
+        t0,t1,t2,t3 = tables
+        r0,r1,r2,r3 = shift_rows
+        data = memoryview(data)
+        out = bytearray(len(data))
+
+        #Large inputs are split so the working set of each batch stays in cache
+        for off in range(0, len(data), self.batch_size):
+            #Load blocks as big endian column words and apply the first AddRoundKey
+            chunk = data[off:off+self.batch_size]
+            state = numpy.frombuffer(chunk, dtype='>u4').astype('<u4').reshape(-1, 4) ^ round_keys[0]
+
+            #Each inner round is SubBytes, (Inv)ShiftRows and (Inv)MixColumns as four T-table lookups
+            #over the whole batch followed by a broadcast AddRoundKey
+            for i in range(1, self._Nr):
+                b = state.view(numpy.uint8)
+                state = take(t0, b[:, r0]) ^ take(t1, b[:, r1]) ^ take(t2, b[:, r2]) ^ take(t3, b[:, r3])
+                state ^= round_keys[i]
+
+            #Final round has no MixColumns, use the plain (inverse) sbox
+            state = take(sbox, state.view(numpy.uint8)[:, final_shift_rows]) ^ last_key
+            out[off:off+len(chunk)] = state.tobytes()
+        return bytes(out)
+
+    def cipher_blocks (self, data):
+        """Perform AES block cipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        return self._crypt(data, self._ek, self._Te, _shift_rows, self._sbox, _final_shift_rows, self._last_ek)
+
+    def decipher_blocks (self, data):
+        """Perform AES block decipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        #Equivalent inverse cipher, same shape as encryption with the decryption key schedule
+        return self._crypt(data, self._dk, self._Td, _i_shift_rows, self._i_sbox, _final_i_shift_rows, self._last_dk)
+
+    def cipher_block (self, state):
+        """Perform AES block cipher on input"""
+        #PKCS7 Padding
+        state=state+[16-len(state)]*(16-len(state))
+        return list(bytearray(self.cipher_blocks(bytearray(state))))
+
+    def decipher_block (self, state):
+        """Perform AES block decipher on input"""
+        #null padding. Padding actually should not be needed here with valid input.
+        state=state+[0]*(16-len(state))
+        return list(bytearray(self.decipher_blocks(bytearray(state))))
+
+    def cipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block cipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.cipher_blocks(src[src_off:src_off+16])
+
+    def decipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block decipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.decipher_blocks(src[src_off:src_off+16])
+
+import unittest
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestNumpyCipher(unittest.TestCase):
+    def test_cipher(self):
+        """Test NumPy AES cipher with all key lengths"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+
+        for key_size in 128, 192, 256:
+            test_expanded_key = key_expander.KeyExpander(key_size).expand(test_data.test_key[key_size])
+            test_cipher = AESNumpyCipher(test_expanded_key)
+            self.assertEqual(test_cipher.cipher_block(test_data.test_block_plaintext),
+                test_data.test_block_ciphertext_validated[key_size],
+                msg='Test %d bit cipher'%key_size)
+            self.assertEqual(test_cipher.decipher_block(test_data.test_block_ciphertext_validated[key_size]),
+                test_data.test_block_plaintext,
+                msg='Test %d bit decipher'%key_size)
+
+    def test_batch(self):
+        """Test NumPy batches against the single block cipher"""
+        try:
+            from . import test_keys, key_expander, aes_cipher
+        except:
+            import test_keys, key_expander, aes_cipher
+
+        test_data = test_keys.TestKeys()
+        test_expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        test_cipher = AESNumpyCipher(test_expanded_key)
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        ciphertext = test_cipher.cipher_blocks(plaintext)
+        self.assertEqual(ciphertext, aes_cipher.AESCipher(test_expanded_key).cipher_blocks(plaintext))
+        self.assertEqual(test_cipher.decipher_blocks(memoryview(ciphertext)), plaintext)
+        self.assertRaises(RuntimeError, test_cipher.cipher_blocks, plaintext[:20])
+
+        #Inputs larger than one batch are split without changing the result
+        test_cipher.batch_size = 32
+        self.assertEqual(test_cipher.cipher_blocks(plaintext), ciphertext)
+        self.assertEqual(test_cipher.decipher_blocks(ciphertext), plaintext)
+
+if __name__ == "__main__":
+    unittest.main()
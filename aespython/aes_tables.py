@@ -164,4 +164,20 @@ gal14=(
 0x37,0x39,0x2b,0x25,0x0f,0x01,0x13,0x1d,0x47,0x49,0x5b,0x55,0x7f,0x71,0x63,0x6d,
 0xd7,0xd9,0xcb,0xc5,0xef,0xe1,0xf3,0xfd,0xa7,0xa9,0xbb,0xb5,0x9f,0x91,0x83,0x8d)
 galI=gal14,gal11,gal13,gal9
-galNI=gal2,gal3,gal1,gal1
\ No newline at end of file
+galNI=gal2,gal3,gal1,gal1
+
+#32 bit word T-tables fusing SubBytes, ShiftRows and MixColumns for one state column.
+#Te0 holds the MixColumns column contribution of sbox[x] from row 0, Te1..Te3 are byte rotations of it.
+def _ror8(t):
+    return tuple((w>>8)|((w&0xff)<<24) for w in t)
+
+Te0=tuple(galNI[0][s]<<24|galNI[3][s]<<16|galNI[2][s]<<8|galNI[1][s] for s in sbox)
+Te1=_ror8(Te0)
+Te2=_ror8(Te1)
+Te3=_ror8(Te2)
+
+#Inverse T-tables for the equivalent inverse cipher, built from i_sbox and the InvMixColumns multipliers.
+Td0=tuple(galI[0][s]<<24|galI[3][s]<<16|galI[2][s]<<8|galI[1][s] for s in i_sbox)
+Td1=_ror8(Td0)
+Td2=_ror8(Td1)
+Td3=_ror8(Td2)
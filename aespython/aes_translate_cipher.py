@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+AES Block Cipher on batches of blocks with bytes.translate.
+
+Keeps a batch of N blocks in one byte string and runs every round as a few bulk operations on
+the whole batch, each a single loop in C. ShiftRows gathers the 16 byte positions with fixed
+stride slices. SubBytes and the MixColumns multiplications are bytes.translate through 256 byte
+tables, the sbox composed with the gal tables. MixColumns rotates the rows of each column by
+shifting the batch as one integer and XORs the terms, and AddRoundKey XORs that integer with the
+round key repeated N times. Decryption uses the equivalent inverse cipher, with the inverse sbox
+composed with gal14, gal11, gal13 and gal9.
+
+Needs only the standard library. Only useful where blocks do not depend on each other, e.g. ECB,
+counter keystreams and CBC/CFB decryption. Single block calls work, but are slower than
+AESTTableCipher.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST FIPS-197 http://csrc.nist.gov/publications/fips/fips197/fips-197.pdf
+Equivalent inverse cipher per FIPS-197 section 5.3.5
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import threading
+
+#Normally use relative import. In test mode use local import.
+try:
+    from . import aes_tables, key_expander
+except ValueError:
+    import aes_tables, key_expander
+
+#State byte 4*c+r is row r of column c. Source of output byte i after ShiftRows or InvShiftRows
+_shift_rows = [i % 4 + 4 * ((i // 4 + i % 4) % 4) for i in range(16)]
+_i_shift_rows = [i % 4 + 4 * ((i // 4 - i % 4) % 4) for i in range(16)]
+
+def _table (gal, sbox):
+    #Translation table of gal[sbox[x]], SubBytes and one MixColumns multiplication in one pass
+    return bytes(bytearray(gal[s] for s in sbox))
+
+#SubBytes times 1 and 2, and InvSubBytes times 1, 14, 11, 13 and 9
+_sb = _table(aes_tables.gal1, aes_tables.sbox)
+_sb2 = _table(aes_tables.gal2, aes_tables.sbox)
+_si = _table(aes_tables.gal1, aes_tables.i_sbox)
+_si14, _si11, _si13, _si9 = [_table(gal, aes_tables.i_sbox) for gal in aes_tables.galI]
+
+def _mix_terms (shifted):
+    #SubBytes of every byte times 2, 3, 1 and 1, the MixColumns terms. 3*s is 2*s ^ s, one translation fewer.
+    s2, s1 = [int.from_bytes(shifted.translate(t), 'little') for t in (_sb2, _sb)]
+    return s2, s2 ^ s1, s1, s1
+
+def _i_mix_terms (shifted):
+    #InvSubBytes of every byte times 14, 11, 13 and 9, the InvMixColumns terms
+    return [int.from_bytes(shifted.translate(t), 'little') for t in (_si14, _si11, _si13, _si9)]
+
+def _rotate_masks (blocks):
+    #For k = 1..3, masks of the low 4-k and high k bytes of every 32 bit column
+    return [(int.from_bytes((b'\xff' * (4 - k) + b'\x00' * k) * 4 * blocks, 'little'),
+        int.from_bytes((b'\x00' * (4 - k) + b'\xff' * k) * 4 * blocks, 'little')) for k in (1, 2, 3)]
+
+def _schedules (expanded_key):
+    #Encryption and equivalent inverse cipher round keys, 16 bytes per round
+    key_length = (len(expanded_key) // 16 - 7) * 32
+    inverse_key = key_expander.KeyExpander(key_length).expand_inverse(expanded_key)
+    return ([bytes(bytearray(expanded_key[i:i+16])) for i in range(0, len(expanded_key), 16)],
+        [bytes(bytearray(inverse_key[i:i+16])) for i in range(0, len(inverse_key), 16)])
+
+class AESTranslateCipher:
+    """Perform AES cipher/decipher on batches of blocks with bytes.translate"""
+
+    #Bytes processed per pass
+    batch_size = 1 << 16
+
+    def __init__ (self, expanded_key):
+        #Store expanded key, and both schedules as 16 byte round keys
+        #Schedules are cached with the key schedule, so hot keys only pay for them once
+        self._expanded_key = expanded_key
+        self._ek, self._dk = key_expander.schedule_cache.derived(expanded_key, 'translate',
+            lambda: _schedules(expanded_key))
+
+        #Number of rounds determined by expanded key length
+        self._Nr = int(len(expanded_key) / 16) - 1
+
+        #(decrypt, blocks) -> round keys repeated for a batch of blocks, and the rotation masks for it
+        #Guarded by _lock, one cipher may be shared by threads
+        self._repeated = {}
+        self._lock = threading.Lock()
+
+    def __getstate__ (self):
+        #Locks do not pickle, e.g. sending a mode to a worker process, and the cache is rebuilt on demand
+        state = self.__dict__.copy()
+        del state['_lock'], state['_repeated']
+        return state
+
+    def __setstate__ (self, state):
+        self.__dict__.update(state)
+        self._repeated = {}
+        self._lock = threading.Lock()
+
+    def _prepare (self, round_keys, blocks):
+        #Only a few batch lengths are in use at once, typically full batches and one short tail
+        key = (round_keys is self._dk, blocks)
+        with self._lock:
+            value = self._repeated.get(key)
+        if value is None:
+            #Build outside the lock, a racing thread may build the same value which is harmless
+            value = ([int.from_bytes(k * blocks, 'little') for k in round_keys], _rotate_masks(blocks))
+            with self._lock:
+                if len(self._repeated) >= 4:
+                    self._repeated.clear()
+                self._repeated[key] = value
+        return value
+
+    def _crypt (self, data, round_keys, shift_rows, mix_terms, sbox):
+        if len(data) % 16:
+            raise RuntimeError('data length ' + str(len(data)) + ' is not a multiple of 16')
+
+        from_bytes = int.from_bytes
+        out = bytearray()
+        for off in range(0, len(data), self.batch_size):
+            chunk = data[off:off+self.batch_size]
+            n = len(chunk)
+            keys, ((l1, h1), (l2, h2), (l3, h3)) = self._prepare(round_keys, n // 16)
+
+            state = (from_bytes(chunk, 'little') ^ keys[0]).to_bytes(n, 'little')
+            shifted = bytearray(n)
+            for r in range(1, self._Nr + 1):
+                #(Inv)ShiftRows, byte i of every block from byte shift_rows[i]
+                for i in range(16):
+                    shifted[i::16] = state[shift_rows[i]::16]
+                if r == self._Nr:
+                    #Final round has no MixColumns
+                    state = (from_bytes(shifted.translate(sbox), 'little') ^ keys[r]).to_bytes(n, 'little')
+                    break
+
+                #Row r of a column is the sum of terms a0..a3 taken from rows r..r+3 of the column.
+                #Moving every column's rows up by k is a shift of the whole batch by 8k bits.
+                a0, a1, a2, a3 = mix_terms(shifted)
+                state = (a0 ^ ((a1 >> 8) & l1) ^ ((a1 << 24) & h1) ^ ((a2 >> 16) & l2) ^ ((a2 << 16) & h2)
+                    ^ ((a3 >> 24) & l3) ^ ((a3 << 8) & h3) ^ keys[r]).to_bytes(n, 'little')
+            out += state
+        return bytes(out)
+
+    def cipher_blocks (self, data):
+        """Perform AES block cipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        return self._crypt(data, self._ek, _shift_rows, _mix_terms, _sb)
+
+    def decipher_blocks (self, data):
+        """Perform AES block decipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        #Equivalent inverse cipher, same shape as encryption with the decryption key schedule
+        return self._crypt(data, self._dk, _i_shift_rows, _i_mix_terms, _si)
+
+    def cipher_block (self, state):
+        """Perform AES block cipher on input"""
+        #PKCS7 Padding
+        state=state+[16-len(state)]*(16-len(state))
+        return list(bytearray(self.cipher_blocks(bytearray(state))))
+
+    def decipher_block (self, state):
+        """Perform AES block decipher on input"""
+        #null padding. Padding actually should not be needed here with valid input.
+        state=state+[0]*(16-len(state))
+        return list(bytearray(self.decipher_blocks(bytearray(state))))
+
+    def cipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block cipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.cipher_blocks(src[src_off:src_off+16])
+
+    def decipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block decipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.decipher_blocks(src[src_off:src_off+16])
+
+import unittest
+class TestTranslateCipher(unittest.TestCase):
+    def test_cipher(self):
+        """Test translate AES cipher with all key lengths"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+
+        for key_size in 128, 192, 256:
+            test_expanded_key = key_expander.KeyExpander(key_size).expand(test_data.test_key[key_size])
+            test_cipher = AESTranslateCipher(test_expanded_key)
+            self.assertEqual(test_cipher.cipher_block(test_data.test_block_plaintext),
+                test_data.test_block_ciphertext_validated[key_size],
+                msg='Test %d bit cipher'%key_size)
+            self.assertEqual(test_cipher.decipher_block(test_data.test_block_ciphertext_validated[key_size]),
+                test_data.test_block_plaintext,
+                msg='Test %d bit decipher'%key_size)
+
+    def test_batch(self):
+        """Test translate batches against the single block cipher"""
+        try:
+            from . import test_keys, key_expander, aes_cipher
+        except:
+            import test_keys, key_expander, aes_cipher
+
+        test_data = test_keys.TestKeys()
+        test_expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        test_cipher = AESTranslateCipher(test_expanded_key)
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        ciphertext = test_cipher.cipher_blocks(plaintext)
+        self.assertEqual(ciphertext, aes_cipher.AESCipher(test_expanded_key).cipher_blocks(plaintext))
+        self.assertEqual(test_cipher.decipher_blocks(memoryview(ciphertext)), plaintext)
+        self.assertEqual(test_cipher.cipher_blocks(b''), b'')
+        self.assertRaises(RuntimeError, test_cipher.cipher_blocks, plaintext[:20])
+
+        #Inputs larger than one batch are split without changing the result, the last batch is shorter
+        test_cipher.batch_size = 48
+        self.assertEqual(test_cipher.cipher_blocks(plaintext), ciphertext)
+        self.assertEqual(test_cipher.decipher_blocks(ciphertext), plaintext)
+
+    def test_threads(self):
+        """Test one cipher shared by threads with different batch lengths, and a pickled copy"""
+        import os, pickle, threading
+        try:
+            from . import key_expander
+        except:
+            import key_expander
+
+        test_cipher = AESTranslateCipher(key_expander.KeyExpander(256).expand(bytearray(os.urandom(32))))
+        plaintexts = [os.urandom(16 * n) for n in range(1, 9)]
+        expected = [test_cipher.cipher_blocks(p) for p in plaintexts]
+        errors = []
+        def run():
+            try:
+                for i in range(50):
+                    p = plaintexts[i % len(plaintexts)]
+                    if test_cipher.decipher_blocks(test_cipher.cipher_blocks(p)) != p:
+                        errors.append(i)
+            except Exception as err:
+                errors.append(err)
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+        copy = pickle.loads(pickle.dumps(test_cipher))
+        self.assertEqual([copy.cipher_blocks(p) for p in plaintexts], expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+AES Block Cipher using 32 bit word T-tables.
+
+Drop in replacement for AESCipher. Performs single block cipher decipher operations on a
+16 element list of integers. Internally the state is held as four 32 bit big endian words,
+one per column, and each round is a single pass of fused SubBytes, ShiftRows and MixColumns
+table lookups followed by the round key XOR.
+
+Decryption uses the equivalent inverse cipher, so it has the same round shape as encryption
+with inverse tables and a decryption key schedule from KeyExpander.expand_inverse.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST FIPS-197 http://csrc.nist.gov/publications/fips/fips197/fips-197.pdf
+Equivalent inverse cipher per FIPS-197 section 5.3.5
+Table driven round per section 5.2.1 of The Design of Rijndael, Daemen and Rijmen.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import struct
+
+#Normally use relative import. In test mode use local import.
+try:
+    from . import aes_tables, key_expander
+except ValueError:
+    import aes_tables, key_expander
+
+#A 16 byte block viewed as four big endian 32 bit column words
+_block = struct.Struct('>4I')
+
+def _words (byte_list):
+    #Pack a list of bytes into a tuple of big endian 32 bit words
+    return struct.unpack('>%dI' % (len(byte_list) // 4), bytearray(byte_list))
+
+def _schedules (expanded_key):
+    #Encryption and equivalent inverse cipher decryption round keys as words
+    key_length = (len(expanded_key) // 16 - 7) * 32
+    return _words(expanded_key), _words(key_expander.KeyExpander(key_length).expand_inverse(expanded_key))
+
+class AESTTableCipher:
+    """Perform single block AES cipher/decipher with 32 bit word T-tables"""
+
+    __slots__ = ('_expanded_key', '_ek', '_dk', '_Nr')
+
+    def __init__ (self, expanded_key):
+        #Store expanded key, both as bytes and as round key words
+        #Decryption round keys are for the equivalent inverse cipher
+        #Word forms are cached with the key schedule, so hot keys only pay for them once
+        self._expanded_key = expanded_key
+        self._ek, self._dk = key_expander.schedule_cache.derived(expanded_key, 'ttable', lambda: _schedules(expanded_key))
+
+        #Number of rounds determined by expanded key length
+        self._Nr = int(len(expanded_key) / 16) - 1
+
+    def _cipher_words (self, s0, s1, s2, s3):
+        #Encrypt a state held as four column words, returns the four resulting column words
+        Te0, Te1, Te2, Te3 = aes_tables.Te0, aes_tables.Te1, aes_tables.Te2, aes_tables.Te3
+        ek = self._ek
+
+        s0 ^= ek[0]
+        s1 ^= ek[1]
+        s2 ^= ek[2]
+        s3 ^= ek[3]
+
+        for k in range(4, self._Nr * 4, 4):
+            t0 = Te0[s0>>24] ^ Te1[s1>>16&255] ^ Te2[s2>>8&255] ^ Te3[s3&255] ^ ek[k]
+            t1 = Te0[s1>>24] ^ Te1[s2>>16&255] ^ Te2[s3>>8&255] ^ Te3[s0&255] ^ ek[k+1]
+            t2 = Te0[s2>>24] ^ Te1[s3>>16&255] ^ Te2[s0>>8&255] ^ Te3[s1&255] ^ ek[k+2]
+            s3 = Te0[s3>>24] ^ Te1[s0>>16&255] ^ Te2[s1>>8&255] ^ Te3[s2&255] ^ ek[k+3]
+            s0, s1, s2 = t0, t1, t2
+
+        #Final round has no MixColumns, use the plain sbox
+        sbox = aes_tables.sbox
+        k = self._Nr * 4
+        return (
+            (sbox[s0>>24]<<24 | sbox[s1>>16&255]<<16 | sbox[s2>>8&255]<<8 | sbox[s3&255]) ^ ek[k],
+            (sbox[s1>>24]<<24 | sbox[s2>>16&255]<<16 | sbox[s3>>8&255]<<8 | sbox[s0&255]) ^ ek[k+1],
+            (sbox[s2>>24]<<24 | sbox[s3>>16&255]<<16 | sbox[s0>>8&255]<<8 | sbox[s1&255]) ^ ek[k+2],
+            (sbox[s3>>24]<<24 | sbox[s0>>16&255]<<16 | sbox[s1>>8&255]<<8 | sbox[s2&255]) ^ ek[k+3])
+
+    def _decipher_words (self, s0, s1, s2, s3):
+        #Decrypt a state held as four column words, returns the four resulting column words
+        Td0, Td1, Td2, Td3 = aes_tables.Td0, aes_tables.Td1, aes_tables.Td2, aes_tables.Td3
+        dk = self._dk
+
+        s0 ^= dk[0]
+        s1 ^= dk[1]
+        s2 ^= dk[2]
+        s3 ^= dk[3]
+
+        for k in range(4, self._Nr * 4, 4):
+            t0 = Td0[s0>>24] ^ Td1[s3>>16&255] ^ Td2[s2>>8&255] ^ Td3[s1&255] ^ dk[k]
+            t1 = Td0[s1>>24] ^ Td1[s0>>16&255] ^ Td2[s3>>8&255] ^ Td3[s2&255] ^ dk[k+1]
+            t2 = Td0[s2>>24] ^ Td1[s1>>16&255] ^ Td2[s0>>8&255] ^ Td3[s3&255] ^ dk[k+2]
+            s3 = Td0[s3>>24] ^ Td1[s2>>16&255] ^ Td2[s1>>8&255] ^ Td3[s0&255] ^ dk[k+3]
+            s0, s1, s2 = t0, t1, t2
+
+        #Final round has no InvMixColumns, use the plain inverse sbox
+        i_sbox = aes_tables.i_sbox
+        k = self._Nr * 4
+        return (
+            (i_sbox[s0>>24]<<24 | i_sbox[s3>>16&255]<<16 | i_sbox[s2>>8&255]<<8 | i_sbox[s1&255]) ^ dk[k],
+            (i_sbox[s1>>24]<<24 | i_sbox[s0>>16&255]<<16 | i_sbox[s3>>8&255]<<8 | i_sbox[s2&255]) ^ dk[k+1],
+            (i_sbox[s2>>24]<<24 | i_sbox[s1>>16&255]<<16 | i_sbox[s0>>8&255]<<8 | i_sbox[s3&255]) ^ dk[k+2],
+            (i_sbox[s3>>24]<<24 | i_sbox[s2>>16&255]<<16 | i_sbox[s1>>8&255]<<8 | i_sbox[s0&255]) ^ dk[k+3])
+
+    def cipher_block (self, state):
+        """Perform AES block cipher on input"""
+        #PKCS7 Padding
+        state=state+[16-len(state)]*(16-len(state))
+
+        return list(bytearray(_block.pack(*self._cipher_words(*_block.unpack(bytearray(state))))))
+
+    def decipher_block (self, state):
+        """Perform AES block decipher on input"""
+        #null padding. Padding actually should not be needed here with valid input.
+        state=state+[0]*(16-len(state))
+
+        return list(bytearray(_block.pack(*self._decipher_words(*_block.unpack(bytearray(state))))))
+
+    def cipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block cipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        _block.pack_into(dst, dst_off, *self._cipher_words(*_block.unpack_from(src, src_off)))
+
+    def decipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block decipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        _block.pack_into(dst, dst_off, *self._decipher_words(*_block.unpack_from(src, src_off)))
+
+    def cipher_blocks (self, data):
+        """Perform AES block cipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        if len(data) % 16:
+            raise RuntimeError('cipher_blocks(): data length ' + str(len(data)) + ' is not a multiple of 16')
+        out = bytearray(len(data))
+        unpack_from, pack_into, cipher_words = _block.unpack_from, _block.pack_into, self._cipher_words
+        for off in range(0, len(data), 16):
+            pack_into(out, off, *cipher_words(*unpack_from(data, off)))
+        return bytes(out)
+
+    def decipher_blocks (self, data):
+        """Perform AES block decipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        if len(data) % 16:
+            raise RuntimeError('decipher_blocks(): data length ' + str(len(data)) + ' is not a multiple of 16')
+        out = bytearray(len(data))
+        unpack_from, pack_into, decipher_words = _block.unpack_from, _block.pack_into, self._decipher_words
+        for off in range(0, len(data), 16):
+            pack_into(out, off, *decipher_words(*unpack_from(data, off)))
+        return bytes(out)
+
+import unittest
+class TestTTableCipher(unittest.TestCase):
+    def test_tables(self):
+        """Test T-tables against sbox and galois tables"""
+        for x in 0, 1, 0x53, 0xff:
+            s = aes_tables.sbox[x]
+            self.assertEqual(aes_tables.Te0[x], aes_tables.gal2[s]<<24 | s<<16 | s<<8 | aes_tables.gal3[s])
+            self.assertEqual(aes_tables.Te3[x], s<<24 | s<<16 | aes_tables.gal3[s]<<8 | aes_tables.gal2[s])
+
+    def test_cipher(self):
+        """Test T-table AES cipher with all key lengths"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+
+        for key_size in 128, 192, 256:
+            test_key_expander = key_expander.KeyExpander(key_size)
+            test_expanded_key = test_key_expander.expand(test_data.test_key[key_size])
+            test_cipher = AESTTableCipher(test_expanded_key)
+            self.assertEqual(test_cipher.cipher_block(test_data.test_block_plaintext),
+                test_data.test_block_ciphertext_validated[key_size],
+                msg='Test %d bit cipher'%key_size)
+
+            self.assertEqual(test_cipher.decipher_block(test_data.test_block_ciphertext_validated[key_size]),
+                test_data.test_block_plaintext,
+                msg='Test %d bit decipher'%key_size)
+
+    def test_padding(self):
+        """Test T-table cipher pads short blocks like AESCipher"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+        test_expanded_key = key_expander.KeyExpander(256).expand(test_data.test_key[256])
+        try:
+            from . import aes_cipher
+        except:
+            import aes_cipher
+        short_block = test_data.test_block_plaintext[:5]
+        self.assertEqual(AESTTableCipher(test_expanded_key).cipher_block(short_block),
+            aes_cipher.AESCipher(test_expanded_key).cipher_block(short_block))
+        self.assertEqual(len(short_block), 5)
+
+    def test_cipher_into(self):
+        """Test T-table AES cipher into bytes like buffers, including in place"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+        test_cipher = AESTTableCipher(key_expander.KeyExpander(192).expand(test_data.test_key[192]))
+        out = bytearray(20)
+        test_cipher.cipher_block_into(bytes(bytearray(test_data.test_block_plaintext)), 0, memoryview(out), 4)
+        self.assertEqual(list(out[4:]), test_data.test_block_ciphertext_validated[192])
+        test_cipher.decipher_block_into(out, 4, out, 4)
+        self.assertEqual(list(out[4:]), test_data.test_block_plaintext)
+
+    def test_cipher_blocks(self):
+        """Test T-table batch interface against the single block cipher"""
+        try:
+            from . import test_keys, key_expander, aes_cipher
+        except:
+            import test_keys, key_expander, aes_cipher
+
+        test_data = test_keys.TestKeys()
+        test_expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        test_cipher = AESTTableCipher(test_expanded_key)
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        ciphertext = test_cipher.cipher_blocks(plaintext)
+        self.assertEqual(ciphertext, aes_cipher.AESCipher(test_expanded_key).cipher_blocks(plaintext))
+        self.assertEqual(test_cipher.decipher_blocks(memoryview(ciphertext)), plaintext)
+        self.assertRaises(RuntimeError, test_cipher.cipher_blocks, plaintext[:20])
+
+if __name__ == "__main__":
+    unittest.main()
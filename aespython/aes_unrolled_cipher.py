@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+AES Block Cipher with generated, fully unrolled T-table rounds.
+
+Same algorithm and state as AESTTableCipher, but the cipher and decipher functions are Python
+source generated for a round count (10, 12 or 14) with every round written out in straight line
+code, compiled once and cached per round count. The compiled code is a factory: calling it with
+the tables and the round key words at key setup returns functions with every round key and table
+bound as a closure variable. The hot path then runs no loop over rounds, no method calls and no
+attribute or global lookups.
+
+source(rounds, decrypt) returns the generated source, for reading or debugging.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST FIPS-197 http://csrc.nist.gov/publications/fips/fips197/fips-197.pdf
+Equivalent inverse cipher per FIPS-197 section 5.3.5
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import struct
+import threading
+
+#Normally use relative import. In test mode use local import.
+try:
+    from . import aes_tables, key_expander, aes_ttable_cipher
+except ValueError:
+    import aes_tables, key_expander, aes_ttable_cipher
+
+#A 16 byte block viewed as four big endian 32 bit column words
+_block = struct.Struct('>4I')
+
+#(rounds, decrypt) -> generated source and compiled factory
+_sources = {}
+_factories = {}
+_lock = threading.Lock()
+
+def _round (state, out, k, sbox_round, decrypt):
+    #One round from the four words named state into the four words named out, using round key words k..k+3.
+    #Decryption reads the columns in the opposite direction, as InvShiftRows moves rows the other way.
+    step = -1 if decrypt else 1
+    lines = []
+    for c in range(4):
+        a, b, d, e = [state[(c + step * i) % 4] for i in range(4)]
+        if sbox_round:
+            lines.append('%s = (S[%s>>24]<<24 | S[%s>>16&255]<<16 | S[%s>>8&255]<<8 | S[%s&255]) ^ k%d' % (out[c], a, b, d, e, k + c))
+        else:
+            lines.append('%s = T0[%s>>24] ^ T1[%s>>16&255] ^ T2[%s>>8&255] ^ T3[%s&255] ^ k%d' % (out[c], a, b, d, e, k + c))
+    return lines
+
+def _body (rounds, decrypt):
+    #Straight line rounds from words s0..s3 to words r0..r3, alternating between two sets of names
+    names = (('s0', 's1', 's2', 's3'), ('t0', 't1', 't2', 't3'))
+    lines = ['s%d ^= k%d' % (c, c) for c in range(4)]
+    for r in range(1, rounds):
+        lines += _round(names[(r - 1) % 2], names[r % 2], 4 * r, False, decrypt)
+    return lines + _round(names[(rounds - 1) % 2], ('r0', 'r1', 'r2', 'r3'), 4 * rounds, True, decrypt)
+
+def source (rounds, decrypt=False):
+    """Generated factory source for a round count, encryption or decryption"""
+    key = (rounds, decrypt)
+    with _lock:
+        if key not in _sources:
+            body = _body(rounds, decrypt)
+            keys = ', '.join('k%d' % i for i in range(4 * rounds + 4))
+            lines = ['def factory(T0, T1, T2, T3, S, iter_unpack, pack, %s):' % keys,
+                '    def words(s0, s1, s2, s3):']
+            lines += ['        ' + line for line in body]
+            lines += ['        return r0, r1, r2, r3',
+                '    def blocks(data):',
+                '        out = []',
+                '        extend = out.extend',
+                '        for s0, s1, s2, s3 in iter_unpack(data):']
+            lines += ['            ' + line for line in body]
+            lines += ['            extend((r0, r1, r2, r3))',
+                "        return pack('>%dI' % len(out), *out)",
+                '    return words, blocks',
+                '']
+            _sources[key] = '\n'.join(lines)
+        return _sources[key]
+
+def factory (rounds, decrypt=False):
+    """Compiled factory for a round count, encryption or decryption. Compiles on first use only."""
+    key = (rounds, decrypt)
+    if key not in _factories:
+        namespace = {}
+        exec(compile(source(rounds, decrypt), '<aes_unrolled_cipher %d rounds%s>' % (rounds, ' decrypt' if decrypt else ''), 'exec'), namespace)
+        with _lock:
+            _factories.setdefault(key, namespace['factory'])
+    return _factories[key]
+
+def _functions (expanded_key):
+    #(words, blocks) functions for encryption and decryption, bound to the key's round key words
+    ek, dk = key_expander.schedule_cache.derived(expanded_key, 'ttable', lambda: aes_ttable_cipher._schedules(expanded_key))
+    rounds = len(ek) // 4 - 1
+    return (factory(rounds, False)(aes_tables.Te0, aes_tables.Te1, aes_tables.Te2, aes_tables.Te3, aes_tables.sbox,
+            _block.iter_unpack, struct.pack, *ek),
+        factory(rounds, True)(aes_tables.Td0, aes_tables.Td1, aes_tables.Td2, aes_tables.Td3, aes_tables.i_sbox,
+            _block.iter_unpack, struct.pack, *dk))
+
+class AESUnrolledCipher:
+    """Perform single block AES cipher/decipher with generated, unrolled T-table rounds"""
+
+    def __init__ (self, expanded_key):
+        #Store expanded key, and the generated functions bound to its round keys
+        #Functions are cached with the key schedule, so hot keys only pay for them once
+        self._expanded_key = expanded_key
+        (self._cipher_words, self._cipher_blocks), (self._decipher_words, self._decipher_blocks) = \
+            key_expander.schedule_cache.derived(expanded_key, 'unrolled', lambda: _functions(expanded_key))
+
+        #Number of rounds determined by expanded key length
+        self._Nr = int(len(expanded_key) / 16) - 1
+
+    def __reduce__ (self):
+        #Generated functions do not pickle, rebuild them from the expanded key, e.g. in a worker process
+        return (AESUnrolledCipher, (self._expanded_key,))
+
+    def cipher_block (self, state):
+        """Perform AES block cipher on input"""
+        #PKCS7 Padding
+        state=state+[16-len(state)]*(16-len(state))
+
+        return list(bytearray(_block.pack(*self._cipher_words(*_block.unpack(bytearray(state))))))
+
+    def decipher_block (self, state):
+        """Perform AES block decipher on input"""
+        #null padding. Padding actually should not be needed here with valid input.
+        state=state+[0]*(16-len(state))
+
+        return list(bytearray(_block.pack(*self._decipher_words(*_block.unpack(bytearray(state))))))
+
+    def cipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block cipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        _block.pack_into(dst, dst_off, *self._cipher_words(*_block.unpack_from(src, src_off)))
+
+    def decipher_block_into (self, src, src_off, dst, dst_off):
+        """Perform AES block decipher on src[src_off:src_off+16], writing the result into dst at dst_off"""
+        _block.pack_into(dst, dst_off, *self._decipher_words(*_block.unpack_from(src, src_off)))
+
+    def cipher_blocks (self, data):
+        """Perform AES block cipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        if len(data) % 16:
+            raise RuntimeError('cipher_blocks(): data length ' + str(len(data)) + ' is not a multiple of 16')
+        return self._cipher_blocks(data)
+
+    def decipher_blocks (self, data):
+        """Perform AES block decipher on every 16 byte block of a bytes like buffer, returns bytes"""
+        if len(data) % 16:
+            raise RuntimeError('decipher_blocks(): data length ' + str(len(data)) + ' is not a multiple of 16')
+        return self._decipher_blocks(data)
+
+import unittest
+class TestUnrolledCipher(unittest.TestCase):
+    def test_cipher(self):
+        """Test unrolled AES cipher with all key lengths"""
+        try:
+            from . import test_keys, key_expander
+        except:
+            import test_keys, key_expander
+
+        test_data = test_keys.TestKeys()
+
+        for key_size in 128, 192, 256:
+            test_expanded_key = key_expander.KeyExpander(key_size).expand(test_data.test_key[key_size])
+            test_cipher = AESUnrolledCipher(test_expanded_key)
+            self.assertEqual(test_cipher.cipher_block(test_data.test_block_plaintext),
+                test_data.test_block_ciphertext_validated[key_size],
+                msg='Test %d bit cipher'%key_size)
+            self.assertEqual(test_cipher.decipher_block(test_data.test_block_ciphertext_validated[key_size]),
+                test_data.test_block_plaintext,
+                msg='Test %d bit decipher'%key_size)
+
+    def test_batch(self):
+        """Test unrolled batches and single blocks into buffers against the T-table cipher"""
+        import os
+        try:
+            from . import key_expander
+        except:
+            import key_expander
+
+        for key_size in 128, 192, 256:
+            test_expanded_key = key_expander.KeyExpander(key_size).expand(bytearray(os.urandom(key_size // 8)))
+            test_cipher = AESUnrolledCipher(test_expanded_key)
+            plaintext = os.urandom(16 * 9)
+            ciphertext = test_cipher.cipher_blocks(plaintext)
+            self.assertEqual(ciphertext, aes_ttable_cipher.AESTTableCipher(test_expanded_key).cipher_blocks(plaintext))
+            self.assertEqual(test_cipher.decipher_blocks(memoryview(ciphertext)), plaintext)
+            self.assertRaises(RuntimeError, test_cipher.cipher_blocks, plaintext[:20])
+
+            buf = bytearray(plaintext[:32])
+            test_cipher.cipher_block_into(buf, 16, buf, 16)
+            self.assertEqual(bytes(buf[16:]), ciphertext[16:32])
+            test_cipher.decipher_block_into(buf, 16, buf, 0)
+            self.assertEqual(bytes(buf[:16]), plaintext[16:32])
+
+    def test_pickle(self):
+        """Test an unrolled cipher survives a pickle round trip"""
+        import os, pickle
+        try:
+            from . import key_expander
+        except:
+            import key_expander
+
+        test_expanded_key = key_expander.KeyExpander(256).expand(bytearray(os.urandom(32)))
+        test_cipher = AESUnrolledCipher(test_expanded_key)
+        plaintext = os.urandom(16 * 3)
+        copy = pickle.loads(pickle.dumps(test_cipher))
+        self.assertEqual(copy._expanded_key, test_expanded_key)
+        self.assertEqual(copy.cipher_blocks(plaintext), test_cipher.cipher_blocks(plaintext))
+        self.assertEqual(copy.decipher_blocks(test_cipher.cipher_blocks(plaintext)), plaintext)
+
+    def test_source(self):
+        """Test generated code is compiled once per round count and has no loop over rounds"""
+        for rounds in 10, 12, 14:
+            self.assertIs(factory(rounds), factory(rounds))
+            self.assertIsNot(factory(rounds), factory(rounds, True))
+            text = source(rounds, True)
+            self.assertEqual(text.count('T0['), 2 * 4 * (rounds - 1))
+            self.assertIn('k%d' % (4 * rounds + 3), text)
+            self.assertEqual(text.count('for '), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""
+Benchmark suite.
+
+Times key expansion, single block cipher_block/decipher_block calls and bulk encrypt/decrypt of
+every mode, for each engine, key size and message size. Each measurement repeats the call until
+both a minimum number of calls and a minimum time are reached and reports calls/s, blocks/s,
+MB/s and per call latency percentiles.
+
+Results can be written as JSON and compared against a saved baseline: any measurement whose
+throughput dropped by more than the threshold is a regression and the run exits with status 1.
+
+ECB over random data is the cleanest measure of raw engine throughput, since it has no chaining
+and goes straight to each engine's batch interface; ecb_throughput gives that number alone.
+
+Running this file as __main__ runs the suite, -h lists the options. For example
+    python -m aespython.benchmark -m CBC,CTR -s 16,64K,64M -o new.json -c baseline.json -t 0.05
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import getopt
+import json
+import os
+import sys
+import time
+
+try:
+    from aespython import key_expander, aes_cipher, aes_ttable_cipher, aes_numpy_cipher, aes_bitsliced_cipher, aes_translate_cipher, aes_unrolled_cipher
+    from aespython import cbc_mode, cfb_mode, ofb_mode, ctr_mode, ecb_mode, xts_mode, gcm_mode
+except:
+    import key_expander, aes_cipher, aes_ttable_cipher, aes_numpy_cipher, aes_bitsliced_cipher, aes_translate_cipher, aes_unrolled_cipher
+    import cbc_mode, cfb_mode, ofb_mode, ctr_mode, ecb_mode, xts_mode, gcm_mode
+
+timer = getattr(time, 'perf_counter', time.time)
+
+MODES = ('ECB', 'CBC', 'CFB', 'OFB', 'CTR', 'XTS', 'GCM')
+KEY_SIZES = (128, 192, 256)
+SIZES = (16, 1 << 10, 1 << 16, 1 << 20)
+FULL_SIZES = (16, 1 << 8, 1 << 12, 1 << 16, 1 << 20, 1 << 24, 1 << 26)
+#Chained operations that make one block cipher call per block, and engines built only for batches.
+#A batch engine's cost per block on a chain is its single block latency, already measured by cipher_block.
+SERIAL_OPS = ('CBC encrypt', 'CFB encrypt', 'OFB encrypt', 'OFB decrypt')
+BATCH_ENGINES = ('AESBitslicedCipher', 'AESTranslateCipher')
+#Largest message size measured for engines slower than about 1 MB/s, larger sizes are skipped.
+#At FULL_SIZES they would otherwise spend minutes on every op.
+MAX_SIZES = {'AESCipher' : 1 << 20, 'AESTTableCipher' : 1 << 20, 'AESUnrolledCipher' : 1 << 20}
+
+def engines():
+    """Return (name, class) for every block cipher engine usable in this interpreter"""
+    result = [('AESCipher', aes_cipher.AESCipher), ('AESTTableCipher', aes_ttable_cipher.AESTTableCipher),
+        ('AESUnrolledCipher', aes_unrolled_cipher.AESUnrolledCipher),
+        ('AESBitslicedCipher', aes_bitsliced_cipher.AESBitslicedCipher), ('AESTranslateCipher', aes_translate_cipher.AESTranslateCipher)]
+    if aes_numpy_cipher.numpy is not None:
+        result.append(('AESNumpyCipher', aes_numpy_cipher.AESNumpyCipher))
+    return result
+
+def best_time(function, data, repeat=3):
+    """Best wall clock time in seconds of repeat calls of function(data)"""
+    best = None
+    for i in range(repeat):
+        start = timer()
+        function(data)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def ecb_throughput(engine, key_size=256, size=1 << 16, repeat=3):
+    """Return (encrypt, decrypt) throughput of ECBMode over size bytes of random data in MB/s"""
+    key = bytearray(os.urandom(key_size // 8))
+    mode = ecb_mode.ECBMode(engine(key_expander.KeyExpander(key_size).expand(key)), 16)
+    data = os.urandom(size)
+    return (size / best_time(mode.encrypt, data, repeat) / 1e6,
+        size / best_time(mode.decrypt, data, repeat) / 1e6)
+
+def percentile(sorted_times, p):
+    """Nearest rank percentile p of an ascending list"""
+    return sorted_times[min(len(sorted_times) - 1, max(0, int(-(-p * len(sorted_times) // 100)) - 1))]
+
+def measure(function, data, min_calls=3, min_time=0.2, max_calls=100000):
+    """Call function(data) at least min_calls times and for at least min_time seconds, returns the per call times"""
+    times = []
+    total = 0.0
+    while len(times) < min_calls or (total < min_time and len(times) < max_calls):
+        start = timer()
+        function(data)
+        elapsed = timer() - start
+        times.append(elapsed)
+        total += elapsed
+    return times
+
+def summarize(times, size):
+    """Statistics of per call times of size byte calls. Rates use the mean time."""
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    return {'calls' : len(times), 'mean' : mean, 'p50' : percentile(times, 50),
+        'p90' : percentile(times, 90), 'p99' : percentile(times, 99),
+        'calls_per_s' : 1 / mean if mean else 0.0,
+        'blocks_per_s' : size / 16.0 / mean if mean else 0.0,
+        'mb_per_s' : size / 1e6 / mean if mean else 0.0}
+
+def new_mode(name, engine, key_size):
+    """Return (encrypt, decrypt) bulk functions of mode name over a random key"""
+    def cipher():
+        return engine(key_expander.KeyExpander(key_size).expand(bytearray(os.urandom(key_size // 8))))
+
+    if name == 'XTS':
+        mode = xts_mode.XTSMode(cipher(), cipher())
+        return lambda data: mode.encrypt_sectors(0, data), lambda data: mode.decrypt_sectors(0, data)
+    if name == 'GCM':
+        mode = gcm_mode.GCMMode(cipher())
+        iv = os.urandom(12)
+        def decrypt(data):
+            mode.set_iv(iv)
+            mode.decrypt(data)
+            return mode.finalize()
+        return lambda data: mode.encrypt_and_digest(iv, data), decrypt
+    mode_class = {'ECB' : ecb_mode.ECBMode, 'CBC' : cbc_mode.CBCMode, 'CFB' : cfb_mode.CFBMode,
+        'OFB' : ofb_mode.OFBMode, 'CTR' : ctr_mode.CTRMode}[name]
+    mode = mode_class(cipher(), 16)
+    mode.set_iv(list(bytearray(os.urandom(16))))
+    return mode.encrypt, mode.decrypt
+
+def run_suite(engine_list=None, key_sizes=KEY_SIZES, sizes=SIZES, modes=MODES, min_calls=3, min_time=0.2, report=None):
+    """
+        Run every benchmark, returns a list of result dicts
+
+        Each result names the engine, op, key_size and size in bytes next to the statistics from
+        summarize. report, if given, is called with each result as soon as it is measured.
+        Sizes above an engine's MAX_SIZES entry are not measured for it.
+    """
+    if engine_list is None:
+        engine_list = engines()
+    results = []
+    def record(engine_name, op, key_size, size, times):
+        result = {'engine' : engine_name, 'op' : op, 'key_size' : key_size, 'size' : size}
+        result.update(summarize(times, size))
+        results.append(result)
+        if report is not None:
+            report(result)
+
+    for key_size in key_sizes:
+        key = bytearray(os.urandom(key_size // 8))
+        #The schedule cache would turn every call after the first into a lookup
+        expander = key_expander.KeyExpander(key_size, cache=None)
+        record('KeyExpander', 'expand', key_size, key_size // 8, measure(expander.expand, key, min_calls, min_time))
+
+        for engine_name, engine in engine_list:
+            block_cipher = engine(key_expander.KeyExpander(key_size).expand(key))
+            block = list(bytearray(os.urandom(16)))
+            record(engine_name, 'cipher_block', key_size, 16, measure(block_cipher.cipher_block, block, min_calls, min_time))
+            record(engine_name, 'decipher_block', key_size, 16, measure(block_cipher.decipher_block, block, min_calls, min_time))
+
+            for size in sizes:
+                if size > MAX_SIZES.get(engine_name, size):
+                    continue
+                data = os.urandom(size)
+                for name in modes:
+                    encrypt, decrypt = new_mode(name, engine, key_size)
+                    for op, function in (name + ' encrypt', encrypt), (name + ' decrypt', decrypt):
+                        if engine_name not in BATCH_ENGINES or op not in SERIAL_OPS:
+                            record(engine_name, op, key_size, size, measure(function, data, min_calls, min_time))
+    return results
+
+def result_id(result):
+    return '%s %s %d %d' % (result['engine'], result['op'], result['key_size'], result['size'])
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump({'python' : sys.version.split()[0], 'time' : time.time(), 'results' : results}, f, indent=1)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+def compare(results, baseline, threshold=0.1):
+    """
+        Compare results against baseline results on median calls/s, which shrugs off the odd stalled call
+
+        Returns (result_id, baseline calls/s, calls/s, ratio) for every measurement in both whose
+        median rate fell below (1 - threshold) times the baseline, worst first.
+    """
+    old = dict((result_id(r), 1 / r['p50']) for r in baseline if r['p50'])
+    regressions = []
+    for r in results:
+        base = old.get(result_id(r))
+        rate = 1 / r['p50'] if r['p50'] else 0.0
+        if base and rate < base * (1 - threshold):
+            regressions.append((result_id(r), base, rate, rate / base))
+    return sorted(regressions, key=lambda r: r[3])
+
+def print_result(result):
+    print('%-16s %-15s %3d %9d  %9.0f blocks/s %9.3f MB/s  p50 %9.1f us  p90 %9.1f us  p99 %9.1f us' % (
+        result['engine'], result['op'], result['key_size'], result['size'], result['blocks_per_s'],
+        result['mb_per_s'], result['p50'] * 1e6, result['p90'] * 1e6, result['p99'] * 1e6))
+
+def parse_size(text):
+    """Parse a byte count with an optional K, M or G suffix"""
+    text = text.strip().upper()
+    scale = {'K' : 1 << 10, 'M' : 1 << 20, 'G' : 1 << 30}.get(text[-1:], 1)
+    return int(text[:-1] if scale > 1 else text) * scale
+
+def usage():
+    print('benchmark.py usage:')
+    print('-e NAMES    or --engines=NAMES \t Comma separated engine names, default all available.')
+    print('-m MODES    or --modes=MODES \t Comma separated modes, default ' + ','.join(MODES) + '.')
+    print('-k BITS     or --keys=BITS \t Comma separated key sizes, default 128,192,256.')
+    print('-s SIZES    or --sizes=SIZES \t Comma separated message sizes, K/M suffixes allowed, default 16,1K,64K,1M.')
+    print('-f          or --full \t\t Message sizes 16 B to 64 MiB, engines slower than 1 MB/s stop at 1 MiB.')
+    print('-n CALLS    or --calls=CALLS \t Minimum calls per measurement, default 3.')
+    print('-T SECONDS  or --time=SECONDS \t Minimum time per measurement, default 0.2.')
+    print('-o FILE     or --out=FILE \t Write results as JSON.')
+    print('-c FILE     or --compare=FILE \t Compare median rates against baseline JSON, exit 1 on regression.')
+    print('-t RATIO    or --threshold=RATIO \t Allowed slowdown against the baseline, default 0.1.')
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv, 'he:m:k:s:fn:T:o:c:t:', ['help','engines=','modes=','keys=','sizes=','full',
+            'calls=','time=','out=','compare=','threshold='])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        return 2
+
+    engine_list = engines()
+    modes = MODES
+    key_sizes = KEY_SIZES
+    sizes = SIZES
+    min_calls = 3
+    min_time = 0.2
+    out_path = None
+    baseline_path = None
+    threshold = 0.1
+    for o, a in opts:
+        if o in ('-h','--help'):
+            usage()
+            return 0
+        elif o in ('-e','--engines'):
+            names = [n for n in a.split(',') if n]
+            available = [e[0] for e in engines()]
+            for n in names:
+                if n not in available:
+                    print('unknown engine', n + ', available:', ','.join(available))
+                    return 2
+            engine_list = [e for e in engines() if e[0] in names]
+        elif o in ('-m','--modes'):
+            modes = [m.upper() for m in a.split(',') if m]
+            for m in modes:
+                if m not in MODES:
+                    print('unknown mode', m)
+                    return 2
+        elif o in ('-k','--keys'):
+            key_sizes = [int(k) for k in a.split(',')]
+        elif o in ('-s','--sizes'):
+            sizes = [parse_size(s) for s in a.split(',')]
+        elif o in ('-f','--full'):
+            sizes = FULL_SIZES
+        elif o in ('-n','--calls'):
+            min_calls = int(a)
+        elif o in ('-T','--time'):
+            min_time = float(a)
+        elif o in ('-o','--out'):
+            out_path = a
+        elif o in ('-c','--compare'):
+            baseline_path = a
+        elif o in ('-t','--threshold'):
+            threshold = float(a)
+
+    results = run_suite(engine_list, key_sizes, sizes, modes, min_calls, min_time, print_result)
+    if out_path is not None:
+        save(results, out_path)
+    if baseline_path is not None:
+        regressions = compare(results, load(baseline_path), threshold)
+        for name, base, rate, ratio in regressions:
+            print('REGRESSION %-50s %12.1f -> %12.1f calls/s (%.0f%%)' % (name, base, rate, ratio * 100))
+        if regressions:
+            return 1
+        print('No regressions over', threshold * 100, '% against', baseline_path)
+    return 0
+
+import unittest
+class TestBenchmark(unittest.TestCase):
+    def test_suite(self):
+        """Test a minimal run covers every op and compares against itself and a faster baseline"""
+        results = run_suite([('AESTTableCipher', aes_ttable_cipher.AESTTableCipher)], (128,), (32,), MODES, 1, 0)
+        self.assertEqual(len(results), 1 + 2 + 2 * len(MODES))
+        self.assertEqual(compare(results, results), [])
+
+        faster = [dict(r) for r in results]
+        for r in faster:
+            r['p50'] /= 2
+        self.assertEqual(len(compare(results, faster, 0.1)), len(results))
+
+        #Batch engines skip the chained ops
+        results = run_suite([('AESBitslicedCipher', aes_bitsliced_cipher.AESBitslicedCipher)], (128,), (32,), MODES, 1, 0)
+        self.assertEqual(len(results), 1 + 2 + 2 * len(MODES) - len(SERIAL_OPS))
+
+    def test_stats(self):
+        """Test percentiles and size parsing"""
+        times = [i / 100.0 for i in range(1, 101)]
+        self.assertEqual([percentile(times, p) for p in (50, 90, 99, 100)], [0.5, 0.9, 0.99, 1.0])
+        self.assertEqual(summarize([0.5, 0.5], 32)['blocks_per_s'], 4.0)
+        self.assertEqual([parse_size(s) for s in ('16', '64K', '64M')], [16, 1 << 16, 1 << 26])
+
+    def test_limits(self):
+        """Test slow engines skip large sizes and unknown engine names are rejected"""
+        results = run_suite([('AESCipher', aes_cipher.AESCipher)], (128,), (1 << 26,), ('ECB',), 1, 0)
+        self.assertEqual([r['op'] for r in results], ['expand', 'cipher_block', 'decipher_block'])
+        self.assertEqual(main(['-e', 'AESTTableCipher,NoSuchCipher']), 2)
+
+if __name__ == "__main__":
+    sys.exit(main())
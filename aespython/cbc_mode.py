@@ -12,31 +12,112 @@ Licensed under the MIT license http://www.opensource.org/licenses/mit-license.ph
 __author__ = "Adam Newman"
 
 try:
-    from aespython.cipher_mode import CipherMode
+    from aespython.cipher_mode import CipherMode, block_struct, xor_bytes, decipher_blocks, cipher_into, decipher_into
     from aespython.mode_test import GeneralTestEncryptionMode
 except:
-    from cipher_mode import CipherMode
+    from cipher_mode import CipherMode, block_struct, xor_bytes, decipher_blocks, cipher_into, decipher_into
     from mode_test import GeneralTestEncryptionMode
 
 class CBCMode(CipherMode):
     """Perform CBC operation on a block and retain IV information for next operation"""
     
     name = "CBC"
+    padded = True
+
+    __slots__ = ()
 
     def __init__(self, block_cipher, block_size):
         CipherMode.__init__(self, block_cipher, block_size)        
    
     def encrypt_block(self, plaintext):
         ciphertext = self._block_cipher.cipher_block([i ^ j for i,j in zip (plaintext, self._iv)])
-        self._iv = ciphertext
+        self._iv = self._iv_type(ciphertext)
         return ciphertext
     
     def decrypt_block(self, ciphertext):
         result_decipher = self._block_cipher.decipher_block(ciphertext)
         plaintext = [i ^ j for i,j in zip (self._iv, result_decipher)]
-        self._iv = ciphertext
+        self._iv = self._iv_type(ciphertext)
         return plaintext
 
+    def encrypt_block_into(self, src, src_off, dst, dst_off):
+        """Encrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        v0,v1,v2,v3 = block_struct.unpack(bytearray(self._iv))
+        p0,p1,p2,p3 = block_struct.unpack_from(src, src_off)
+        block_struct.pack_into(dst, dst_off, p0^v0, p1^v1, p2^v2, p3^v3)
+        cipher_into(self._block_cipher)(dst, dst_off, dst, dst_off)
+        self._iv = self._iv_type(bytearray(dst[dst_off:dst_off+16]))
+
+    def decrypt_block_into(self, src, src_off, dst, dst_off):
+        """Decrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        v0,v1,v2,v3 = block_struct.unpack(bytearray(self._iv))
+        self._iv = self._iv_type(bytearray(src[src_off:src_off+16]))
+        decipher_into(self._block_cipher)(src, src_off, dst, dst_off)
+        d0,d1,d2,d3 = block_struct.unpack_from(dst, dst_off)
+        block_struct.pack_into(dst, dst_off, d0^v0, d1^v1, d2^v2, d3^v3)
+
+    def encrypt(self, plaintext):
+        """Encrypt a bytes like buffer of one or more blocks, returns bytes"""
+        n = len(plaintext)
+        full = n - n % 16
+        #A trailing partial block is padded by the block cipher, so output is always whole blocks
+        out = bytearray(-(-n // 16) * 16)
+        unpack_from, pack_into = block_struct.unpack_from, block_struct.pack_into
+        cipher_block_into = cipher_into(self._block_cipher)
+        v0,v1,v2,v3 = block_struct.unpack(bytearray(self._iv))
+        for off in range(0, full, 16):
+            p0,p1,p2,p3 = unpack_from(plaintext, off)
+            pack_into(out, off, p0^v0, p1^v1, p2^v2, p3^v3)
+            cipher_block_into(out, off, out, off)
+            v0,v1,v2,v3 = unpack_from(out, off)
+        if full:
+            self._iv = self._iv_type(out[full-16:full])
+        if full < n:
+            out[full:] = bytearray(self.encrypt_block(list(bytearray(plaintext[full:]))))
+        return bytes(out)
+
+    def decrypt(self, ciphertext):
+        """Decrypt a bytes like buffer of one or more blocks, returns bytes"""
+        n = len(ciphertext)
+        full = n - n % 16
+        out = bytearray(-(-n // 16) * 16)
+        if full:
+            #No chaining dependency on decrypt, so all whole blocks go to the block cipher as one batch
+            #then plaintext i is decipher(C[i]) ^ C[i-1], with the IV standing in for C[-1]
+            ciphertext = memoryview(ciphertext)
+            chain = bytearray(self._iv) + ciphertext[:full-16]
+            out[:full] = xor_bytes(decipher_blocks(self._block_cipher, ciphertext[:full]), chain)
+            self._iv = self._iv_type(ciphertext[full-16:full].tobytes())
+        if full < n:
+            out[full:] = bytearray(self.decrypt_block(list(bytearray(ciphertext[full:]))))
+        return bytes(out)
+
+    def decrypt_range(self, in_file, iv, start, end, offset=0):
+        """
+            Decrypt plaintext bytes [start, end) of a CBC ciphertext in the seekable file in_file
+
+            iv is the IV the ciphertext was encrypted with and offset the file position of its
+            first block. Plaintext block i only needs ciphertext blocks i-1 and i, so only the
+            blocks covering the range and one predecessor are read. The mode's IV is unchanged.
+            Returns bytes, shorter than requested if end is past the end of the ciphertext.
+        """
+        if start < 0 or end <= start:
+            return b''
+        first, last = start // 16, (end - 1) // 16
+        if first:
+            in_file.seek(offset + (first - 1) * 16)
+            data = in_file.read((last - first + 2) * 16)
+            chain, ciphertext = data[:16], data[16:]
+        else:
+            in_file.seek(offset)
+            chain, ciphertext = bytes(bytearray(iv)), in_file.read((last + 1) * 16)
+        full = len(ciphertext) - len(ciphertext) % 16
+        if not full:
+            return b''
+        ciphertext = ciphertext[:full]
+        plaintext = xor_bytes(decipher_blocks(self._block_cipher, ciphertext), chain + ciphertext[:-16])
+        return plaintext[start - first * 16:end - first * 16]
+
 class TestEncryptionMode(GeneralTestEncryptionMode):
     def test_mode(self):
         """Test CBC Mode Encrypt/Decrypt"""        
@@ -50,6 +131,32 @@ class TestEncryptionMode(GeneralTestEncryptionMode):
         test_mode = CBCMode(self.get_keyed_cipher(test_data.test_mode_key), 16)        
         
         self.run_cipher(test_mode, test_data.test_mode_iv, test_data.test_cbc_ciphertext, test_data.test_mode_plaintext)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_cbc_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_cbc_ciphertext, test_data.test_mode_plaintext)
+
+        #Same results through an engine with only cipher_block and decipher_block
+        test_mode = CBCMode(self.get_unbatched_cipher(test_data.test_mode_key), 16)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_cbc_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_cbc_ciphertext, test_data.test_mode_plaintext)
+
+    def test_range(self):
+        """Test CBC random access decryption of byte ranges"""
+        import io
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        in_file = io.BytesIO(b'HEADER' + bytes(bytearray(sum(test_data.test_cbc_ciphertext, []))))
+
+        test_mode = CBCMode(self.get_keyed_cipher(test_data.test_mode_key), 16)
+        test_mode.set_iv(test_data.test_mode_iv)
+        for start, end in (0, 64), (0, 1), (5, 20), (16, 32), (31, 33), (40, 100), (63, 64), (70, 80):
+            self.assertEqual(test_mode.decrypt_range(in_file, test_data.test_mode_iv, start, end, 6), plaintext[start:end],
+                msg='CBC range ' + str(start) + ':' + str(end))
+        self.assertEqual(test_mode._iv, test_data.test_mode_iv)
 
 if __name__ == "__main__":
     import unittest
@@ -12,10 +12,10 @@ Licensed under the MIT license http://www.opensource.org/licenses/mit-license.ph
 __author__ = "Adam Newman"
 
 try:
-    from aespython.cipher_mode import CipherMode
+    from aespython.cipher_mode import CipherMode, block_struct, xor_bytes, cipher_blocks, cipher_into
     from aespython.mode_test import GeneralTestEncryptionMode
 except:
-    from cipher_mode import CipherMode
+    from cipher_mode import CipherMode, block_struct, xor_bytes, cipher_blocks, cipher_into
     from mode_test import GeneralTestEncryptionMode
 
 class CFBMode(CipherMode):
@@ -23,6 +23,8 @@ class CFBMode(CipherMode):
     
     name = "CFB"
 
+    __slots__ = ()
+
     def __init__(self, block_cipher, block_size):
         CipherMode.__init__(self, block_cipher, block_size)
     
@@ -38,6 +40,57 @@ class CFBMode(CipherMode):
         self._iv = ciphertext
         return plaintext
 
+    def encrypt_block_into(self, src, src_off, dst, dst_off):
+        """Encrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        p0,p1,p2,p3 = block_struct.unpack_from(src, src_off)
+        cipher_into(self._block_cipher)(bytearray(self._iv), 0, dst, dst_off)
+        k0,k1,k2,k3 = block_struct.unpack_from(dst, dst_off)
+        block_struct.pack_into(dst, dst_off, p0^k0, p1^k1, p2^k2, p3^k3)
+        self._iv = list(bytearray(dst[dst_off:dst_off+16]))
+
+    def decrypt_block_into(self, src, src_off, dst, dst_off):
+        """Decrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        c0,c1,c2,c3 = block_struct.unpack_from(src, src_off)
+        cipher_into(self._block_cipher)(bytearray(self._iv), 0, dst, dst_off)
+        k0,k1,k2,k3 = block_struct.unpack_from(dst, dst_off)
+        block_struct.pack_into(dst, dst_off, c0^k0, c1^k1, c2^k2, c3^k3)
+        self._iv = list(block_struct.pack(c0, c1, c2, c3))
+
+    def encrypt(self, plaintext):
+        """Encrypt a bytes like buffer of one or more blocks, returns bytes"""
+        n = len(plaintext)
+        full = n - n % 16
+        out = bytearray(n)
+        unpack_from, pack_into = block_struct.unpack_from, block_struct.pack_into
+        cipher_block_into = cipher_into(self._block_cipher)
+        #Feedback block is the previous ciphertext, which is already sitting in the output buffer
+        prev, prev_off = bytearray(self._iv), 0
+        for off in range(0, full, 16):
+            cipher_block_into(prev, prev_off, out, off)
+            k0,k1,k2,k3 = unpack_from(out, off)
+            p0,p1,p2,p3 = unpack_from(plaintext, off)
+            pack_into(out, off, p0^k0, p1^k1, p2^k2, p3^k3)
+            prev, prev_off = out, off
+        if full:
+            self._iv = list(out[full-16:full])
+        if full < n:
+            out[full:] = bytearray(self.encrypt_block(list(bytearray(plaintext[full:]))))
+        return bytes(out)
+
+    def decrypt(self, ciphertext):
+        """Decrypt a bytes like buffer of one or more blocks, returns bytes"""
+        n = len(ciphertext)
+        if not n:
+            return b''
+        #Feedback for block i is C[i-1], already known, so every block cipher call for the buffer
+        #is one batch E(IV || C[0..k-2]). A trailing partial block uses a truncated keystream block.
+        ciphertext = memoryview(ciphertext)
+        blocks = -(-n // 16)
+        feedback = bytearray(self._iv) + ciphertext[:(blocks - 1) * 16]
+        keystream = cipher_blocks(self._block_cipher, feedback)
+        self._iv = list(ciphertext[(blocks - 1) * 16:].tobytes())
+        return xor_bytes(ciphertext, memoryview(keystream)[:n])
+
 class TestEncryptionMode(GeneralTestEncryptionMode):
     def test_mode(self):
         """Test CBC Mode Encrypt/Decrypt"""        
@@ -51,6 +104,20 @@ class TestEncryptionMode(GeneralTestEncryptionMode):
         test_mode = CFBMode(self.get_keyed_cipher(test_data.test_mode_key), 16)        
         
         self.run_cipher(test_mode, test_data.test_mode_iv, test_data.test_cfb_ciphertext, test_data.test_mode_plaintext)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_cfb_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_cfb_ciphertext, test_data.test_mode_plaintext)
+        self.assertFalse(hasattr(test_mode, '__dict__'))
+
+        #Same results through an engine with only cipher_block and decipher_block
+        test_mode = CFBMode(self.get_unbatched_cipher(test_data.test_mode_key), 16)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_cfb_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_cfb_ciphertext, test_data.test_mode_plaintext)
+
+        #Batched decrypt of a stream ending in a partial block
+        test_mode.set_iv(test_data.test_mode_iv)
+        ciphertext = bytes(bytearray(sum(test_data.test_cfb_ciphertext, [])))
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        self.assertEqual(test_mode.decrypt(ciphertext[:16]) + test_mode.decrypt(ciphertext[16:37]), plaintext[:37])
 
 if __name__ == "__main__":
     import unittest
@@ -11,19 +11,86 @@ Licensed under the MIT license http://www.opensource.org/licenses/mit-license.ph
 """
 __author__ = "Adam Newman"
 
+import struct
+
+#A 16 byte block viewed as four big endian 32 bit words, used by modes to XOR whole blocks at once
+block_struct = struct.Struct('>4I')
+
+def xor_bytes(a, b):
+    """XOR two equal length bytes like buffers in one pass, returns bytes"""
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def _per_block(function, data):
+    #One list interface call per 16 byte block, for block ciphers without batch methods
+    if len(data) % 16:
+        raise RuntimeError('data length ' + str(len(data)) + ' is not a multiple of 16')
+    data = bytearray(data)
+    return b''.join([bytes(bytearray(function(list(data[i:i+16])))) for i in range(0, len(data), 16)])
+
+def _list_into(function):
+    #A block_into style function over the list interface, for block ciphers without buffer methods
+    def into(src, src_off, dst, dst_off):
+        dst[dst_off:dst_off+16] = bytearray(function(list(bytearray(src[src_off:src_off+16]))))
+    return into
+
+def cipher_into(block_cipher):
+    """Return block_cipher's cipher_block_into, or the same through its cipher_block if it has none"""
+    into = getattr(block_cipher, 'cipher_block_into', None)
+    if into is None:
+        return _list_into(block_cipher.cipher_block)
+    return into
+
+def decipher_into(block_cipher):
+    """Return block_cipher's decipher_block_into, or the same through its decipher_block if it has none"""
+    into = getattr(block_cipher, 'decipher_block_into', None)
+    if into is None:
+        return _list_into(block_cipher.decipher_block)
+    return into
+
+def cipher_blocks(block_cipher, data):
+    """Cipher every 16 byte block of a bytes like buffer, batched if block_cipher has cipher_blocks, returns bytes"""
+    batch = getattr(block_cipher, 'cipher_blocks', None)
+    if batch is None:
+        return _per_block(block_cipher.cipher_block, data)
+    return batch(data)
+
+def decipher_blocks(block_cipher, data):
+    """Decipher every 16 byte block of a bytes like buffer, batched if block_cipher has decipher_blocks, returns bytes"""
+    batch = getattr(block_cipher, 'decipher_blocks', None)
+    if batch is None:
+        return _per_block(block_cipher.decipher_block, data)
+    return batch(data)
+
 class CipherMode:
-    """Perform Cipher operation on a block and retain IV information for next operation"""
+    """
+        Perform Cipher operation on a block and retain IV information for next operation
+
+        Block ciphers used by modes provide cipher_block and decipher_block on lists. The buffer
+        methods cipher_block_into and decipher_block_into and the batch methods cipher_blocks and
+        decipher_blocks are optional: modes go through cipher_into(), decipher_into(),
+        cipher_blocks() and decipher_blocks() above, which fall back to the list interface.
+    """
 
     name = "ABSTRACT"
 
+    #True for block modes that must be padded to whole blocks, e.g. PKCS7 in the aes_io wrappers
+    padded = False
+
+    #Type the IV and chaining block are kept as, a list of ints for the list interface.
+    #Subclasses may keep bytes instead, the modes accept either.
+    _iv_type = list
+
+    #Subclasses without __slots__ of their own still get an instance __dict__
+    __slots__ = ('_block_cipher', '_block_size', '_iv')
+
     def __init__(self, block_cipher, block_size):
         self._block_cipher = block_cipher
         self._block_size = block_size
-        self._iv = [0] * block_size
+        self._iv = self._iv_type(bytearray(block_size))
 
     def set_iv(self, iv):
         if len(iv) == self._block_size:
-            self._iv = iv
+            self._iv = self._iv_type(bytearray(iv))
 
     def encrypt_block(self, plaintext):
         raise(NotImplementedError, "Abstract function")
@@ -31,4 +98,28 @@ class CipherMode:
     def decrypt_block(self, ciphertext):
         raise(NotImplementedError, "Abstract function")
 
+    def encrypt_block_into(self, src, src_off, dst, dst_off):
+        """Encrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        #Generic fallback through the list interface, modes override this
+        dst[dst_off:dst_off+self._block_size] = bytearray(self.encrypt_block(list(bytearray(src[src_off:src_off+self._block_size]))))
+
+    def decrypt_block_into(self, src, src_off, dst, dst_off):
+        """Decrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        dst[dst_off:dst_off+self._block_size] = bytearray(self.decrypt_block(list(bytearray(src[src_off:src_off+self._block_size]))))
+
+    def encrypt(self, plaintext):
+        """Encrypt a bytes like buffer of one or more blocks, returns bytes"""
+        #Generic fallback, modes override this with a tighter loop
+        data = bytearray(plaintext)
+        out = bytearray()
+        for i in range(0, len(data), self._block_size):
+            out.extend(self.encrypt_block(list(data[i:i+self._block_size])))
+        return bytes(out)
 
+    def decrypt(self, ciphertext):
+        """Decrypt a bytes like buffer of one or more blocks, returns bytes"""
+        data = bytearray(ciphertext)
+        out = bytearray()
+        for i in range(0, len(data), self._block_size):
+            out.extend(self.decrypt_block(list(data[i:i+self._block_size])))
+        return bytes(out)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Compact key schedules and cipher contexts, for keeping many keys and sessions alive at once.
+
+A KeySchedule holds the encryption and equivalent inverse cipher round keys of one key as two
+array('I') of 32 bit words and nothing else: no expanded byte list and no tuple of int objects.
+It is made once per key and shared by every context using the key. CompactCipher is the T-table
+engine reading its round keys from a schedule, and has no state of its own, so encrypting and
+decrypting contexts for a key can share one cipher as well. CompactCBCMode and CompactCTRMode
+are CBCMode and CTRMode holding their IV as bytes. Every class uses __slots__, so no object
+carries an instance __dict__. Nothing here touches the shared schedule cache: GCMMode over a
+CompactCipher builds its GHASH tables for the one context and does not cache them.
+
+Memory on 64 bit CPython 3.11, counting every object reachable from a context but not small ints,
+None and the shared tables:
+    KeySchedule, per key                  AES-128 about 560, AES-256 about 690 bytes
+    CompactCipher, per key                64 bytes
+    CompactCBCMode                        about 110 bytes, the mode and its 16 byte IV
+    CompactCTRMode                        about 170 bytes, also the counter and stream position
+against about 3.2 KB for a CBCMode over an AESCipher and about 7.5 KB over an AESTTableCipher,
+not counting the copy pinned in the shared schedule cache. footprint() measures any object.
+Reading round keys from an array makes CompactCipher about 30% slower than AESTTableCipher.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import array
+import sys
+
+try:
+    from aespython import key_expander, aes_ttable_cipher, cbc_mode, ctr_mode
+except:
+    import key_expander, aes_ttable_cipher, cbc_mode, ctr_mode
+
+#Smallest array type code holding a 32 bit word
+_word_type = 'I' if array.array('I').itemsize >= 4 else 'L'
+
+#Interned objects every context shares, not counted by footprint()
+_shared = set(id(i) for i in range(-5, 257)) | set([id(None), id(True), id(False)])
+
+def footprint(obj, seen=None):
+    """
+        Bytes of obj and every object reachable from it through slots, containers and arrays
+
+        Small ints, None and booleans are not counted, nor objects whose id is in seen, e.g. a
+        cipher shared with other contexts.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or id(obj) in _shared or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(footprint(k, seen) + footprint(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(footprint(x, seen) for x in obj)
+    elif not isinstance(obj, (bytes, bytearray, array.array, int, str)):
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                #Read the slot itself, a subclass may shadow it with a property
+                try:
+                    size += footprint(cls.__dict__[name].__get__(obj, cls), seen)
+                except AttributeError:
+                    pass
+        if hasattr(obj, '__dict__'):
+            size += footprint(obj.__dict__, seen)
+    return size
+
+class KeySchedule:
+    """Encryption and decryption round key words of one key, shared by every context using the key"""
+
+    __slots__ = ('ek', 'dk')
+
+    def __init__(self, key):
+        """key is 16, 24 or 32 bytes. The byte schedule is expanded outside the shared cache and dropped."""
+        expander = key_expander.KeyExpander(len(key) * 8, cache=None)
+        expanded_key = expander.expand(bytearray(key))
+        ek, dk = aes_ttable_cipher._schedules(expanded_key)
+        self.ek = array.array(_word_type, ek)
+        self.dk = array.array(_word_type, dk)
+
+    def cipher(self):
+        return CompactCipher(self)
+
+class CompactCipher(aes_ttable_cipher.AESTTableCipher):
+    """Perform AES cipher/decipher with T-tables on the round keys of a KeySchedule"""
+
+    __slots__ = ()
+
+    def __init__(self, schedule):
+        #No byte schedule is kept, so nothing derived from this cipher goes into the shared cache
+        self._expanded_key = None
+        self._ek = schedule.ek
+        self._dk = schedule.dk
+        self._Nr = len(schedule.ek) // 4 - 1
+
+class CompactCBCMode(cbc_mode.CBCMode):
+    """CBCMode holding its IV as bytes, with no instance __dict__"""
+
+    __slots__ = ()
+    _iv_type = bytes
+
+class CompactCTRMode(ctr_mode.CTRMode):
+    """CTRMode holding its initial counter block as bytes, with no instance __dict__"""
+
+    __slots__ = ()
+    _iv_type = bytes
+
+import unittest
+class TestCompact(unittest.TestCase):
+    def test_cipher(self):
+        """Test compact cipher against the known answers with all key lengths"""
+        try:
+            from aespython import test_keys
+        except:
+            import test_keys
+
+        test_data = test_keys.TestKeys()
+        for key_size in 128, 192, 256:
+            test_cipher = KeySchedule(bytearray(test_data.test_key[key_size])).cipher()
+            self.assertEqual(test_cipher.cipher_block(test_data.test_block_plaintext),
+                test_data.test_block_ciphertext_validated[key_size], msg='Test %d bit cipher'%key_size)
+            self.assertEqual(test_cipher.decipher_block(test_data.test_block_ciphertext_validated[key_size]),
+                test_data.test_block_plaintext, msg='Test %d bit decipher'%key_size)
+
+    def test_gcm(self):
+        """Test GCM over a compact cipher matches the T-table cipher and leaves the schedule cache alone"""
+        import os
+        try:
+            from aespython import gcm_mode
+        except:
+            import gcm_mode
+
+        key, iv, plaintext = os.urandom(32), os.urandom(12), os.urandom(40)
+        size = key_expander.schedule_cache.stats()['size']
+        mode = gcm_mode.GCMMode(KeySchedule(key).cipher())
+        mode.set_iv(iv)
+        result = mode.encrypt(plaintext) + mode.finalize()
+        self.assertEqual(key_expander.schedule_cache.stats()['size'], size)
+
+        mode = gcm_mode.GCMMode(aes_ttable_cipher.AESTTableCipher(key_expander.KeyExpander(256, cache=None).expand(bytearray(key))))
+        mode.set_iv(iv)
+        self.assertEqual(mode.encrypt(plaintext) + mode.finalize(), result)
+        key_expander.schedule_cache.purge(key)
+
+    def test_modes(self):
+        """Test compact CBC and CTR against the NIST vectors and the regular modes"""
+        try:
+            from aespython import test_keys, cbc_mode, ctr_mode
+        except:
+            import test_keys, cbc_mode, ctr_mode
+
+        test_data = test_keys.TestKeys()
+        test_cipher = KeySchedule(bytearray(test_data.test_mode_key)).cipher()
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        reference_cipher = aes_ttable_cipher.AESTTableCipher(key_expander.KeyExpander(256).expand(test_data.test_mode_key))
+        for compact_class, mode_class in (CompactCBCMode, cbc_mode.CBCMode), (CompactCTRMode, ctr_mode.CTRMode):
+            #An encrypting and a decrypting context sharing one cipher
+            encryptor, decryptor = compact_class(test_cipher, 16), compact_class(test_cipher, 16)
+            encryptor.set_iv(test_data.test_mode_iv)
+            decryptor.set_iv(bytes(bytearray(test_data.test_mode_iv)))
+            reference = mode_class(reference_cipher, 16)
+            reference.set_iv(test_data.test_mode_iv)
+            result = encryptor.encrypt(plaintext[:32]) + encryptor.encrypt(plaintext[32:])
+            self.assertEqual(result, reference.encrypt(plaintext), msg=compact_class.name)
+            self.assertEqual(decryptor.decrypt(result[:32]) + decryptor.decrypt(result[32:]), plaintext, msg=compact_class.name)
+
+            #Block at a time, as the list and buffer interfaces
+            decryptor.set_iv(test_data.test_mode_iv)
+            self.assertEqual(bytes(bytearray(decryptor.decrypt_block(list(bytearray(result[:16]))))), plaintext[:16])
+            buf = bytearray(result[16:32])
+            decryptor.decrypt_block_into(buf, 0, buf, 0)
+            self.assertEqual(bytes(buf), plaintext[16:32])
+
+        encryptor = CompactCBCMode(test_cipher, 16)
+        encryptor.set_iv(test_data.test_mode_iv)
+        self.assertEqual(encryptor.encrypt(plaintext), bytes(bytearray(sum(test_data.test_cbc_ciphertext, []))))
+
+    def test_footprint(self):
+        """Test compact objects have no __dict__ and stay within the documented sizes"""
+        import os
+
+        schedule = KeySchedule(os.urandom(32))
+        test_cipher = schedule.cipher()
+        mode = CompactCBCMode(test_cipher, 16)
+        mode.set_iv(os.urandom(16))
+        self.assertIs(type(mode._iv), bytes)
+        for obj in schedule, test_cipher, mode, CompactCTRMode(test_cipher, 16):
+            self.assertFalse(hasattr(obj, '__dict__'), msg=type(obj).__name__)
+        self.assertLess(footprint(schedule), 800)
+        self.assertLess(footprint(test_cipher, set([id(schedule.ek), id(schedule.dk)])), 100)
+        self.assertLess(footprint(mode, set([id(test_cipher)])), 160)
+        mode = CompactCTRMode(test_cipher, 16)
+        mode.set_iv(os.urandom(16))
+        mode.seek(1 << 40)
+        self.assertLess(footprint(mode, set([id(test_cipher)])), 220)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Chunked container format, version 2.
+
+The plaintext is split into chunk_size pieces and every chunk is encrypted independently in CBC
+mode with its own random IV, so chunks can be encrypted and decrypted in any order, across a
+process pool, and any byte range can be read without touching the rest of the file.
+
+Layout, all integers little endian:
+    header   magic 'PYAESCF' + version byte 2, flags byte, 3 reserved bytes,
+             32 byte salt (zero unless flags bit 0), 64 bit plaintext size,
+             32 bit chunk size, 32 bit CRC32 of the IV index, 32 bit CRC32 of the header
+    index    16 byte IV for each of size // chunk_size + 1 chunks
+    chunks   chunk i at data_offset + i * chunk_size. Every chunk but the last is chunk_size
+             bytes of plaintext; the last holds the remaining 0 to chunk_size - 1 bytes and is
+             PKCS7 padded, so it is 16 to chunk_size bytes of ciphertext.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import concurrent.futures
+import os
+import struct
+import zlib
+
+try:
+    from aespython import key_expander, aes_unrolled_cipher, cbc_mode, parallel, instrument
+except:
+    import key_expander, aes_unrolled_cipher, cbc_mode, parallel, instrument
+
+MAGIC = b'PYAESCF\x02'
+FLAG_SALT = 1
+
+header_struct = struct.Struct('<8sB3x32sQII')
+crc_struct = struct.Struct('<I')
+HEADER_SIZE = header_struct.size + crc_struct.size
+
+def is_container(prefix):
+    """True if the bytes at the start of a file are a version 2 container header"""
+    return bytes(prefix[:len(MAGIC)]) == MAGIC
+
+def chunk_count(size, chunk_size):
+    return size // chunk_size + 1
+
+def chunk_lengths(header):
+    """Ciphertext length of every chunk described by a header from read_header"""
+    last = header['size'] % header['chunk_size']
+    return [header['chunk_size']] * (len(header['ivs']) - 1) + [last - last % 16 + 16]
+
+def read_header(in_file):
+    """
+        Read and verify the header and IV index at the current position of in_file
+
+        Returns a dict of salt (None without a password), size, chunk_size, ivs and
+        data_offset, the file position of chunk 0.
+    """
+    start = in_file.tell()
+    data = in_file.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE or not is_container(data):
+        raise RuntimeError('read_header(): not a version 2 container')
+    if crc_struct.unpack_from(data, header_struct.size)[0] != zlib.crc32(data[:header_struct.size]) & 0xffffffff:
+        raise RuntimeError('read_header(): header checksum mismatch')
+    magic, flags, salt, size, chunk_size, index_crc = header_struct.unpack_from(data)
+    if chunk_size <= 0 or chunk_size % 16:
+        raise RuntimeError('read_header(): invalid chunk size ' + str(chunk_size))
+
+    #size is not covered by the index checksum yet, check the index fits in the file before reading it
+    index_size = 16 * chunk_count(size, chunk_size)
+    position = in_file.tell()
+    available = in_file.seek(0, os.SEEK_END) - position
+    in_file.seek(position)
+    if index_size > available:
+        raise RuntimeError('read_header(): IV index of ' + str(index_size) + ' bytes runs past the end of the file')
+    index = in_file.read(index_size)
+    if len(index) < index_size or zlib.crc32(index) & 0xffffffff != index_crc:
+        raise RuntimeError('read_header(): IV index checksum mismatch')
+    return {'salt' : salt if flags & FLAG_SALT else None, 'size' : size, 'chunk_size' : chunk_size,
+        'ivs' : [index[i:i+16] for i in range(0, len(index), 16)], 'data_offset' : start + HEADER_SIZE + len(index)}
+
+def write_header(out_file, size, chunk_size, ivs, salt=None):
+    """Write the header and IV index for a file of size plaintext bytes"""
+    index = b''.join(ivs)
+    header = header_struct.pack(MAGIC, FLAG_SALT if salt else 0, bytes(salt or bytes(32)), size, chunk_size,
+        zlib.crc32(index) & 0xffffffff)
+    out_file.write(header + crc_struct.pack(zlib.crc32(header) & 0xffffffff) + index)
+
+def _encrypt_chunk(ciphers, iv, plaintext, last):
+    #The last chunk is PKCS7 padded, every other chunk is whole blocks
+    if last:
+        pad = 16 - len(plaintext) % 16
+        plaintext = bytes(plaintext) + bytes(bytearray([pad] * pad))
+    mode = cbc_mode.CBCMode(ciphers[0], 16)
+    mode.set_iv(list(bytearray(iv)))
+    return mode.encrypt(plaintext)
+
+def _decrypt_chunk(ciphers, iv, ciphertext, last):
+    mode = cbc_mode.CBCMode(ciphers[1], 16)
+    mode.set_iv(list(bytearray(iv)))
+    plaintext = mode.decrypt(ciphertext)
+    if last:
+        pad = bytearray(plaintext[-1:])[0]
+        if not 0 < pad <= 16 or plaintext[-pad:] != bytes(bytearray([pad] * pad)):
+            raise RuntimeError('_decrypt_chunk(): invalid padding')
+        plaintext = plaintext[:-pad]
+    return plaintext
+
+def _new_ciphers(key, engine):
+    #CBC encryption is serial so it uses the unrolled T-table engine, decryption is batched
+    expanded_key = key_expander.KeyExpander(256).expand(bytearray(key))
+    return aes_unrolled_cipher.AESUnrolledCipher(expanded_key), engine(expanded_key)
+
+#Ciphers of the current worker process, created once by _init_worker
+_worker_ciphers = None
+
+def _init_worker(key, engine):
+    global _worker_ciphers
+    _worker_ciphers = _new_ciphers(key, engine)
+
+def _pool_encrypt_chunk(iv, plaintext, last):
+    return _encrypt_chunk(_worker_ciphers, iv, plaintext, last)
+
+def _pool_decrypt_chunk(iv, ciphertext, last):
+    return _decrypt_chunk(_worker_ciphers, iv, ciphertext, last)
+
+class ChunkedContainer:
+    """Encrypt and decrypt version 2 containers, in this process or with a pool of worker processes"""
+
+    def __init__(self, key, workers=1, chunk_size=1 << 20, engine=None):
+        """key is a 256 bit key. workers > 1 starts a process pool, chunk_size applies to new files."""
+        if chunk_size <= 0 or chunk_size % 16:
+            raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+        if engine is None:
+            engine = parallel.default_engine()
+        self._chunk_size = chunk_size
+        self._workers = workers
+        self._executor = None
+        if workers > 1:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                initializer=_init_worker, initargs=(bytes(bytearray(key)), engine))
+        else:
+            self._ciphers = _new_ciphers(key, engine)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self, decrypt, iv, data, last):
+        #Returns a future, already resolved when running in this process
+        if self._executor is not None:
+            return self._executor.submit(_pool_decrypt_chunk if decrypt else _pool_encrypt_chunk, iv, data, last)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result((_decrypt_chunk if decrypt else _encrypt_chunk)(self._ciphers, iv, data, last))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _read_exact(self, in_file, length):
+        with instrument.phase('ChunkedContainer.read', 'io_bytes_read') as io_phase:
+            data = in_file.read(length)
+            while len(data) < length:
+                more = in_file.read(length - len(data))
+                if not more:
+                    break
+                data += more
+            io_phase.add(len(data))
+        return data
+
+    def _run(self, decrypt, in_file, out_file, ivs, lengths):
+        #Submit chunks in order, keeping at most a few per worker in flight, and write results in order
+        pending = []
+        written = 0
+        for i, length in enumerate(lengths):
+            data = self._read_exact(in_file, length)
+            if len(data) != length:
+                raise RuntimeError('chunk ' + str(i) + ' is truncated')
+            pending.append(self._submit(decrypt, ivs[i], data, i == len(lengths) - 1))
+            while pending and (i == len(lengths) - 1 or len(pending) > 2 * self._workers):
+                data = pending.pop(0).result()
+                with instrument.phase('ChunkedContainer.write', 'io_bytes_written', len(data)):
+                    out_file.write(data)
+                written += len(data)
+        return written
+
+    def encrypt_file(self, in_file, out_file, size, salt=None):
+        """Encrypt size bytes from the current position of in_file into a new container, returns bytes written"""
+        count = chunk_count(size, self._chunk_size)
+        ivs = [os.urandom(16) for i in range(count)]
+        write_header(out_file, size, self._chunk_size, ivs, salt)
+        lengths = [self._chunk_size] * (count - 1) + [size % self._chunk_size]
+        written = self._run(False, in_file, out_file, ivs, lengths)
+        if in_file.read(1):
+            raise RuntimeError('encrypt_file(): input is longer than ' + str(size) + ' bytes')
+        return written
+
+    def decrypt_file(self, in_file, out_file, header=None):
+        """Decrypt a container into out_file. header is read from in_file unless given. Returns bytes written."""
+        if header is None:
+            header = read_header(in_file)
+        in_file.seek(header['data_offset'])
+        return self._run(True, in_file, out_file, header['ivs'], chunk_lengths(header))
+
+    def read_range(self, in_file, start, end, header=None):
+        """Return plaintext bytes [start, end) of a container, decrypting only the chunks covering them"""
+        if header is None:
+            header = read_header(in_file)
+        end = min(end, header['size'])
+        if start >= end:
+            return b''
+        chunk_size = header['chunk_size']
+        lengths = chunk_lengths(header)
+        first, last = start // chunk_size, (end - 1) // chunk_size
+        futures = []
+        for i in range(first, last + 1):
+            in_file.seek(header['data_offset'] + i * chunk_size)
+            futures.append(self._submit(True, header['ivs'][i], self._read_exact(in_file, lengths[i]), i == len(lengths) - 1))
+        data = b''.join(f.result() for f in futures)
+        return data[start - first * chunk_size:end - first * chunk_size]
+
+import unittest
+class TestChunkedContainer(unittest.TestCase):
+    def test_container(self):
+        """Test container round trip for sizes around chunk boundaries, in process and with workers"""
+        import io
+
+        key = bytearray(range(32))
+        for workers in 1, 2:
+            with ChunkedContainer(key, workers, chunk_size=64) as container:
+                for size in 0, 1, 63, 64, 65, 300:
+                    plaintext = os.urandom(size)
+                    out_file = io.BytesIO()
+                    container.encrypt_file(io.BytesIO(plaintext), out_file, size, b's' * 32)
+
+                    in_file = io.BytesIO(out_file.getvalue())
+                    header = read_header(in_file)
+                    self.assertEqual((header['salt'], header['size'], header['chunk_size']), (b's' * 32, size, 64))
+                    self.assertEqual(len(out_file.getvalue()), header['data_offset'] + sum(chunk_lengths(header)))
+
+                    result = io.BytesIO()
+                    self.assertEqual(container.decrypt_file(in_file, result, header), size)
+                    self.assertEqual(result.getvalue(), plaintext, msg='size ' + str(size) + ' workers ' + str(workers))
+                    for start, end in (0, 10), (60, 70), (5, 1000), (128, 129):
+                        self.assertEqual(container.read_range(in_file, start, end, header), plaintext[start:end])
+
+    def test_stats(self):
+        """Test chunk reads and writes are counted as I/O while instrumented"""
+        import io
+
+        with instrument.measure() as m:
+            with ChunkedContainer(bytearray(32), chunk_size=64) as container:
+                container.encrypt_file(io.BytesIO(bytes(100)), io.BytesIO(), 100)
+        self.assertEqual(m.stats['counters']['io_bytes_read'], 100)
+        self.assertEqual(m.stats['counters']['io_bytes_written'], 112)
+        self.assertEqual(m.stats['phases']['ChunkedContainer.write']['calls'], 2)
+
+    def test_header(self):
+        """Test corrupt headers and short input are rejected"""
+        import io
+
+        container = ChunkedContainer(bytearray(32), chunk_size=64)
+        out_file = io.BytesIO()
+        container.encrypt_file(io.BytesIO(b'x' * 100), out_file, 100)
+        data = out_file.getvalue()
+        self.assertTrue(is_container(data))
+        self.assertEqual(read_header(io.BytesIO(data))['salt'], None)
+        for pos in 0, 20, HEADER_SIZE + 3:
+            corrupt = bytearray(data)
+            corrupt[pos] ^= 1
+            self.assertRaises(RuntimeError, read_header, io.BytesIO(bytes(corrupt)))
+
+        #A huge size with a valid header checksum is refused before the index is read
+        header = header_struct.pack(MAGIC, 0, bytes(32), 1 << 40, 16, 0)
+        self.assertRaises(RuntimeError, read_header, io.BytesIO(header + crc_struct.pack(zlib.crc32(header) & 0xffffffff)))
+        self.assertRaises(RuntimeError, container.encrypt_file, io.BytesIO(b'x' * 50), io.BytesIO(), 100)
+        self.assertRaises(RuntimeError, container.encrypt_file, io.BytesIO(b'x' * 150), io.BytesIO(), 100)
+
+if __name__ == "__main__":
+    unittest.main()
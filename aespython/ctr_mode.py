@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+CTR Mode of operation
+
+The IV is the initial counter block. Counter blocks are incremented as a 128 bit big endian
+integer. The keystream for any position can be computed directly, so buffers are processed
+as one batch of counter blocks and seek() moves to any byte offset without touching the prefix.
+Encryption and decryption are the same operation.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST SP 800-38A http://csrc.nist.gov/publications/nistpubs/800-38a/sp800-38a.pdf
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+try:
+    from aespython.cipher_mode import CipherMode, xor_bytes, cipher_blocks
+    from aespython.mode_test import GeneralTestEncryptionMode
+except:
+    from cipher_mode import CipherMode, xor_bytes, cipher_blocks
+    from mode_test import GeneralTestEncryptionMode
+
+class CTRMode(CipherMode):
+    """Perform CTR operation on a buffer and retain the stream position for next operation"""
+
+    name = "CTR"
+
+    __slots__ = ('_counter', '_position')
+
+    def __init__(self, block_cipher, block_size):
+        CipherMode.__init__(self, block_cipher, block_size)
+        self._counter = 0
+        self._position = 0
+
+    def set_iv(self, iv):
+        """Set the initial counter block and rewind to the start of the stream"""
+        if len(iv) == self._block_size:
+            self._iv = self._iv_type(bytearray(iv))
+            self._counter = int.from_bytes(bytearray(iv), 'big')
+            self._position = 0
+
+    def seek(self, byte_offset):
+        """Move to byte_offset in the keystream, relative to the initial counter block"""
+        if byte_offset < 0:
+            raise RuntimeError('seek(): negative offset ' + str(byte_offset))
+        self._position = byte_offset
+
+    def tell(self):
+        return self._position
+
+    def counter_blocks(self, first_block, count):
+        """Return count consecutive counter blocks starting at block index first_block, as bytes"""
+        counter = self._counter + first_block
+        return b''.join([((counter + i) & 0xffffffffffffffffffffffffffffffff).to_bytes(16, 'big') for i in range(count)])
+
+    def keystream(self, length):
+        """Return length bytes of keystream from the current position and advance past them"""
+        start = self._position
+        first_block = start // 16
+        count = (start + length + 15) // 16 - first_block
+        keystream = cipher_blocks(self._block_cipher, self.counter_blocks(first_block, count))
+        self._position += length
+        return keystream[start % 16:start % 16 + length]
+
+    def encrypt(self, plaintext):
+        """Encrypt a bytes like buffer of any length, returns bytes"""
+        if not len(plaintext):
+            return b''
+        return xor_bytes(plaintext, self.keystream(len(plaintext)))
+
+    def decrypt(self, ciphertext):
+        """Decrypt a bytes like buffer of any length, returns bytes"""
+        return self.encrypt(ciphertext)
+
+    def encrypt_block(self, plaintext):
+        return list(bytearray(self.encrypt(bytearray(plaintext))))
+
+    def decrypt_block(self, ciphertext):
+        return self.encrypt_block(ciphertext)
+
+    def encrypt_block_into(self, src, src_off, dst, dst_off):
+        """Encrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        dst[dst_off:dst_off+16] = self.encrypt(memoryview(src)[src_off:src_off+16])
+
+    def decrypt_block_into(self, src, src_off, dst, dst_off):
+        """Decrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        self.encrypt_block_into(src, src_off, dst, dst_off)
+
+class TestEncryptionMode(GeneralTestEncryptionMode):
+    def test_mode(self):
+        """Test CTR Mode Encrypt/Decrypt"""
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+
+        test_mode = CTRMode(self.get_keyed_cipher(test_data.test_mode_key), 16)
+
+        self.run_cipher(test_mode, test_data.test_ctr_iv, test_data.test_ctr_ciphertext, test_data.test_mode_plaintext)
+        self.run_bulk_cipher(test_mode, test_data.test_ctr_iv, test_data.test_ctr_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_ctr_iv, test_data.test_ctr_ciphertext, test_data.test_mode_plaintext)
+
+        #Same results through an engine with only cipher_block and decipher_block
+        test_mode = CTRMode(self.get_unbatched_cipher(test_data.test_mode_key), 16)
+        self.run_bulk_cipher(test_mode, test_data.test_ctr_iv, test_data.test_ctr_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_ctr_iv, test_data.test_ctr_ciphertext, test_data.test_mode_plaintext)
+
+    def test_seek(self):
+        """Test CTR Mode random access and counter wrap"""
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        ciphertext = bytes(bytearray(sum(test_data.test_ctr_ciphertext, [])))
+
+        test_mode = CTRMode(self.get_keyed_cipher(test_data.test_mode_key), 16)
+        test_mode.set_iv(test_data.test_ctr_iv)
+        for offset in 0, 5, 16, 37, 63:
+            test_mode.seek(offset)
+            self.assertEqual(test_mode.decrypt(ciphertext[offset:]), plaintext[offset:], msg='CTR seek ' + str(offset))
+            self.assertEqual(test_mode.tell(), len(plaintext))
+
+        #Odd sized pieces continue the same keystream
+        test_mode.set_iv(test_data.test_ctr_iv)
+        pieces = [test_mode.encrypt(plaintext[i:i+7]) for i in range(0, len(plaintext), 7)]
+        self.assertEqual(b''.join(pieces), ciphertext)
+
+        #Counter block wraps modulo 2^128
+        test_mode.set_iv([0xff] * 16)
+        self.assertEqual(test_mode.counter_blocks(0, 2), b'\xff' * 16 + b'\x00' * 16)
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+ECB Mode of operation
+
+Every block is enciphered independently, so bulk calls hand the whole buffer to the block
+cipher's batch interface. ECB leaks equal plaintext blocks and should not be used on its own
+for data; it is the raw measure of engine throughput and the building block for keystreams.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST SP 800-38A http://csrc.nist.gov/publications/nistpubs/800-38a/sp800-38a.pdf
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+try:
+    from aespython.cipher_mode import CipherMode, cipher_blocks, decipher_blocks, cipher_into, decipher_into
+    from aespython.mode_test import GeneralTestEncryptionMode
+except:
+    from cipher_mode import CipherMode, cipher_blocks, decipher_blocks, cipher_into, decipher_into
+    from mode_test import GeneralTestEncryptionMode
+
+class ECBMode(CipherMode):
+    """Perform ECB operation on a block. There is no IV, set_iv is accepted and ignored"""
+
+    name = "ECB"
+    padded = True
+
+    __slots__ = ()
+
+    def __init__(self, block_cipher, block_size):
+        CipherMode.__init__(self, block_cipher, block_size)
+
+    def encrypt_block(self, plaintext):
+        return self._block_cipher.cipher_block(plaintext)
+
+    def decrypt_block(self, ciphertext):
+        return self._block_cipher.decipher_block(ciphertext)
+
+    def encrypt_block_into(self, src, src_off, dst, dst_off):
+        """Encrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        cipher_into(self._block_cipher)(src, src_off, dst, dst_off)
+
+    def decrypt_block_into(self, src, src_off, dst, dst_off):
+        """Decrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        decipher_into(self._block_cipher)(src, src_off, dst, dst_off)
+
+    def encrypt(self, plaintext):
+        """Encrypt a bytes like buffer of one or more blocks, returns bytes"""
+        n = len(plaintext)
+        full = n - n % 16
+        out = cipher_blocks(self._block_cipher, memoryview(plaintext)[:full])
+        if full < n:
+            #Trailing partial block is padded by the block cipher
+            out += bytes(bytearray(self.encrypt_block(list(bytearray(plaintext[full:])))))
+        return out
+
+    def decrypt(self, ciphertext):
+        """Decrypt a bytes like buffer of one or more blocks, returns bytes"""
+        n = len(ciphertext)
+        full = n - n % 16
+        out = decipher_blocks(self._block_cipher, memoryview(ciphertext)[:full])
+        if full < n:
+            out += bytes(bytearray(self.decrypt_block(list(bytearray(ciphertext[full:])))))
+        return out
+
+class TestEncryptionMode(GeneralTestEncryptionMode):
+    def test_mode(self):
+        """Test ECB Mode Encrypt/Decrypt"""
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+
+        test_mode = ECBMode(self.get_keyed_cipher(test_data.test_mode_key), 16)
+
+        self.run_cipher(test_mode, test_data.test_mode_iv, test_data.test_ecb_ciphertext, test_data.test_mode_plaintext)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_ecb_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_ecb_ciphertext, test_data.test_mode_plaintext)
+        self.assertFalse(hasattr(test_mode, '__dict__'))
+
+        #Same results through an engine with only cipher_block and decipher_block
+        test_mode = ECBMode(self.get_unbatched_cipher(test_data.test_mode_key), 16)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_ecb_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_ecb_ciphertext, test_data.test_mode_plaintext)
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
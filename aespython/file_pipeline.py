@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Pipelined file transform.
+
+A reader thread, a cipher stage and a writer thread connected by bounded queues, so disk or
+network I/O overlaps with computation. The reader fills buffers from a fixed pool, so at most
+depth chunks are read ahead and memory use stays bounded. The cipher stage runs in the calling
+thread and hands each buffer back to the pool as soon as it has been transformed.
+
+Time spent waiting on each queue is recorded per stage. Large waits in the cipher stage mean
+I/O bound, large waits in the reader and writer mean CPU bound.
+
+Running this file as __main__ will result in a self-test of the pipeline.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class FilePipeline:
+    """Read, transform and write a file in overlapping stages"""
+
+    def __init__(self, transform, chunk_size=1 << 20, depth=4, limit=None):
+        """
+            transform is called with a memoryview of each chunk and returns the bytes to write,
+            e.g. a CipherMode's encrypt or decrypt. Chunks are whole multiples of 16 bytes,
+            only the last one can be shorter. If limit is given output is truncated to limit bytes.
+        """
+        if chunk_size <= 0 or chunk_size % 16:
+            raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+        self._transform = transform
+        self._chunk_size = chunk_size
+        self._depth = depth
+        self._limit = limit
+        self.stats = {}
+
+    def _wait(self, stage, function, *args):
+        #Run a blocking queue operation, adding the time it took to the stage's wait time
+        start = time.time()
+        result = function(*args)
+        self.stats[stage + '_wait'] += time.time() - start
+        return result
+
+    def _reader(self, in_file, free, filled, errors, stop):
+        try:
+            while not stop.is_set():
+                buf = self._wait('read', free.get)
+                #None in place of a buffer means the pipeline is shutting down
+                if buf is None:
+                    break
+                view = memoryview(buf)
+                n = 0
+                while n < len(buf):
+                    count = in_file.readinto(view[n:])
+                    if not count:
+                        break
+                    n += count
+                if n == 0:
+                    break
+                self._wait('read', filled.put, (buf, n))
+                self.stats['bytes_read'] += n
+                if n < len(buf):
+                    break
+        except Exception as e:
+            errors.append(e)
+        filled.put(None)
+
+    def _writer(self, out_file, results, errors):
+        written = 0
+        while True:
+            data = self._wait('write', results.get)
+            if data is None:
+                break
+            #After an error keep draining so the cipher stage never blocks
+            if errors:
+                continue
+            try:
+                if self._limit is not None:
+                    data = data[:max(0, self._limit - written)]
+                out_file.write(data)
+                written += len(data)
+            except Exception as e:
+                errors.append(e)
+        self.stats['bytes_written'] = written
+
+    def run(self, in_file, out_file):
+        """Transform in_file from its current position to EOF into out_file, returns bytes written"""
+        self.stats = {'read_wait' : 0.0, 'cipher_wait' : 0.0, 'write_wait' : 0.0,
+            'cipher' : 0.0, 'bytes_read' : 0, 'bytes_written' : 0}
+        free = queue.Queue()
+        for i in range(self._depth):
+            free.put(bytearray(self._chunk_size))
+        filled = queue.Queue(self._depth)
+        results = queue.Queue(self._depth)
+        errors = []
+        stop = threading.Event()
+
+        reader = threading.Thread(target=self._reader, args=(in_file, free, filled, errors, stop))
+        writer = threading.Thread(target=self._writer, args=(out_file, results, errors))
+        reader.daemon = writer.daemon = True
+        reader.start()
+        writer.start()
+
+        done = False
+        try:
+            while True:
+                item = self._wait('cipher', filled.get)
+                if item is None:
+                    done = True
+                    break
+                buf, n = item
+                if errors:
+                    #Stop transforming once any stage failed, just recycle buffers until the reader ends
+                    stop.set()
+                    free.put(buf)
+                    continue
+                start = time.time()
+                try:
+                    data = self._transform(memoryview(buf)[:n])
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+                    free.put(buf)
+                    continue
+                self.stats['cipher'] += time.time() - start
+                free.put(buf)
+                self._wait('cipher', results.put, data)
+        finally:
+            #On any exit, including KeyboardInterrupt, unblock the reader before joining it:
+            #None in free wakes it in free.get, draining filled to its final None frees filled.put
+            stop.set()
+            free.put(None)
+            while not done:
+                done = filled.get() is None
+            reader.join()
+            results.put(None)
+            writer.join()
+
+        if errors:
+            raise errors[0]
+        return self.stats['bytes_written']
+
+import unittest
+class TestFilePipeline(unittest.TestCase):
+    def get_mode(self):
+        try:
+            from aespython import key_expander, aes_ttable_cipher, cbc_mode
+            from aespython.test_keys import TestKeys
+        except:
+            import key_expander, aes_ttable_cipher, cbc_mode
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        mode = cbc_mode.CBCMode(aes_ttable_cipher.AESTTableCipher(expanded_key), 16)
+        mode.set_iv(test_data.test_mode_iv)
+        return mode
+
+    def test_pipeline(self):
+        """Test pipelined CBC encrypt and decrypt match the bulk mode calls"""
+        import io
+        import os
+
+        plaintext = os.urandom(1000)
+        expected = self.get_mode().encrypt(plaintext)
+
+        out_file = io.BytesIO()
+        pipeline = FilePipeline(self.get_mode().encrypt, chunk_size=64, depth=2)
+        self.assertEqual(pipeline.run(io.BytesIO(plaintext), out_file), len(expected))
+        self.assertEqual(out_file.getvalue(), expected)
+        self.assertEqual(pipeline.stats['bytes_read'], len(plaintext))
+
+        out_file = io.BytesIO()
+        FilePipeline(self.get_mode().decrypt, chunk_size=48, limit=len(plaintext)).run(io.BytesIO(expected), out_file)
+        self.assertEqual(out_file.getvalue(), plaintext)
+
+    def test_errors(self):
+        """Test a failing stage stops the pipeline and raises"""
+        import io
+
+        def fail(data):
+            raise ValueError('transform failed')
+
+        pipeline = FilePipeline(fail, chunk_size=16, depth=2)
+        self.assertRaises(ValueError, pipeline.run, io.BytesIO(b'x' * 1000), io.BytesIO())
+
+    def test_interrupt(self):
+        """Test an exception that is not caught by the stages, e.g. KeyboardInterrupt, does not hang the pipeline"""
+        import io
+        import threading
+
+        def interrupt(data):
+            raise KeyboardInterrupt()
+
+        raised = []
+        def run():
+            try:
+                FilePipeline(interrupt, chunk_size=16, depth=2).run(io.BytesIO(b'x' * 1000), io.BytesIO())
+            except KeyboardInterrupt:
+                raised.append(True)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(raised, [True])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+GCM Mode of operation
+
+Galois/Counter Mode encrypts with a CTR keystream and authenticates the additional data and the
+ciphertext with GHASH, a polynomial hash over GF(2^128) keyed with H = E(K, 0^128), in one pass.
+
+GHASH multiplies by the fixed H, which is linear in the other operand, so it is table driven:
+for each of the 16 byte positions of a block a 256 entry table holds every byte value at that
+position times H, and a multiplication is 16 lookups XORed together. The tables are built from
+the 128 powers H * x^d with XORs only, and are cached next to the key's expanded schedule
+unless the block cipher keeps none.
+
+Messages are processed incrementally: set_iv starts a message, update_aad adds additional data,
+encrypt or decrypt take the payload in pieces of any length and finalize returns the tag.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per NIST SP 800-38D http://csrc.nist.gov/publications/nistpubs/800-38D/SP-800-38D.pdf
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import hmac
+
+try:
+    from aespython import key_expander
+    from aespython.cipher_mode import xor_bytes, cipher_blocks
+except:
+    import key_expander
+    from cipher_mode import xor_bytes, cipher_blocks
+
+#Reduction polynomial x^128 + x^7 + x^2 + x + 1 in GCM's reflected bit order
+_R = 0xe1 << 120
+
+def ghash_tables(h):
+    """Return 16 tables of 256 products, table i holding byte value b at block byte i times H"""
+    #Block bit p, counting from the least significant bit of the big endian integer, is x^(127-p)
+    powers = []
+    for d in range(128):
+        powers.append(h)
+        h = (h >> 1) ^ _R if h & 1 else h >> 1
+    tables = []
+    for i in range(16):
+        table = [0] * 256
+        for k in range(8):
+            bit = 1 << k
+            product = powers[127 - 8 * (15 - i) - k]
+            for b in range(bit):
+                table[bit | b] = product ^ table[b]
+        tables.append(tuple(table))
+    return tuple(tables)
+
+class GCMMode:
+    """Perform GCM authenticated encryption of a message in pieces and retain the GHASH state for next operation"""
+
+    name = "GCM"
+
+    def __init__(self, block_cipher, tag_size=16):
+        if not 12 <= tag_size <= 16:
+            raise RuntimeError('tag_size ' + str(tag_size) + ' is not between 12 and 16 bytes')
+        self._block_cipher = block_cipher
+        self._tag_size = tag_size
+        factory = lambda: ghash_tables(int.from_bytes(cipher_blocks(block_cipher, bytes(16)), 'big'))
+        #Engines keeping no byte schedule, e.g. compact.CompactCipher, get uncached tables
+        expanded_key = getattr(block_cipher, '_expanded_key', None)
+        if expanded_key is None:
+            self._tables = factory()
+        else:
+            self._tables = key_expander.schedule_cache.derived(expanded_key, 'ghash', factory)
+        self._j0 = None
+
+    def ghash(self, y, data):
+        """Absorb data, a whole number of blocks, into the GHASH value y and return the new value"""
+        t0,t1,t2,t3,t4,t5,t6,t7,t8,t9,t10,t11,t12,t13,t14,t15 = self._tables
+        from_bytes = int.from_bytes
+        for off in range(0, len(data), 16):
+            b = (y ^ from_bytes(data[off:off+16], 'big')).to_bytes(16, 'big')
+            y = (t0[b[0]] ^ t1[b[1]] ^ t2[b[2]] ^ t3[b[3]] ^ t4[b[4]] ^ t5[b[5]] ^ t6[b[6]] ^ t7[b[7]] ^
+                t8[b[8]] ^ t9[b[9]] ^ t10[b[10]] ^ t11[b[11]] ^ t12[b[12]] ^ t13[b[13]] ^ t14[b[14]] ^ t15[b[15]])
+        return y
+
+    def set_iv(self, iv):
+        """Start a new message under iv. 12 byte IVs are used directly, other lengths are hashed."""
+        iv = bytes(bytearray(iv))
+        if not iv:
+            raise RuntimeError('set_iv(): empty IV')
+        if len(iv) == 12:
+            self._j0 = iv + b'\x00\x00\x00\x01'
+        else:
+            padded = iv + bytes(-len(iv) % 16) + bytes(8) + (len(iv) * 8).to_bytes(8, 'big')
+            self._j0 = self.ghash(0, padded).to_bytes(16, 'big')
+        self._counter = int.from_bytes(self._j0[12:], 'big')
+        self._y = 0
+        self._pending = b''
+        self._aad_length = 0
+        self._length = 0
+
+    def _absorb(self, data):
+        #Hash whole blocks now and keep a partial block for the next call
+        data = self._pending + bytes(data)
+        full = len(data) - len(data) % 16
+        self._y = self.ghash(self._y, data[:full])
+        self._pending = data[full:]
+
+    def _flush(self):
+        if self._pending:
+            self._y = self.ghash(self._y, self._pending + bytes(16 - len(self._pending)))
+            self._pending = b''
+
+    def _check_started(self):
+        if self._j0 is None:
+            raise RuntimeError('set_iv() must start each message')
+
+    def update_aad(self, data):
+        """Add additional authenticated data, only before any plaintext or ciphertext"""
+        self._check_started()
+        if self._length:
+            raise RuntimeError('update_aad(): additional data must come before the payload')
+        self._aad_length += len(data)
+        self._absorb(data)
+
+    def keystream(self, length):
+        """Return length bytes of keystream from the current payload position, counter blocks from inc32(J0)"""
+        start = self._length
+        first_block = start // 16
+        count = (start + length + 15) // 16 - first_block
+        prefix, counter = self._j0[:12], self._counter + 1 + first_block
+        blocks = b''.join([prefix + ((counter + i) & 0xffffffff).to_bytes(4, 'big') for i in range(count)])
+        return cipher_blocks(self._block_cipher, blocks)[start % 16:start % 16 + length]
+
+    def _payload(self, data):
+        #The additional data ends at the first payload byte, its last block is zero padded
+        self._check_started()
+        if not self._length:
+            self._flush()
+        keystream = self.keystream(len(data))
+        self._length += len(data)
+        return xor_bytes(data, keystream)
+
+    def encrypt(self, plaintext):
+        """Encrypt the next piece of the message, of any length, returns bytes"""
+        if not len(plaintext):
+            return b''
+        ciphertext = self._payload(plaintext)
+        self._absorb(ciphertext)
+        return ciphertext
+
+    def decrypt(self, ciphertext):
+        """Decrypt the next piece of the message, of any length, returns bytes. Check the tag with verify before use."""
+        if not len(ciphertext):
+            return b''
+        plaintext = self._payload(ciphertext)
+        self._absorb(ciphertext)
+        return plaintext
+
+    def finalize(self):
+        """End the message and return its authentication tag. set_iv must be called before the next message."""
+        self._check_started()
+        self._flush()
+        lengths = (self._aad_length * 8).to_bytes(8, 'big') + (self._length * 8).to_bytes(8, 'big')
+        s = self.ghash(self._y, lengths)
+        tag = xor_bytes(cipher_blocks(self._block_cipher, self._j0), s.to_bytes(16, 'big'))
+        self._j0 = None
+        return tag[:self._tag_size]
+
+    def verify(self, tag):
+        """End the message and compare tag with its authentication tag in constant time, raises RuntimeError on mismatch"""
+        if not hmac.compare_digest(self.finalize(), bytes(bytearray(tag))):
+            raise RuntimeError('verify(): authentication tag mismatch')
+
+    def encrypt_and_digest(self, iv, plaintext, aad=b''):
+        """Encrypt a whole message, returns (ciphertext, tag)"""
+        self.set_iv(iv)
+        self.update_aad(aad)
+        ciphertext = self.encrypt(plaintext)
+        return ciphertext, self.finalize()
+
+    def decrypt_and_verify(self, iv, ciphertext, tag, aad=b''):
+        """Decrypt a whole message and check its tag, returns the plaintext or raises RuntimeError"""
+        self.set_iv(iv)
+        self.update_aad(aad)
+        plaintext = self.decrypt(ciphertext)
+        self.verify(tag)
+        return plaintext
+
+import unittest
+class TestEncryptionMode(unittest.TestCase):
+    def get_mode(self, key, tag_size=16):
+        try:
+            from aespython import aes_ttable_cipher
+        except:
+            import aes_ttable_cipher
+
+        return GCMMode(aes_ttable_cipher.AESTTableCipher(key_expander.KeyExpander(len(key) * 8).expand(bytearray(key))), tag_size)
+
+    def test_vectors(self):
+        """Test GCM against the McGrew-Viega test cases 1 to 4, 6, 13 and 14"""
+        import binascii
+        k3 = 'feffe9928665731c6d6a8f9467308308'
+        p3 = ('d9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72'
+            '1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b391aafd255')
+        c3 = ('42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e'
+            '21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091473f5985')
+        aad = 'feedfacedeadbeeffeedfacedeadbeefabaddad2'
+        vectors = [
+            ('00' * 16, '00' * 12, '', '', '', '58e2fccefa7e3061367f1d57a4e7455a'),
+            ('00' * 16, '00' * 12, '00' * 16, '', '0388dace60b6a392f328c2b971b2fe78', 'ab6e47d42cec13bdf53a67b21257bddf'),
+            (k3, 'cafebabefacedbaddecaf888', p3, '', c3, '4d5c2af327cd64a62cf35abd2ba6fab4'),
+            (k3, 'cafebabefacedbaddecaf888', p3[:120], aad, c3[:120], '5bc94fbc3221a5db94fae95ae7121a47'),
+            (k3, '9313225df88406e555909c5aff5269aa6a7a9538534f7da1e4c303d2a318a728'
+                'c3c0c95156809539fcf0e2429a6b525416aedbf5a0de6a57a637b39b', p3[:120], aad,
+                '8ce24998625615b603a033aca13fb894be9112a5c3a211a8ba262a3cca7e2ca7'
+                '01e4a9a4fba43c90ccdcb281d48c7c6fd62875d2aca417034c34aee5', '619cc5aefffe0bfa462af43c1699d050'),
+            ('00' * 32, '00' * 12, '', '', '', '530f8afbc74536b9a963b4f1c4cb738b'),
+            ('00' * 32, '00' * 12, '00' * 16, '', 'cea7403d4d606b6e074ec5d3baf39d18', 'd0d1c8a799996bf0265b98b5d48ab919'),
+        ]
+        for i, (key, iv, plaintext, aad, ciphertext, tag) in enumerate(vectors):
+            key, iv, plaintext, aad, ciphertext, tag = [binascii.unhexlify(v) for v in (key, iv, plaintext, aad, ciphertext, tag)]
+            test_mode = self.get_mode(key)
+            self.assertEqual(test_mode.encrypt_and_digest(iv, plaintext, aad), (ciphertext, tag), msg='GCM vector ' + str(i))
+            self.assertEqual(test_mode.decrypt_and_verify(iv, ciphertext, tag, aad), plaintext, msg='GCM vector ' + str(i))
+
+    def test_incremental(self):
+        """Test GCM in odd sized pieces matches one shot, and tampering is detected"""
+        import os
+
+        test_mode = self.get_mode(os.urandom(32), 12)
+        iv, aad, plaintext = os.urandom(12), os.urandom(37), os.urandom(300)
+        ciphertext, tag = test_mode.encrypt_and_digest(iv, plaintext, aad)
+        self.assertEqual(len(tag), 12)
+
+        test_mode.set_iv(iv)
+        for i in range(0, len(aad), 10):
+            test_mode.update_aad(aad[i:i+10])
+        pieces = [test_mode.encrypt(plaintext[i:i+7]) for i in range(0, len(plaintext), 7)]
+        self.assertEqual((b''.join(pieces), test_mode.finalize()), (ciphertext, tag))
+
+        test_mode.set_iv(iv)
+        test_mode.update_aad(aad)
+        self.assertEqual(b''.join([test_mode.decrypt(ciphertext[i:i+50]) for i in range(0, len(ciphertext), 50)]), plaintext)
+        test_mode.verify(tag)
+
+        tampered = bytearray(ciphertext)
+        tampered[100] ^= 1
+        self.assertRaises(RuntimeError, test_mode.decrypt_and_verify, iv, bytes(tampered), tag, aad)
+        self.assertRaises(RuntimeError, test_mode.decrypt_and_verify, iv, ciphertext, tag, aad[1:])
+        self.assertRaises(RuntimeError, test_mode.encrypt, b'after finalize')
+
+        #Same results through an engine with only cipher_block and decipher_block
+        try:
+            from aespython import mode_test
+        except:
+            import mode_test
+        unbatched_mode = GCMMode(mode_test.UnbatchedCipher(test_mode._block_cipher), 12)
+        self.assertEqual(unbatched_mode.encrypt_and_digest(iv, plaintext, aad), (ciphertext, tag))
+        self.assertEqual(unbatched_mode.decrypt_and_verify(iv, ciphertext, tag, aad), plaintext)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Opt in instrumentation of the hot paths.
+
+enable() wraps the methods of the engines, KeyExpander and the modes in place, and disable()
+puts the originals back, so with instrumentation off the code runs exactly as written with no
+checks on the hot path. While enabled every wrapped call is counted and timed:
+
+    phases      calls and exclusive time per method, e.g. 'CBCMode.encrypt' is the time CBC spends
+                in its own XOR and chaining, not in the block cipher, and 'AESCipher._mix_columns'
+                is one round operation. phase() times other code, such as file I/O, the same way.
+    counters    key_expansions, blocks_ciphered, blocks_deciphered, bytes_encrypted,
+                bytes_decrypted and anything counted through phase(). A call made from inside
+                another call of the same kind, such as a mode's encrypt_block calling its encrypt,
+                is only counted once.
+
+With sample_every N only every Nth call of a method is timed and its time is scaled up by the
+ratio of calls to timed calls; counts stay exact. Objects that captured a bound method before
+enable() keep calling the original.
+
+snapshot() returns the current totals, measure() is a context manager that enables
+instrumentation if needed and keeps the difference over its block in its stats attribute.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import threading
+import time
+
+try:
+    from aespython import key_expander, aes_cipher, aes_ttable_cipher, aes_numpy_cipher, aes_bitsliced_cipher, aes_translate_cipher, aes_unrolled_cipher, cipher_mode
+    from aespython import cbc_mode, cfb_mode, ofb_mode, ctr_mode, ecb_mode, xts_mode, gcm_mode
+except:
+    import key_expander, aes_cipher, aes_ttable_cipher, aes_numpy_cipher, aes_bitsliced_cipher, aes_translate_cipher, aes_unrolled_cipher, cipher_mode
+    import cbc_mode, cfb_mode, ofb_mode, ctr_mode, ecb_mode, xts_mode, gcm_mode
+
+timer = getattr(time, 'perf_counter', time.time)
+
+_lock = threading.Lock()
+_local = threading.local()
+_enabled = False
+_sample_every = 1
+_patched = []
+#Phase name -> [calls, timed calls, exclusive seconds of timed calls]
+_phases = {}
+_counters = {}
+
+def engine_classes():
+    """Block cipher engines that enable() instruments"""
+    return [aes_cipher.AESCipher, aes_ttable_cipher.AESTTableCipher, aes_unrolled_cipher.AESUnrolledCipher, aes_numpy_cipher.AESNumpyCipher,
+        aes_bitsliced_cipher.AESBitslicedCipher, aes_translate_cipher.AESTranslateCipher]
+
+def mode_classes():
+    """Modes that enable() instruments"""
+    return [cipher_mode.CipherMode, cbc_mode.CBCMode, cfb_mode.CFBMode, ofb_mode.OFBMode, ctr_mode.CTRMode,
+        ecb_mode.ECBMode, xts_mode.XTSMode, gcm_mode.GCMMode]
+
+def _thread_state():
+    try:
+        return _local.state
+    except AttributeError:
+        #Stack of child time of the timed calls in progress, and nesting depth per kind of call
+        _local.state = ([], {})
+        return _local.state
+
+def _count(name, n):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def _start(stack):
+    frame = [0.0, timer()]
+    stack.append(frame)
+    return frame
+
+def _stop(stats, stack, frame):
+    elapsed = timer() - frame[1]
+    stack.pop()
+    if stack:
+        stack[-1][0] += elapsed
+    with _lock:
+        stats[1] += 1
+        stats[2] += elapsed - frame[0]
+
+def _wrap(name, function, kind, counter):
+    stats = _phases.setdefault(name, [0, 0, 0.0])
+    def wrapper(*args, **kwargs):
+        stack, depth = _thread_state()
+        if counter is not None and not depth.get(kind):
+            _count(*counter(args))
+        depth[kind] = depth.get(kind, 0) + 1
+        try:
+            with _lock:
+                stats[0] += 1
+                sampled = not stats[0] % _sample_every
+            if not sampled:
+                return function(*args, **kwargs)
+            frame = _start(stack)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _stop(stats, stack, frame)
+        finally:
+            depth[kind] -= 1
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def _targets():
+    #(class, method, kind, counter) for every method to wrap. Counters map call args to (name, count).
+    targets = [(key_expander.KeyExpander, 'expand', 'key', lambda args: ('key_expansions', 1))]
+    one = lambda name: lambda args: (name, 1)
+    for cls in engine_classes():
+        targets.append((cls, '__init__', 'key', None))
+        for method, counter in (('cipher_block', one('blocks_ciphered')), ('decipher_block', one('blocks_deciphered')),
+                ('cipher_block_into', one('blocks_ciphered')), ('decipher_block_into', one('blocks_deciphered')),
+                ('cipher_blocks', lambda args: ('blocks_ciphered', len(args[1]) // 16)),
+                ('decipher_blocks', lambda args: ('blocks_deciphered', len(args[1]) // 16))):
+            targets.append((cls, method, 'cipher', counter))
+        for method in ('_sub_bytes', '_i_sub_bytes', '_shift_rows', '_i_shift_rows', '_mix_columns', '_add_round_key'):
+            targets.append((cls, method, 'round', None))
+    for cls in mode_classes():
+        for method in ('encrypt', 'decrypt', 'encrypt_block', 'decrypt_block'):
+            targets.append((cls, method, 'mode', lambda args, name=method: ('bytes_' + name.split('_')[0] + 'ed', len(args[1]))))
+        for method in ('encrypt_block_into', 'decrypt_block_into'):
+            targets.append((cls, method, 'mode', lambda args, name=method: ('bytes_' + name.split('_')[0] + 'ed', 16)))
+        for method in ('encrypt_sector', 'decrypt_sector', 'encrypt_sectors', 'decrypt_sectors'):
+            targets.append((cls, method, 'mode', lambda args, name=method: ('bytes_' + name.split('_')[0] + 'ed', len(args[2]))))
+    #Only methods a class defines itself, inherited ones are wrapped on the class that defines them
+    return [t for t in targets if t[1] in t[0].__dict__]
+
+def enable(sample_every=1):
+    """Start instrumenting, timing every sample_every-th call of each method. Totals carry on from before."""
+    global _enabled, _sample_every
+    if sample_every < 1:
+        raise RuntimeError('sample_every ' + str(sample_every) + ' is not a positive integer')
+    _sample_every = sample_every
+    if _enabled:
+        return
+    for cls, method, kind, counter in _targets():
+        original = cls.__dict__[method]
+        _patched.append((cls, method, original))
+        setattr(cls, method, _wrap(cls.__name__ + '.' + method, original, kind, counter))
+    _enabled = True
+
+def disable():
+    """Stop instrumenting and restore the original methods. Totals are kept until reset()."""
+    global _enabled
+    while _patched:
+        cls, method, original = _patched.pop()
+        setattr(cls, method, original)
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def reset():
+    """Zero every total"""
+    with _lock:
+        for stats in _phases.values():
+            stats[:] = [0, 0, 0.0]
+        _counters.clear()
+
+class _Phase:
+    def __init__(self, name, counter):
+        self._stats = _phases.setdefault(name, [0, 0, 0.0])
+        self._counter = counter
+        self._count = 0
+
+    def add(self, n):
+        """Add n to the phase's counter, e.g. bytes read"""
+        self._count += n
+
+    def __enter__(self):
+        with _lock:
+            self._stats[0] += 1
+        self._stack = _thread_state()[0]
+        self._frame = _start(self._stack)
+        return self
+
+    def __exit__(self, *exc_info):
+        _stop(self._stats, self._stack, self._frame)
+        if self._counter is not None:
+            _count(self._counter, self._count)
+        return False
+
+class _NullPhase:
+    def add(self, n):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_phase = _NullPhase()
+
+def phase(name, counter=None, count=0):
+    """
+        Context manager timing its block as phase name, always timed regardless of sampling
+
+        If counter is given, count plus anything passed to add() on the returned object is
+        added to that counter. When instrumentation is off this returns a shared no-op.
+    """
+    if not _enabled:
+        return _null_phase
+    result = _Phase(name, counter)
+    result.add(count)
+    return result
+
+def snapshot():
+    """
+        Return current totals
+
+        A dict of 'phases', mapping phase name to calls, timed calls and estimated exclusive
+        seconds, 'counters' and the key 'schedule_cache' statistics.
+    """
+    with _lock:
+        phases = dict((name, {'calls' : s[0], 'timed' : s[1], 'timed_seconds' : s[2],
+            'seconds' : s[2] * s[0] / s[1] if s[1] else 0.0}) for name, s in _phases.items() if s[0])
+        counters = dict(_counters)
+    return {'phases' : phases, 'counters' : counters, 'schedule_cache' : key_expander.schedule_cache.stats()}
+
+def difference(before, after):
+    """Totals accumulated between two snapshots"""
+    phases = {}
+    for name, a in after['phases'].items():
+        b = before['phases'].get(name, {'calls' : 0, 'timed' : 0, 'timed_seconds' : 0.0})
+        calls, timed, seconds = a['calls'] - b['calls'], a['timed'] - b['timed'], a['timed_seconds'] - b['timed_seconds']
+        if calls:
+            phases[name] = {'calls' : calls, 'timed' : timed, 'timed_seconds' : seconds,
+                'seconds' : seconds * calls / timed if timed else 0.0}
+    counters = dict((name, n - before['counters'].get(name, 0)) for name, n in after['counters'].items()
+        if n != before['counters'].get(name, 0))
+    cache = dict((name, after['schedule_cache'][name] - before['schedule_cache'].get(name, 0))
+        for name in ('hits', 'misses', 'evictions'))
+    return {'phases' : phases, 'counters' : counters, 'schedule_cache' : cache}
+
+class measure:
+    """Context manager collecting the totals of its block into its stats attribute"""
+
+    def __init__(self, sample_every=1):
+        self._sample_every = sample_every
+        self.stats = None
+
+    def __enter__(self):
+        self._was_enabled = _enabled
+        if not _enabled:
+            enable(self._sample_every)
+        self._before = snapshot()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats = difference(self._before, snapshot())
+        if not self._was_enabled:
+            disable()
+        return False
+
+def report(stats):
+    """Format a snapshot or difference as lines of text, slowest phase first"""
+    lines = ['%-40s %12s %12s' % ('phase', 'calls', 'seconds')]
+    for name, p in sorted(stats['phases'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%-40s %12d %12.4f' % (name, p['calls'], p['seconds']))
+    for name, n in sorted(stats['counters'].items()):
+        lines.append('%-40s %12d' % (name, n))
+    lines.append('%-40s %12d hits %d misses' % ('schedule_cache', stats['schedule_cache']['hits'], stats['schedule_cache']['misses']))
+    return '\n'.join(lines)
+
+import unittest
+class TestInstrument(unittest.TestCase):
+    def get_mode(self):
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        #A key no other test uses, so the expansion is a schedule cache miss
+        expanded_key = key_expander.KeyExpander(256).expand([i ^ 0x5a for i in test_data.test_mode_key])
+        mode = cbc_mode.CBCMode(aes_cipher.AESCipher(expanded_key), 16)
+        mode.set_iv(test_data.test_mode_iv)
+        return mode
+
+    def test_measure(self):
+        """Test counts and phases over a block, and that the original methods come back"""
+        original = cbc_mode.CBCMode.__dict__['encrypt']
+        with measure() as m:
+            self.assertTrue(enabled())
+            mode = self.get_mode()
+            mode.encrypt(bytes(64))
+            mode.decrypt(bytes(32))
+            with phase('test.io', 'io_bytes', 5) as p:
+                p.add(3)
+        self.assertFalse(enabled())
+        self.assertTrue(cbc_mode.CBCMode.__dict__['encrypt'] is original)
+
+        counters = m.stats['counters']
+        self.assertEqual(counters['key_expansions'], 1)
+        self.assertEqual(counters['bytes_encrypted'], 64)
+        self.assertEqual(counters['bytes_decrypted'], 32)
+        self.assertEqual(counters['blocks_ciphered'], 4)
+        self.assertEqual(counters['blocks_deciphered'], 2)
+        self.assertEqual(counters['io_bytes'], 8)
+        self.assertEqual(m.stats['phases']['AESCipher._sub_bytes']['calls'], 4 * 14)
+        self.assertEqual(m.stats['phases']['CBCMode.encrypt']['calls'], 1)
+        self.assertTrue(m.stats['phases']['test.io']['seconds'] >= 0)
+        self.assertTrue(report(m.stats).startswith('phase'))
+
+        #Disabled, phase is a no-op and nothing is counted
+        with phase('test.io', 'io_bytes', 5):
+            pass
+        self.assertEqual(snapshot()['counters'].get('io_bytes'), 8)
+
+    def test_sampling(self):
+        """Test sampled timing keeps exact counts"""
+        with measure(sample_every=3) as m:
+            mode = self.get_mode()
+            for i in range(7):
+                mode.encrypt_block([0] * 16)
+        encrypt_block = m.stats['phases']['CBCMode.encrypt_block']
+        self.assertEqual((encrypt_block['calls'], encrypt_block['timed']), (7, 2))
+        self.assertEqual(m.stats['counters']['blocks_ciphered'], 7)
+
+if __name__ == "__main__":
+    unittest.main()
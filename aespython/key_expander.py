@@ -14,20 +14,125 @@ Licensed under the MIT license http://www.opensource.org/licenses/mit-license.ph
 """
 __author__ = "Adam Newman"
 
+import threading
+from collections import OrderedDict
+
 #Normally use relative import. In test mode use local import.
 try:
     from . import aes_tables
 except ValueError:
     import aes_tables
 
+class KeyScheduleCache:
+    """
+        Bounded, thread safe LRU cache of key schedules keyed by key bytes and key size
+
+        Each key holds its expanded schedule plus any forms derived from it, such as decryption
+        schedules or word packed round keys for a particular engine. Capacity counts keys.
+    """
+
+    _expanded_key_length = {176 : 16, 208 : 24, 240 : 32}
+
+    def __init__(self, capacity=256):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_capacity(self, capacity):
+        with self._lock:
+            self._capacity = capacity
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key_array, key_length, form, factory):
+        """Return the cached form of the schedule for key_array, calling factory() to build it on a miss"""
+        cache_key = (bytes(bytearray(key_array)), key_length)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and form in entry:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[form]
+            self.misses += 1
+
+        #Build outside the lock, a racing thread may build the same value which is harmless
+        value = factory()
+        with self._lock:
+            self._entries.setdefault(cache_key, {})[form] = value
+            self._entries.move_to_end(cache_key)
+            self._evict()
+        return value
+
+    def derived(self, expanded_key, form, factory):
+        """
+            Return a form derived from an expanded key, calling factory() to build it on a miss
+
+            The form is cached next to the schedule of the key the expanded key starts with. That
+            schedule is always a real expansion of the key, expanded keys that do not match it are
+            never cached. Each call counts as one hit or one miss.
+        """
+        n = self._expanded_key_length.get(len(expanded_key))
+        if n is None:
+            return factory()
+        cache_key = (bytes(bytearray(expanded_key[:n])), n * 8)
+        schedule = tuple(expanded_key)
+        with self._lock:
+            entry = self._entries.get(cache_key, {})
+            reference = entry.get('expanded')
+            if reference == schedule and form in entry:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[form]
+            self.misses += 1
+
+        if reference is None:
+            reference = tuple(KeyExpander(n * 8, cache=None).expand(list(schedule[:n])))
+        value = factory()
+        if reference != schedule:
+            return value
+        with self._lock:
+            entry = self._entries.setdefault(cache_key, {})
+            entry.setdefault('expanded', reference)
+            entry[form] = value
+            self._entries.move_to_end(cache_key)
+            self._evict()
+        return value
+
+    def purge(self, key_array=None):
+        """Drop every cached schedule of key_array, or the whole cache when no key is given"""
+        with self._lock:
+            if key_array is None:
+                self._entries.clear()
+                return
+            key_bytes = bytes(bytearray(key_array))
+            for cache_key in [k for k in self._entries if k[0] == key_bytes]:
+                del self._entries[cache_key]
+
+    def stats(self):
+        with self._lock:
+            return {'size' : len(self._entries), 'capacity' : self._capacity,
+                'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions}
+
+#Process wide cache used by KeyExpander and the engines unless told otherwise
+schedule_cache = KeyScheduleCache()
+
 class KeyExpander:
     """Perform AES Key Expansion"""
     
     _expanded_key_length = {128 : 176, 192 : 208, 256 : 240}
     
-    def __init__(self, key_length):
+    def __init__(self, key_length, cache=schedule_cache):
         self._key_length = key_length
         self._n = int(key_length / 8)
+        #Schedule cache to use, None always expands
+        self._cache = cache
         
         if key_length in self._expanded_key_length:
             self._b = self._expanded_key_length[key_length]
@@ -55,12 +160,18 @@ class KeyExpander:
         """ 
             Expand the encryption key per AES key schedule specifications
             
+            Schedules are kept in the schedule cache, so expanding a hot key again costs a lookup and a copy.
             http://en.wikipedia.org/wiki/Rijndael_key_schedule#Key_schedule_description
         """
         
         if len(key_array) != self._n:
             raise RuntimeError('expand(): key size ' + str(len(key_array)) + ' is invalid')
         
+        if self._cache is None:
+            return self._expand(key_array)
+        return list(self._cache.get(key_array, self._key_length, 'expanded', lambda: tuple(self._expand(key_array))))
+    
+    def _expand(self, key_array):
         #First n bytes are copied from key. Copy prevents inplace modification of original key
         new_key = list(key_array)
         
@@ -117,6 +228,36 @@ class KeyExpander:
        
         return new_key
 
+    def expand_inverse(self, expanded_key):
+        """
+            Derive the decryption key schedule for the equivalent inverse cipher from an expanded key
+
+            Round keys are returned in the order decryption uses them, last round first.
+            InvMixColumns is applied to every round key except the first and last.
+            Algorithm per NIST FIPS-197 section 5.3.5
+        """
+
+        if len(expanded_key) != self._b:
+            raise RuntimeError('expand_inverse(): expanded key size ' + str(len(expanded_key)) + ' is invalid')
+
+        g0,g1,g2,g3 = aes_tables.galI
+        rounds = self._b // 16
+
+        #Outer round keys are copied unchanged
+        inverse_key = list(expanded_key[-16:])
+
+        for round in range(rounds - 2, 0, -1):
+            for i in range(round * 16, round * 16 + 16, 4):
+                c0,c1,c2,c3 = expanded_key[i:i+4]
+                inverse_key.extend((
+                    g0[c0]^g1[c1]^g2[c2]^g3[c3],
+                    g3[c0]^g0[c1]^g1[c2]^g2[c3],
+                    g2[c0]^g3[c1]^g0[c2]^g1[c3],
+                    g1[c0]^g2[c1]^g3[c2]^g0[c3]))
+
+        inverse_key.extend(expanded_key[:16])
+        return inverse_key
+
 import unittest
 class TestKeyExpander(unittest.TestCase):
     
@@ -135,6 +276,72 @@ class TestKeyExpander(unittest.TestCase):
             self.assertEqual (len([i for i, j in zip(test_expanded_key, test_data.test_expanded_key_validated[key_size]) if i == j]), 
                 len(test_data.test_expanded_key_validated[key_size]),
                 msg='Key expansion ' + str(key_size) + ' bit')
+
+    def test_cache(self):
+        """Test key schedule cache hits, eviction and purge"""
+        try:
+            from . import test_keys
+        except:
+            import test_keys
+
+        test_data = test_keys.TestKeys()
+        test_cache = KeyScheduleCache(2)
+
+        for key_size in [128, 192, 256, 256]:
+            test_expanded_key = KeyExpander(key_size, test_cache).expand(test_data.test_key[key_size])
+            self.assertEqual(test_expanded_key, test_data.test_expanded_key_validated[key_size])
+            #Callers get their own copy
+            test_expanded_key[0] ^= 1
+
+        self.assertEqual(test_cache.stats(), {'size' : 2, 'capacity' : 2, 'hits' : 1, 'misses' : 3, 'evictions' : 1})
+        self.assertEqual(KeyExpander(256, test_cache).expand(test_data.test_key[256]), test_data.test_expanded_key_validated[256])
+
+        #Derived forms live with the key they came from and go away with it
+        calls = []
+        for i in range(2):
+            test_cache.derived(test_data.test_expanded_key_validated[256], 'test', lambda: calls.append(1))
+        self.assertEqual(len(calls), 1)
+        test_cache.derived(test_data.test_key[256] + [0] * 208, 'test', lambda: calls.append(1))
+        self.assertEqual(len(calls), 2)
+
+        test_cache.purge(test_data.test_key[256])
+        self.assertEqual(test_cache.stats()['size'], 1)
+
+        #A bogus expanded key must not become the cached schedule of its key
+        test_cache.purge()
+        test_cache.derived(test_data.test_key[256] + [0] * 208, 'test', lambda: None)
+        self.assertEqual(KeyExpander(256, test_cache).expand(test_data.test_key[256]), test_data.test_expanded_key_validated[256])
+
+        #One miss per derived lookup, the reference schedule is not counted separately
+        misses = test_cache.stats()['misses']
+        test_cache.derived(test_data.test_expanded_key_validated[192], 'test', lambda: None)
+        self.assertEqual(test_cache.stats()['misses'], misses + 1)
+        test_cache.derived(test_data.test_expanded_key_validated[192], 'test', lambda: None)
+        self.assertEqual(test_cache.stats()['misses'], misses + 1)
+        test_cache.purge()
+        self.assertEqual(test_cache.stats()['size'], 0)
+
+    def test_inverse_keys(self):
+        """Test equivalent inverse cipher key schedules"""
+        try:
+            from . import test_keys, aes_cipher
+        except:
+            import test_keys, aes_cipher
+
+        test_data = test_keys.TestKeys()
+
+        for key_size in [128, 192, 256]:
+            test_expander = KeyExpander(key_size)
+            test_expanded_key = test_data.test_expanded_key_validated[key_size]
+            test_inverse_key = test_expander.expand_inverse(test_expanded_key)
+            self.assertEqual(len(test_inverse_key), len(test_expanded_key))
+            self.assertEqual(test_inverse_key[:16], test_expanded_key[-16:])
+            self.assertEqual(test_inverse_key[-16:], test_expanded_key[:16])
+
+            #Second decryption round key is InvMixColumns of the second to last round key
+            round_key = test_expanded_key[-32:-16]
+            aes_cipher.AESCipher(test_expanded_key)._mix_columns(round_key, True)
+            self.assertEqual(test_inverse_key[16:32], round_key, msg='Inverse key ' + str(key_size) + ' bit')
         
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Memory mapped file encryption.
+
+The input file is mapped and the mode processes memoryview slices of the mapping directly, so
+there is no read buffer and no per block copy; the page cache does the buffering. Output can be
+written through a pre-sized mapping, or for length preserving modes (CTR, OFB, CFB) a file can be
+transformed in place.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import mmap
+import os
+
+def map_file(transform, in_path, out_path, in_offset=0, header=b'', out_size=None, chunk_size=1 << 20):
+    """
+        Transform in_path from in_offset to EOF into out_path, one chunk_size slice of the mapping at a time
+
+        transform is a mode's encrypt or decrypt. header is written to out_path first.
+        If out_size is given the output is a mapping of exactly header plus out_size bytes and
+        transformed data beyond out_size is dropped, otherwise output is appended with write().
+        Returns the number of bytes written after the header.
+    """
+    if chunk_size <= 0 or chunk_size % 16:
+        raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+
+    with open(in_path, 'rb') as in_file:
+        with open(out_path, 'w+b') as out_file:
+            out_file.write(header)
+            if out_size is not None:
+                out_file.truncate(len(header) + out_size)
+            size = os.fstat(in_file.fileno()).st_size
+            if size <= in_offset:
+                return 0
+
+            in_map = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            out_map = None
+            if out_size:
+                out_map = mmap.mmap(out_file.fileno(), 0)
+            written = 0
+            try:
+                with memoryview(in_map) as in_view:
+                    for off in range(in_offset, size, chunk_size):
+                        chunk = in_view[off:off+chunk_size]
+                        try:
+                            data = transform(chunk)
+                        finally:
+                            chunk.release()
+                        if out_size is None:
+                            out_file.write(data)
+                        elif out_map is not None:
+                            data = data[:max(0, out_size - written)]
+                            out_map[len(header)+written:len(header)+written+len(data)] = data
+                        written += len(data)
+            finally:
+                if out_map is not None:
+                    out_map.close()
+                in_map.close()
+            return written
+
+def transform_in_place(transform, path, offset=0, length=None, chunk_size=1 << 20):
+    """
+        Transform length bytes of path starting at offset in place, by default to EOF
+
+        transform must be length preserving, e.g. CTR, OFB or CFB encrypt or decrypt.
+        Returns the number of bytes transformed.
+    """
+    if chunk_size <= 0 or chunk_size % 16:
+        raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+
+    with open(path, 'r+b') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        if end <= offset:
+            return 0
+
+        file_map = mmap.mmap(f.fileno(), 0)
+        try:
+            with memoryview(file_map) as view:
+                for off in range(offset, end, chunk_size):
+                    chunk = view[off:min(off+chunk_size, end)]
+                    try:
+                        data = transform(chunk)
+                        if len(data) != len(chunk):
+                            raise RuntimeError('transform_in_place(): transform is not length preserving')
+                        chunk[:] = data
+                    finally:
+                        chunk.release()
+            file_map.flush()
+        finally:
+            file_map.close()
+        return end - offset
+
+import unittest
+class TestMappedFile(unittest.TestCase):
+    def get_mode(self, mode_module, mode_class, iv):
+        try:
+            from aespython import key_expander, aes_ttable_cipher
+            from aespython.test_keys import TestKeys
+        except:
+            import key_expander, aes_ttable_cipher
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        expanded_key = key_expander.KeyExpander(256).expand(test_data.test_mode_key)
+        mode = mode_class(aes_ttable_cipher.AESTTableCipher(expanded_key), 16)
+        mode.set_iv(iv)
+        return mode
+
+    def setUp(self):
+        import tempfile
+        self._dir = tempfile.mkdtemp()
+        self._plaintext = os.urandom(1000)
+        self._in_path = os.path.join(self._dir, 'in')
+        with open(self._in_path, 'wb') as f:
+            f.write(b'HEAD' + self._plaintext)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._dir)
+
+    def test_map_file(self):
+        """Test mapped CBC encrypt and pre-sized mapped decrypt"""
+        try:
+            from aespython import cbc_mode
+        except:
+            import cbc_mode
+
+        iv = [0] * 16
+        expected = self.get_mode(cbc_mode, cbc_mode.CBCMode, iv).encrypt(self._plaintext)
+        out_path = os.path.join(self._dir, 'out')
+        self.assertEqual(map_file(self.get_mode(cbc_mode, cbc_mode.CBCMode, iv).encrypt,
+            self._in_path, out_path, in_offset=4, header=b'hdr', chunk_size=64), len(expected))
+        with open(out_path, 'rb') as f:
+            self.assertEqual(f.read(), b'hdr' + expected)
+
+        dec_path = os.path.join(self._dir, 'dec')
+        map_file(self.get_mode(cbc_mode, cbc_mode.CBCMode, iv).decrypt, out_path, dec_path,
+            in_offset=3, out_size=len(self._plaintext), chunk_size=48)
+        with open(dec_path, 'rb') as f:
+            self.assertEqual(f.read(), self._plaintext)
+
+    def test_in_place(self):
+        """Test CTR encrypt in place matches bulk encrypt and decrypts back"""
+        try:
+            from aespython import ctr_mode
+        except:
+            import ctr_mode
+
+        iv = [0xf0] * 16
+        expected = self.get_mode(ctr_mode, ctr_mode.CTRMode, iv).encrypt(self._plaintext)
+        self.assertEqual(transform_in_place(self.get_mode(ctr_mode, ctr_mode.CTRMode, iv).encrypt,
+            self._in_path, offset=4, chunk_size=32), len(self._plaintext))
+        with open(self._in_path, 'rb') as f:
+            self.assertEqual(f.read(), b'HEAD' + expected)
+
+        transform_in_place(self.get_mode(ctr_mode, ctr_mode.CTRMode, iv).decrypt, self._in_path, offset=4)
+        with open(self._in_path, 'rb') as f:
+            self.assertEqual(f.read(), b'HEAD' + self._plaintext)
+
+if __name__ == "__main__":
+    unittest.main()
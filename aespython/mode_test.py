@@ -10,6 +10,12 @@ except:
     from key_expander import KeyExpander        
     from aes_cipher import AESCipher
 
+class UnbatchedCipher:
+    """Block cipher with only the original cipher_block/decipher_block interface, no buffer or batch methods"""
+    def __init__(self, block_cipher):
+        self.cipher_block = block_cipher.cipher_block
+        self.decipher_block = block_cipher.decipher_block
+
 import unittest
 class GeneralTestEncryptionMode(unittest.TestCase):
     def get_keyed_cipher(self, key):
@@ -20,6 +26,9 @@ class GeneralTestEncryptionMode(unittest.TestCase):
         
         return AESCipher(test_expanded_key)
 
+    def get_unbatched_cipher(self, key):
+        return UnbatchedCipher(self.get_keyed_cipher(key))
+
     def run_cipher(self, cipher_mode, iv, ciphertext_list, plaintext_list):
         """Given an cipher mode, test key, and test iv, use known ciphertext, plaintext to test algorithm"""
 
@@ -35,6 +44,48 @@ class GeneralTestEncryptionMode(unittest.TestCase):
                 16,
                 msg=cipher_mode.name + ' decrypt test block' + str(k))
 
+    def run_bulk_cipher(self, cipher_mode, iv, ciphertext_list, plaintext_list):
+        """Test bulk encrypt/decrypt against known ciphertext, in one call and split across calls"""
+        plaintext = bytes(bytearray(sum(plaintext_list, [])))
+        ciphertext = bytes(bytearray(sum(ciphertext_list, [])))
+
+        cipher_mode.set_iv(iv)
+        self.assertEqual(cipher_mode.encrypt(plaintext), ciphertext, msg=cipher_mode.name + ' bulk encrypt')
+        cipher_mode.set_iv(iv)
+        self.assertEqual(cipher_mode.decrypt(bytearray(ciphertext)), plaintext, msg=cipher_mode.name + ' bulk decrypt')
+
+        #Chaining state must carry over between calls
+        cipher_mode.set_iv(iv)
+        self.assertEqual(cipher_mode.encrypt(memoryview(plaintext)[:16]) + cipher_mode.encrypt(plaintext[16:]),
+            ciphertext, msg=cipher_mode.name + ' split bulk encrypt')
+        cipher_mode.set_iv(iv)
+        self.assertEqual(cipher_mode.decrypt(ciphertext[:32]) + cipher_mode.decrypt(ciphertext[32:]),
+            plaintext, msg=cipher_mode.name + ' split bulk decrypt')
+
+        #A trailing partial block is handled the same as the single block interface
+        cipher_mode.set_iv(iv)
+        expected = bytes(bytearray(cipher_mode.encrypt_block(plaintext_list[0]) + cipher_mode.encrypt_block(plaintext_list[1][:5])))
+        cipher_mode.set_iv(iv)
+        self.assertEqual(cipher_mode.encrypt(plaintext[:21]), expected, msg=cipher_mode.name + ' partial bulk encrypt')
+
+    def run_cipher_into(self, cipher_mode, iv, ciphertext_list, plaintext_list):
+        """Test the block into interface writing at offsets of bytearray and memoryview buffers"""
+        plaintext = bytes(bytearray(sum(plaintext_list, [])))
+        ciphertext = bytes(bytearray(sum(ciphertext_list, [])))
+
+        cipher_mode.set_iv(iv)
+        out = bytearray(len(ciphertext) + 3)
+        for off in range(0, len(plaintext), 16):
+            cipher_mode.encrypt_block_into(plaintext, off, out, off + 3)
+        self.assertEqual(bytes(out[3:]), ciphertext, msg=cipher_mode.name + ' encrypt into')
+
+        cipher_mode.set_iv(iv)
+        out = bytearray(len(plaintext))
+        view = memoryview(out)
+        for off in range(0, len(ciphertext), 16):
+            cipher_mode.decrypt_block_into(memoryview(ciphertext), off, view, off)
+        self.assertEqual(bytes(out), plaintext, msg=cipher_mode.name + ' decrypt into')
+
     def test_mode(self):
         """Abstract Test Harness for Encrypt/Decrypt"""
         pass
@@ -12,10 +12,10 @@ Licensed under the MIT license http://www.opensource.org/licenses/mit-license.ph
 __author__ = "Adam Newman"
 
 try:
-    from aespython.cipher_mode import CipherMode
+    from aespython.cipher_mode import CipherMode, block_struct, cipher_into
     from aespython.mode_test import GeneralTestEncryptionMode
 except:
-    from cipher_mode import CipherMode
+    from cipher_mode import CipherMode, block_struct, cipher_into
     from mode_test import GeneralTestEncryptionMode
 
 class OFBMode(CipherMode):
@@ -23,6 +23,8 @@ class OFBMode(CipherMode):
 
     name = "OFB"
 
+    __slots__ = ()
+
     def __init__(self, block_cipher, block_size):
         self._block_cipher = block_cipher
         self._block_size = block_size
@@ -43,7 +45,44 @@ class OFBMode(CipherMode):
         plaintext = [i ^ j for i,j in zip (cipher_iv, ciphertext)]
         self._iv = cipher_iv
         return plaintext
-        
+
+    def encrypt_block_into(self, src, src_off, dst, dst_off):
+        """Encrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        keystream = bytearray(self._iv)
+        cipher_into(self._block_cipher)(keystream, 0, keystream, 0)
+        k0,k1,k2,k3 = block_struct.unpack(keystream)
+        p0,p1,p2,p3 = block_struct.unpack_from(src, src_off)
+        block_struct.pack_into(dst, dst_off, p0^k0, p1^k1, p2^k2, p3^k3)
+        self._iv = list(keystream)
+
+    def decrypt_block_into(self, src, src_off, dst, dst_off):
+        """Decrypt the block at src[src_off:src_off+16] and write it into the writable buffer dst at dst_off"""
+        self.encrypt_block_into(src, src_off, dst, dst_off)
+
+    def encrypt(self, plaintext):
+        """Encrypt a bytes like buffer of one or more blocks, returns bytes"""
+        #Keystream does not depend on the data, so encryption and decryption are the same
+        n = len(plaintext)
+        full = n - n % 16
+        out = bytearray(n)
+        unpack, unpack_from, pack_into = block_struct.unpack, block_struct.unpack_from, block_struct.pack_into
+        cipher_block_into = cipher_into(self._block_cipher)
+        keystream = bytearray(self._iv)
+        for off in range(0, full, 16):
+            cipher_block_into(keystream, 0, keystream, 0)
+            k0,k1,k2,k3 = unpack(keystream)
+            p0,p1,p2,p3 = unpack_from(plaintext, off)
+            pack_into(out, off, p0^k0, p1^k1, p2^k2, p3^k3)
+        if full:
+            self._iv = list(keystream)
+        if full < n:
+            out[full:] = bytearray(self.encrypt_block(list(bytearray(plaintext[full:]))))
+        return bytes(out)
+
+    def decrypt(self, ciphertext):
+        """Decrypt a bytes like buffer of one or more blocks, returns bytes"""
+        return self.encrypt(ciphertext)
+
 class TestEncryptionMode(GeneralTestEncryptionMode):
     def test_mode(self):
         """Test OFB Mode Encrypt/Decrypt"""        
@@ -57,6 +96,14 @@ class TestEncryptionMode(GeneralTestEncryptionMode):
         test_mode = OFBMode(self.get_keyed_cipher(test_data.test_mode_key), 16)        
         
         self.run_cipher(test_mode, test_data.test_mode_iv, test_data.test_ofb_ciphertext, test_data.test_mode_plaintext)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_ofb_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_ofb_ciphertext, test_data.test_mode_plaintext)
+        self.assertFalse(hasattr(test_mode, '__dict__'))
+
+        #Same results through an engine with only cipher_block and decipher_block
+        test_mode = OFBMode(self.get_unbatched_cipher(test_data.test_mode_key), 16)
+        self.run_bulk_cipher(test_mode, test_data.test_mode_iv, test_data.test_ofb_ciphertext, test_data.test_mode_plaintext)
+        self.run_cipher_into(test_mode, test_data.test_mode_iv, test_data.test_ofb_ciphertext, test_data.test_mode_plaintext)
 
 if __name__ == "__main__":
     import unittest
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Parallel decryption across worker processes.
+
+CBC and CFB decryption have no chaining dependency: plaintext block i only needs ciphertext blocks
+i and i-1. A ciphertext is split into chunks, each decrypted by a worker process using the last block
+of the previous chunk (or the IV) as its IV, and the results are joined back in order. Each worker
+expands the key once when the pool starts.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import concurrent.futures
+import os
+
+try:
+    from aespython import key_expander, aes_numpy_cipher, aes_bitsliced_cipher
+    from aespython.cipher_mode import xor_bytes
+except:
+    import key_expander, aes_numpy_cipher, aes_bitsliced_cipher
+    from cipher_mode import xor_bytes
+
+def default_engine():
+    """Fastest block cipher engine available in this interpreter"""
+    if aes_numpy_cipher.numpy is not None:
+        return aes_numpy_cipher.AESNumpyCipher
+    return aes_bitsliced_cipher.AESBitslicedCipher
+
+#Block cipher of the current worker process, created once by _init_worker
+_worker_cipher = None
+
+def _init_worker(engine, key, key_size):
+    global _worker_cipher
+    _worker_cipher = engine(key_expander.KeyExpander(key_size).expand(bytearray(key)))
+
+def _cbc_decrypt_chunk(iv, ciphertext):
+    #Plaintext i is decipher(C[i]) ^ C[i-1], the chunk IV stands in for C[-1]
+    return xor_bytes(_worker_cipher.decipher_blocks(ciphertext), iv + ciphertext[:-16])
+
+def _cfb_decrypt_chunk(iv, ciphertext):
+    #Keystream block i is E(C[i-1]), all computed as one batch. The last chunk may end in a partial block.
+    blocks = -(-len(ciphertext) // 16)
+    keystream = _worker_cipher.cipher_blocks(iv + ciphertext[:(blocks - 1) * 16])
+    return xor_bytes(ciphertext, keystream[:len(ciphertext)])
+
+class ParallelDecryptor:
+    """Decrypt large buffers or files with a pool of worker processes"""
+
+    def __init__(self, key, key_size=256, workers=None, chunk_size=1 << 20, engine=None):
+        if chunk_size <= 0 or chunk_size % 16:
+            raise RuntimeError('chunk_size ' + str(chunk_size) + ' is not a positive multiple of 16')
+        if engine is None:
+            engine = default_engine()
+
+        self._chunk_size = chunk_size
+        self._workers = workers or os.cpu_count() or 1
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self._workers,
+            initializer=_init_worker, initargs=(engine, bytes(bytearray(key)), key_size))
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _chunks(self, iv, ciphertext, whole_blocks):
+        #Yield (iv, chunk) pairs, every chunk overlapping the previous one by its IV block
+        ciphertext = memoryview(ciphertext)
+        if whole_blocks and len(ciphertext) % 16:
+            raise RuntimeError('ciphertext length ' + str(len(ciphertext)) + ' is not a multiple of 16')
+        prev = bytes(bytearray(iv))
+        for off in range(0, len(ciphertext), self._chunk_size):
+            chunk = ciphertext[off:off+self._chunk_size].tobytes()
+            yield prev, chunk
+            prev = chunk[-16:]
+
+    def _decrypt(self, function, iv, ciphertext, whole_blocks):
+        futures = [self._executor.submit(function, chunk_iv, chunk) for chunk_iv, chunk in self._chunks(iv, ciphertext, whole_blocks)]
+        return b''.join(f.result() for f in futures)
+
+    def _read_chunk(self, in_file):
+        #Fill a whole chunk so only the last one can be short, even on pipes and sockets
+        chunk = in_file.read(self._chunk_size)
+        while chunk and len(chunk) < self._chunk_size:
+            more = in_file.read(self._chunk_size - len(chunk))
+            if not more:
+                break
+            chunk += more
+        return chunk
+
+    def _decrypt_file(self, function, in_file, out_file, iv, length, whole_blocks):
+        pending = []
+        written = 0
+        prev = bytes(bytearray(iv))
+        while True:
+            chunk = self._read_chunk(in_file)
+            if chunk:
+                if whole_blocks and len(chunk) % 16:
+                    raise RuntimeError('ciphertext length is not a multiple of 16')
+                pending.append(self._executor.submit(function, prev, chunk))
+                prev = chunk[-16:]
+            #Write finished chunks in order once enough are queued, or everything at EOF
+            while pending and (not chunk or len(pending) > 2 * self._workers):
+                plaintext = pending.pop(0).result()
+                if length is not None:
+                    plaintext = plaintext[:max(0, length - written)]
+                out_file.write(plaintext)
+                written += len(plaintext)
+            if not chunk:
+                return written
+
+    def cbc_decrypt(self, iv, ciphertext):
+        """Decrypt a whole CBC ciphertext buffer, returns bytes"""
+        return self._decrypt(_cbc_decrypt_chunk, iv, ciphertext, True)
+
+    def cfb_decrypt(self, iv, ciphertext):
+        """Decrypt a whole CFB ciphertext buffer, which may end in a partial block, returns bytes"""
+        return self._decrypt(_cfb_decrypt_chunk, iv, ciphertext, False)
+
+    def cbc_decrypt_file(self, in_file, out_file, iv, length=None):
+        """
+            Decrypt CBC ciphertext from the current position of in_file to EOF into out_file
+
+            Only a few chunks per worker are in flight at once, so memory use is bounded.
+            If length is given the plaintext is truncated to length bytes.
+            Returns the number of bytes written.
+        """
+        return self._decrypt_file(_cbc_decrypt_chunk, in_file, out_file, iv, length, True)
+
+    def cfb_decrypt_file(self, in_file, out_file, iv, length=None):
+        """Decrypt CFB ciphertext from the current position of in_file to EOF into out_file, as cbc_decrypt_file"""
+        return self._decrypt_file(_cfb_decrypt_chunk, in_file, out_file, iv, length, False)
+
+import unittest
+class TestParallelDecryptor(unittest.TestCase):
+    def test_cbc(self):
+        """Test parallel CBC decrypt against known ciphertext with chunks smaller than the input"""
+        import io
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        ciphertext = bytes(bytearray(sum(test_data.test_cbc_ciphertext, [])))
+
+        with ParallelDecryptor(test_data.test_mode_key, workers=2, chunk_size=32) as decryptor:
+            self.assertEqual(decryptor.cbc_decrypt(test_data.test_mode_iv, ciphertext), plaintext)
+
+            out_file = io.BytesIO()
+            self.assertEqual(decryptor.cbc_decrypt_file(io.BytesIO(ciphertext), out_file, test_data.test_mode_iv, 50), 50)
+            self.assertEqual(out_file.getvalue(), plaintext[:50])
+
+            self.assertRaises(RuntimeError, decryptor.cbc_decrypt, test_data.test_mode_iv, ciphertext[:20])
+
+    def test_cfb(self):
+        """Test parallel CFB decrypt against known ciphertext, including a trailing partial block"""
+        import io
+        try:
+            from aespython.test_keys import TestKeys
+        except:
+            from test_keys import TestKeys
+
+        test_data = TestKeys()
+        plaintext = bytes(bytearray(sum(test_data.test_mode_plaintext, [])))
+        ciphertext = bytes(bytearray(sum(test_data.test_cfb_ciphertext, [])))
+
+        with ParallelDecryptor(test_data.test_mode_key, workers=2, chunk_size=32) as decryptor:
+            self.assertEqual(decryptor.cfb_decrypt(test_data.test_mode_iv, ciphertext), plaintext)
+            self.assertEqual(decryptor.cfb_decrypt(test_data.test_mode_iv, ciphertext[:45]), plaintext[:45])
+
+            out_file = io.BytesIO()
+            self.assertEqual(decryptor.cfb_decrypt_file(io.BytesIO(ciphertext[:60]), out_file, test_data.test_mode_iv), 60)
+            self.assertEqual(out_file.getvalue(), plaintext[:60])
+
+if __name__ == "__main__":
+    unittest.main()
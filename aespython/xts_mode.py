@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+XTS Mode of operation
+
+XTS-AES encrypts each data unit (sector) independently under a tweak derived from its sector
+number, so any sector can be read or rewritten in place without touching its neighbours. Two
+keys are used: Key1 enciphers the data, Key2 enciphers the sector number into the initial tweak,
+which is multiplied by alpha in GF(2^128) for each following block. A sector that is not a whole
+number of blocks uses ciphertext stealing, so ciphertext is the same length as plaintext.
+
+Every block of a sector, and every sector of a batch, is independent once the tweaks are known,
+so encrypt_sectors and decrypt_sectors build all tweaks first and hand the whole buffer to the
+block cipher's batch interface in one call.
+
+Running this file as __main__ will result in a self-test of the algorithm.
+
+Algorithm per IEEE P1619 http://grouper.ieee.org/groups/1619/email/pdf00086.pdf
+and NIST SP 800-38E
+
+Copyright (c) 2010, Adam Newman http://www.caller9.com/
+Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
+"""
+__author__ = "Adam Newman"
+
+import functools
+
+try:
+    from aespython.cipher_mode import xor_bytes, cipher_blocks, decipher_blocks
+except:
+    from cipher_mode import xor_bytes, cipher_blocks, decipher_blocks
+
+def _xex(function, data, tweaks):
+    #Each block is tweak ^ function(block ^ tweak)
+    return xor_bytes(function(xor_bytes(data, tweaks)), tweaks)
+
+def _key_of(block_cipher):
+    #Expanded key of an engine as bytes, None if it keeps none
+    expanded_key = getattr(block_cipher, '_expanded_key', None)
+    if expanded_key is None:
+        return None
+    return bytes(bytearray(expanded_key))
+
+class XTSMode:
+    """Perform XTS operation on whole sectors, addressed by sector number"""
+
+    name = "XTS"
+
+    def __init__(self, block_cipher, tweak_cipher, sector_size=512):
+        """
+            block_cipher is keyed with Key1, tweak_cipher with Key2. Sectors are sector_size bytes, at least 16.
+
+            Key1 and Key2 must differ, as SP 800-38E requires.
+        """
+        if sector_size < 16:
+            raise RuntimeError('sector_size ' + str(sector_size) + ' is smaller than a block')
+        key1 = _key_of(block_cipher)
+        if block_cipher is tweak_cipher or (key1 is not None and key1 == _key_of(tweak_cipher)):
+            raise RuntimeError('Key1 and Key2 must differ')
+        self._block_cipher = block_cipher
+        self._tweak_cipher = tweak_cipher
+        self._sector_size = sector_size
+
+    def _expand(self, initial_tweaks, count):
+        #Tweaks for count blocks after each initial tweak, multiplied by alpha as little endian 128 bit values
+        result = []
+        for i in range(0, len(initial_tweaks), 16):
+            t = int.from_bytes(initial_tweaks[i:i+16], 'little')
+            for j in range(count):
+                result.append(t.to_bytes(16, 'little'))
+                t <<= 1
+                if t >> 128:
+                    t ^= 0x100000000000000000000000000000087
+        return b''.join(result)
+
+    def tweaks(self, first_sector, sectors, count):
+        """Return the tweaks of count blocks in each of sectors consecutive sectors from first_sector, as bytes"""
+        if first_sector < 0 or first_sector + sectors > 1 << 128:
+            raise RuntimeError('sector number out of range')
+        numbers = b''.join([(first_sector + i).to_bytes(16, 'little') for i in range(sectors)])
+        return self._expand(cipher_blocks(self._tweak_cipher, numbers), count)
+
+    def _function(self, decrypt):
+        #Batch function of the data cipher, one block at a time for engines without batch methods
+        return functools.partial(decipher_blocks if decrypt else cipher_blocks, self._block_cipher)
+
+    def _crypt_sector(self, sector, data, decrypt):
+        n = len(data)
+        if n < 16:
+            raise RuntimeError('data unit of ' + str(n) + ' bytes is smaller than a block')
+        data = memoryview(data)
+        function = self._function(decrypt)
+        tweaks = self.tweaks(sector, 1, -(-n // 16))
+        partial = n % 16
+        if not partial:
+            return _xex(function, data, tweaks)
+
+        #Ciphertext stealing: the last whole block and the partial block swap tails, and on
+        #decrypt the two final tweaks are used in the opposite order
+        full = n - partial
+        head = _xex(function, data[:full-16], tweaks[:full-16])
+        last_tweak, steal_tweak = tweaks[full-16:full], tweaks[full:]
+        if decrypt:
+            last_tweak, steal_tweak = steal_tweak, last_tweak
+        block = _xex(function, data[full-16:full], last_tweak)
+        stolen = _xex(function, data[full:].tobytes() + block[partial:], steal_tweak)
+        return head + stolen + block[:partial]
+
+    def encrypt_sector(self, sector, plaintext):
+        """Encrypt one data unit of at least 16 bytes under sector number sector, returns bytes"""
+        return self._crypt_sector(sector, plaintext, False)
+
+    def decrypt_sector(self, sector, ciphertext):
+        """Decrypt one data unit of at least 16 bytes under sector number sector, returns bytes"""
+        return self._crypt_sector(sector, ciphertext, True)
+
+    def _crypt_sectors(self, first_sector, data, decrypt):
+        size = self._sector_size
+        n = len(data)
+        data = memoryview(data)
+        sectors = n // size
+        if size % 16:
+            #Every sector steals ciphertext, one at a time
+            whole = b''.join([self._crypt_sector(first_sector + i, data[i*size:(i+1)*size], decrypt) for i in range(sectors)])
+        elif sectors:
+            whole = _xex(self._function(decrypt), data[:sectors*size], self.tweaks(first_sector, sectors, size // 16))
+        else:
+            whole = b''
+        if sectors * size < n:
+            whole += self._crypt_sector(first_sector + sectors, data[sectors*size:], decrypt)
+        return whole
+
+    def encrypt_sectors(self, first_sector, plaintext):
+        """
+            Encrypt consecutive sectors starting at sector number first_sector, returns bytes
+
+            All sectors are enciphered as one batch. The last sector may be short, but not under 16 bytes.
+        """
+        return self._crypt_sectors(first_sector, plaintext, False)
+
+    def decrypt_sectors(self, first_sector, ciphertext):
+        """Decrypt consecutive sectors starting at sector number first_sector, as encrypt_sectors"""
+        return self._crypt_sectors(first_sector, ciphertext, True)
+
+import unittest
+class TestEncryptionMode(unittest.TestCase):
+    def get_mode(self, key1, key2, sector_size=512):
+        try:
+            from aespython import key_expander, aes_ttable_cipher
+        except:
+            import key_expander, aes_ttable_cipher
+
+        key_size = len(key1) * 8
+        return XTSMode(aes_ttable_cipher.AESTTableCipher(key_expander.KeyExpander(key_size).expand(bytearray(key1))),
+            aes_ttable_cipher.AESTTableCipher(key_expander.KeyExpander(key_size).expand(bytearray(key2))), sector_size)
+
+    def test_vectors(self):
+        """Test XTS-AES-128 against IEEE P1619 vectors 2 and 15, XTS-AES-256 against vector 10"""
+        import binascii
+        vectors = [
+            (b'11' * 16, b'22' * 16, 0x3333333333, b'44' * 32,
+                b'c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0'),
+            (b'fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0', b'bfbebdbcbbbab9b8b7b6b5b4b3b2b1b0', 0x123456789a,
+                b'000102030405060708090a0b0c0d0e0f10', b'6c1625db4671522d3d7599601de7ca09ed'),
+            #First two blocks of vector 10, which do not depend on the rest of the sector
+            (b'2718281828459045235360287471352662497757247093699959574966967627',
+                b'3141592653589793238462643383279502884197169399375105820974944592', 0xff,
+                b'000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f',
+                b'1c3b3a102f770386e4836c99e370cf9bea00803f5e482357a4ae12d414a3e63b'),
+        ]
+        for key1, key2, sector, plaintext, ciphertext in vectors:
+            test_mode = self.get_mode(binascii.unhexlify(key1), binascii.unhexlify(key2))
+            plaintext, ciphertext = binascii.unhexlify(plaintext), binascii.unhexlify(ciphertext)
+            self.assertEqual(test_mode.encrypt_sector(sector, plaintext), ciphertext, msg='XTS encrypt sector ' + hex(sector))
+            self.assertEqual(test_mode.decrypt_sector(sector, ciphertext), plaintext, msg='XTS decrypt sector ' + hex(sector))
+
+    def test_keys(self):
+        """Test Key1 equal to Key2 is rejected, as in IEEE P1619 vector 1"""
+        try:
+            from aespython import key_expander, aes_ttable_cipher
+        except:
+            import key_expander, aes_ttable_cipher
+
+        for key_size in 128, 256:
+            self.assertRaises(RuntimeError, self.get_mode, bytes(key_size // 8), bytes(key_size // 8))
+            test_cipher = aes_ttable_cipher.AESTTableCipher(key_expander.KeyExpander(key_size).expand(bytearray(key_size // 8)))
+            self.assertRaises(RuntimeError, XTSMode, test_cipher, test_cipher)
+
+    def test_sectors(self):
+        """Test batched sectors match sector at a time, including stealing and a short last sector"""
+        import os
+
+        for sector_size, length in (64, 0), (64, 64 * 3 + 20), (40, 40 * 4), (512, 512 * 3):
+            test_mode = self.get_mode(os.urandom(32), os.urandom(32), sector_size)
+            plaintext = os.urandom(length)
+            expected = b''.join([test_mode.encrypt_sector(7 + i // sector_size, plaintext[i:i+sector_size])
+                for i in range(0, length, sector_size)])
+            ciphertext = test_mode.encrypt_sectors(7, plaintext)
+            self.assertEqual(ciphertext, expected, msg='XTS sectors ' + str(sector_size) + ' ' + str(length))
+            self.assertEqual(test_mode.decrypt_sectors(7, ciphertext), plaintext)
+
+        #A sector rewritten in place only changes its own ciphertext
+        self.assertEqual(test_mode.encrypt_sectors(8, plaintext[512:1024]), ciphertext[512:1024])
+        self.assertRaises(RuntimeError, test_mode.encrypt_sector, 0, b'short')
+
+        #Same results through engines with only cipher_block and decipher_block
+        try:
+            from aespython import mode_test
+        except:
+            import mode_test
+        unbatched_mode = XTSMode(mode_test.UnbatchedCipher(test_mode._block_cipher), mode_test.UnbatchedCipher(test_mode._tweak_cipher))
+        self.assertEqual(unbatched_mode.encrypt_sectors(7, plaintext), ciphertext)
+        self.assertEqual(unbatched_mode.decrypt_sector(8, ciphertext[512:1024]), plaintext[512:1024])
+        self.assertEqual(unbatched_mode.encrypt_sector(3, plaintext[:40]), test_mode.encrypt_sector(3, plaintext[:40]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """
-Demonstration the pythonaes package. Requires Python 2.6 or 3.x
+Demonstration the pythonaes package. Requires Python 3.7 or greater.
+
+The aespython package needs Python 3.4 or greater, for int.from_bytes, struct.iter_unpack and
+concurrent.futures; aes_asyncio needs 3.7 for asyncio.get_running_loop. Python 2 is not supported.
 
 This program was written as a test. It should be reviewed before use on classified material.
 You should also keep a copy of your original file after it is encrypted, all of my tests were
@@ -24,6 +27,11 @@ is checksummed among other things, but this is a demo/test harness. It will work
 not affect the aespython module. This will often cause trailing blocks < 16 bytes to be truncated during
 decryption.
 
+Format 2, written with -f 2, fixes this: a checksummed fixed width header with a 64 bit size, then
+independently encrypted chunks each with its own random IV, see aespython/container.py. Its chunks are
+encrypted and decrypted across worker processes. Decryption detects the format, so format 1 files still
+decrypt. A manually provided IV is only used by format 1, format 2 needs just the key.
+
 Copyright (c) 2010, Adam Newman http://www.caller9.com/
 Licensed under the MIT license http://www.opensource.org/licenses/mit-license.php
 """
@@ -37,13 +45,25 @@ import getopt
 import sys
 import time
 
-from aespython import key_expander, aes_cipher, cbc_mode
+#Checked before importing the package, which does not import on older versions
+if sys.version_info < (3, 7):
+    print('Requires Python 3.7 or greater')
+    sys.exit(1)
+
+from aespython import key_expander, aes_cipher, aes_unrolled_cipher, cbc_mode, parallel, file_pipeline, mmap_file, container, instrument
 
 class AESdemo:
     def __init__(self):
         self._salt = None
         self._iv = None
         self._key = None
+        self._workers = 1
+        self._chunk_size = 1 << 20
+        self._pipeline = False
+        self._mmap = False
+        self._format = 1
+        self._range = None
+        self.pipeline_stats = None
         self._python3 = sys.version_info > (3, 0)
     
     def new_salt(self):
@@ -55,6 +75,30 @@ class AESdemo:
     def set_key(self, key):
         self._key = key
     
+    def set_workers(self, workers):
+        #Number of processes used for decryption, 1 decrypts in this process
+        self._workers = workers
+    
+    def set_chunk_size(self, chunk_size):
+        #Bytes read, ciphered and written per pass. Must be whole blocks.
+        self._chunk_size = max(16, chunk_size - chunk_size % 16)
+    
+    def set_pipeline(self, pipeline):
+        #Overlap reading, ciphering and writing in separate threads
+        self._pipeline = pipeline
+    
+    def set_mmap(self, use_mmap):
+        #Map the input file and cipher slices of the mapping, the output is a pre-sized mapping
+        self._mmap = use_mmap
+    
+    def set_format(self, file_format):
+        #File format written by encrypt_file, 1 or 2
+        self._format = file_format
+    
+    def set_range(self, start, end):
+        #Decrypt only plaintext bytes [start, end), None or negative values count as in a slice
+        self._range = slice(start, end)
+    
     def hex_string_to_int_array(self, hex_string):
         result = []
         for i in range(0,len(hex_string),2):
@@ -79,9 +123,39 @@ class AESdemo:
             tmpstr += chr(i)
         return tmpstr
     
+    def read_chunk(self, in_file, buf):
+        #Fill buf from in_file, returns bytes read. Only less than len(buf) at end of file.
+        view = memoryview(buf)
+        n = 0
+        with instrument.phase('AESdemo.read', 'io_bytes_read') as io_phase:
+            while n < len(buf):
+                count = in_file.readinto(view[n:])
+                if not count:
+                    break
+                n += count
+            io_phase.add(n)
+        return n
+    
+    def write_chunk(self, out_file, data):
+        with instrument.phase('AESdemo.write', 'io_bytes_written', len(data)):
+            out_file.write(data)
+    
+    def new_cipher_mode(self, engine = aes_unrolled_cipher.AESUnrolledCipher):
+        #CBC mode over a faster engine than AESCipher, output is the same
+        expanded_key = key_expander.KeyExpander(256).expand(self._key)
+        aes_cbc_256 = cbc_mode.CBCMode(engine(expanded_key), 16)
+        aes_cbc_256.set_iv(self._iv)
+        return aes_cbc_256
+    
     def decrypt_file(self, in_file_path, out_file_path, password = None):
         with open(in_file_path, 'rb') as in_file:
             
+            #Format 2 files start with a magic number, anything else is format 1
+            if container.is_container(in_file.read(len(container.MAGIC))):
+                in_file.seek(0)
+                return self.decrypt_container(in_file, out_file_path, password)
+            in_file.seek(0)
+            
             #If a password is provided, generate key and iv using salt from file.
             if password is not None:
                 self._salt = in_file.read (32)
@@ -89,38 +163,94 @@ class AESdemo:
             
             #Key and iv have not been generated or provided, bail out
             if self._key is None or self._iv is None:
+                print('format 1 files need both key and iv to decrypt')
                 return False
             
-            #Initialize encryption using key and iv
-            key_expander_256 = key_expander.KeyExpander(256)
-            expanded_key = key_expander_256.expand(self._key)
-            aes_cipher_256 = aes_cipher.AESCipher(expanded_key)
-            aes_cbc_256 = cbc_mode.CBCMode(aes_cipher_256, 16)
-            aes_cbc_256.set_iv(self._iv)
+            #Initialize decryption using key and iv. CBC decrypt is batched, so use a batch engine if available.
+            aes_cbc_256 = self.new_cipher_mode(parallel.default_engine())
             
             #Read original file size
             filesize = struct.unpack('L',in_file.read(struct.calcsize('L')))[0]
             
-            #Decrypt to eof
+            #Decrypt only the blocks covering the range, and one before it
+            if self._range is not None:
+                start, end = self._range.indices(filesize)[:2]
+                with open(out_file_path, 'wb') as out_file:
+                    out_file.write(aes_cbc_256.decrypt_range(in_file, self._iv, start, end, in_file.tell()))
+                self._salt = None
+                return True
+            
+            #CBC decryption parallelizes, hand the rest of the file to a process pool
+            if self._workers > 1:
+                with parallel.ParallelDecryptor(self._key, 256, self._workers) as decryptor:
+                    with open(out_file_path, 'wb') as out_file:
+                        decryptor.cbc_decrypt_file(in_file, out_file, self._iv, filesize)
+                self._salt = None
+                return True
+            
+            if self._mmap:
+                mmap_file.map_file(aes_cbc_256.decrypt, in_file_path, out_file_path, in_file.tell(),
+                    out_size = filesize, chunk_size = self._chunk_size)
+                self._salt = None
+                return True
+            
+            if self._pipeline:
+                with open(out_file_path, 'wb') as out_file:
+                    pipeline = file_pipeline.FilePipeline(aes_cbc_256.decrypt, self._chunk_size, limit=filesize)
+                    pipeline.run(in_file, out_file)
+                    self.pipeline_stats = pipeline.stats
+                self._salt = None
+                return True
+            
+            #Decrypt to eof one chunk at a time, reusing the read buffer
             with open(out_file_path, 'wb') as out_file:
-                eof = False
+                buf = bytearray(self._chunk_size)
+                view = memoryview(buf)
+                remaining = filesize
                 
-                while not eof:
-                    in_data = in_file.read(16)
-                    if len(in_data) == 0:
-                        eof = True
-                    else:
-                        out_data = aes_cbc_256.decrypt_block(list(bytearray(in_data)))
-                        #At end of file, if end of original file is within < 16 bytes slice it out.
-                        if filesize - out_file.tell() < 16:
-                            out_file.write(self.fix_bytes(out_data[:filesize - out_file.tell()]))
-                        else:
-                            out_file.write(self.fix_bytes(out_data))
-                    
+                while True:
+                    n = self.read_chunk(in_file, buf)
+                    if n == 0:
+                        break
+                    out_data = aes_cbc_256.decrypt(view[:n])
+                    #At end of file, if end of original file is within the chunk slice it out.
+                    self.write_chunk(out_file, out_data[:max(0, remaining)])
+                    remaining -= len(out_data)
         
         self._salt = None
         return True
+    
+    def decrypt_container(self, in_file, out_file_path, password = None):
+        try:
+            header = container.read_header(in_file)
+        except RuntimeError as err:
+            print('Not a valid format 2 file:', err)
+            return False
+        if password is not None:
+            self._salt = header['salt']
+            self.create_key_from_password(password)
+        if self._key is None:
+            print('format 2 files need a key or password to decrypt')
+            return False
         
+        try:
+            with container.ChunkedContainer(self._key, self._workers) as chunked:
+                with open(out_file_path, 'wb') as out_file:
+                    if self._range is not None:
+                        start, end = self._range.indices(header['size'])[:2]
+                        out_file.write(chunked.read_range(in_file, start, end, header))
+                    else:
+                        chunked.decrypt_file(in_file, out_file, header)
+        except RuntimeError as err:
+            #Bad padding in the last chunk, almost always a wrong key or password. Leave no partial output.
+            if os.path.exists(out_file_path):
+                os.remove(out_file_path)
+            print('Decryption failed, wrong key or password or corrupt file:', err)
+            return False
+        finally:
+            self._salt = None
+        return True
+    
     def encrypt_file(self, in_file_path, out_file_path, password = None):        
         #If a password is provided, generate new salt and create key and iv
         if password is not None:
@@ -129,23 +259,35 @@ class AESdemo:
         else:
             self._salt = None
         
-        #If key and iv are not provided are established above, bail out.
-        if self._key is None or self._iv is None:
+        #If key and iv are not provided are established above, bail out. Format 2 makes its own IVs.
+        if self._key is None or (self._iv is None and self._format == 1):
             return False
         
-        #Initialize encryption using key and iv
-        key_expander_256 = key_expander.KeyExpander(256)
-        expanded_key = key_expander_256.expand(self._key)
-        aes_cipher_256 = aes_cipher.AESCipher(expanded_key)
-        aes_cbc_256 = cbc_mode.CBCMode(aes_cipher_256, 16)
-        aes_cbc_256.set_iv(self._iv)
-        
         #Get filesize of original file for storage in encrypted file
         try:
             filesize = os.stat(in_file_path)[6]
         except:
             return False
+        
+        if self._format == 2:
+            with container.ChunkedContainer(self._key, self._workers, self._chunk_size) as chunked:
+                with open(in_file_path, 'rb') as in_file:
+                    with open(out_file_path, 'wb') as out_file:
+                        chunked.encrypt_file(in_file, out_file, filesize, self._salt)
+            self._salt = None
+            return True
+        
+        #Initialize encryption using key and iv
+        aes_cbc_256 = self.new_cipher_mode()
 
+        if self._mmap:
+            #Header is salt and filesize, followed by the CBC padded ciphertext
+            header = (self._salt or b'') + struct.pack('L',filesize)
+            mmap_file.map_file(aes_cbc_256.encrypt, in_file_path, out_file_path, header = header,
+                out_size = -(-filesize // 16) * 16, chunk_size = self._chunk_size)
+            self._salt = None
+            return True
+        
         with open(in_file_path, 'rb') as in_file:
             with open(out_file_path, 'wb') as out_file:
                 #Write salt if present
@@ -155,15 +297,20 @@ class AESdemo:
                 #Write filesize of original
                 out_file.write(struct.pack('L',filesize))
                 
-                #Encrypt to eof
-                eof = False
-                while not eof:
-                    in_data = in_file.read(16)
-                    if len(in_data) == 0:
-                        eof = True
-                    else:
-                        out_data = aes_cbc_256.encrypt_block(bytearray(in_data))
-                        out_file.write(self.fix_bytes(out_data))                        
+                #Encrypt to eof one chunk at a time, reusing the read buffer.
+                #Only the last chunk can end in a partial block, which CBC pads.
+                if self._pipeline:
+                    pipeline = file_pipeline.FilePipeline(aes_cbc_256.encrypt, self._chunk_size)
+                    pipeline.run(in_file, out_file)
+                    self.pipeline_stats = pipeline.stats
+                else:
+                    buf = bytearray(self._chunk_size)
+                    view = memoryview(buf)
+                    while True:
+                        n = self.read_chunk(in_file, buf)
+                        if n == 0:
+                            break
+                        self.write_chunk(out_file, aes_cbc_256.encrypt(view[:n]))
                 
         self._salt = None
         return True
@@ -171,38 +318,90 @@ class AESdemo:
 def usage():
     print('AES Demo.py usage:')
     print('-u \t\t\t\t Run unit tests.')
+    print('-b [-- OPTIONS] \t\t Run the benchmark suite, options after -- as benchmark.py -h.')
     print('-d \t\t\t\t Use decryption mode.')
     print('-i INFILE   or --in=INFILE \t Specify input file.')
     print('-o OUTFILE  or --out=OUTFILE \t Specify output file.')
     print('-p PASSWORD or --pass=PASSWORD \t Specify password. precludes key/iv')
     print('-k HEXKEY   or --key=HEXKEY \t Provide 256 bit key manually. Requires iv.')
-    print('-v HEXIV    or --iv=HEXIV \t Provide 128 bit IV manually. Requires key.')
+    print('-v HEXIV    or --iv=HEXIV \t Provide 128 bit IV manually. Format 1 only, required there with key.')
+    print('-w N        or --workers=N \t Use N worker processes, format 1 only parallelizes decryption.')
+    print('-c BYTES    or --chunk=BYTES \t Read/write buffer size, default 1048576.')
+    print('-P          or --pipeline \t Overlap read, cipher and write stages, report stage waits. Format 1 only.')
+    print('-m          or --mmap \t\t Memory map input and output files. Format 1 only.')
+    print('-S          or --stats \t\t Instrument ciphers, modes and I/O in this process and print where time went.')
+    print('\t\t\t\t With -w, chunks ciphered by worker processes are not included.')
+    print('-r START:END or --range=START:END  Decrypt only a byte range, either end may be empty or negative.')
+    print('-f N        or --format=N \t Encrypt to file format 1 or 2, default 1. Decryption detects it.')
+
+import unittest
+class TestAESdemo(unittest.TestCase):
+    def test_wrong_password(self):
+        """Test a format 2 file with the wrong password fails cleanly and leaves no output"""
+        import io, shutil, tempfile
+
+        #Fixed salt, IV and plaintext, so the wrong key surely gives invalid padding
+        salt, iv, plaintext = bytes(range(32)), bytes(range(16)), b'pythonaes' * 10
+        demo = AESdemo()
+        demo._salt = salt
+        demo.create_key_from_password('right')
+        ciphers = container._new_ciphers(demo._key, aes_unrolled_cipher.AESUnrolledCipher)
+        data = io.BytesIO()
+        container.write_header(data, len(plaintext), 1 << 20, [iv], salt)
+        data.write(container._encrypt_chunk(ciphers, iv, plaintext, True))
+
+        tmp = tempfile.mkdtemp()
+        try:
+            in_path, out_path = os.path.join(tmp, 'in.aes'), os.path.join(tmp, 'out')
+            with open(in_path, 'wb') as in_file:
+                in_file.write(data.getvalue())
+            self.assertFalse(AESdemo().decrypt_file(in_path, out_path, 'wrong'))
+            self.assertFalse(os.path.exists(out_path))
+            self.assertTrue(AESdemo().decrypt_file(in_path, out_path, 'right'))
+            with open(out_path, 'rb') as out_file:
+                self.assertEqual(out_file.read(), plaintext)
+        finally:
+            shutil.rmtree(tmp)
 
 def unittests():
-    import unittest
-    from aespython import cfb_mode, ofb_mode
+    from aespython import cfb_mode, ofb_mode, ctr_mode, ecb_mode, aes_ttable_cipher, aes_numpy_cipher, aes_bitsliced_cipher, aes_translate_cipher, aes_io, aes_asyncio, xts_mode, gcm_mode, benchmark, compact
     
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(key_expander.TestKeyExpander))
     suite.addTest(unittest.makeSuite(aes_cipher.TestCipher))
+    suite.addTest(unittest.makeSuite(aes_ttable_cipher.TestTTableCipher))
+    suite.addTest(unittest.makeSuite(aes_unrolled_cipher.TestUnrolledCipher))
+    suite.addTest(unittest.makeSuite(aes_numpy_cipher.TestNumpyCipher))
+    suite.addTest(unittest.makeSuite(aes_bitsliced_cipher.TestBitslicedCipher))
+    suite.addTest(unittest.makeSuite(aes_translate_cipher.TestTranslateCipher))
     suite.addTest(unittest.makeSuite(cbc_mode.TestEncryptionMode))
     suite.addTest(unittest.makeSuite(cfb_mode.TestEncryptionMode))
     suite.addTest(unittest.makeSuite(ofb_mode.TestEncryptionMode))
+    suite.addTest(unittest.makeSuite(ctr_mode.TestEncryptionMode))
+    suite.addTest(unittest.makeSuite(ecb_mode.TestEncryptionMode))
+    suite.addTest(unittest.makeSuite(xts_mode.TestEncryptionMode))
+    suite.addTest(unittest.makeSuite(gcm_mode.TestEncryptionMode))
+    suite.addTest(unittest.makeSuite(benchmark.TestBenchmark))
+    suite.addTest(unittest.makeSuite(instrument.TestInstrument))
+    suite.addTest(unittest.makeSuite(parallel.TestParallelDecryptor))
+    suite.addTest(unittest.makeSuite(file_pipeline.TestFilePipeline))
+    suite.addTest(unittest.makeSuite(mmap_file.TestMappedFile))
+    suite.addTest(unittest.makeSuite(aes_io.TestAESIO))
+    suite.addTest(unittest.makeSuite(aes_asyncio.TestAsyncStreams))
+    suite.addTest(unittest.makeSuite(container.TestChunkedContainer))
+    suite.addTest(unittest.makeSuite(compact.TestCompact))
+    suite.addTest(unittest.makeSuite(TestAESdemo))
     
     return not unittest.TextTestRunner(verbosity = 2).run(suite).wasSuccessful()
     
 def main():
     
-    if sys.version_info < (2,6):
-        print ('Requires Python 2.6 or greater')
-        sys.exit(1)
-    
     if len(sys.argv) < 2:
         usage()
         sys.exit(2)
     
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'udk:v:i:o:p:', ['key=','iv=','in=','out=','pass='])
+        opts, args = getopt.getopt(sys.argv[1:], 'ubdPmSk:v:i:o:p:w:c:f:r:', ['key=','iv=','in=','out=','pass=','workers=','chunk=','pipeline','mmap','format=','range=','stats'])
     except getopt.GetoptError as err:
         print(err)
         usage()
@@ -214,11 +413,17 @@ def main():
     iv = None
     password = None
     decrypt = False
+    stats = False
+    file_format = 1
     
     demo = AESdemo()
     for o, a in opts:
         if o == '-u':            
             sys.exit(unittests())
+        elif o == '-b':
+            #Arguments after -- go to the benchmark, e.g. demo.py -b -- -m CBC -s 64K
+            from aespython import benchmark
+            sys.exit(benchmark.main(args))
         elif o == '-d':
             decrypt=True
         elif o in ('-i','--in'):
@@ -231,12 +436,35 @@ def main():
             iv = demo.hex_string_to_int_array(a)            
         elif o in ('-p','--pass'):
             password = a
+        elif o in ('-w','--workers'):
+            demo.set_workers(int(a))
+        elif o in ('-c','--chunk'):
+            demo.set_chunk_size(int(a))
+        elif o in ('-P','--pipeline'):
+            demo.set_pipeline(True)
+        elif o in ('-m','--mmap'):
+            demo.set_mmap(True)
+        elif o in ('-S','--stats'):
+            stats = True
+        elif o in ('-f','--format'):
+            if a not in ('1', '2'):
+                print('format must be 1 or 2')
+                sys.exit(2)
+            file_format = int(a)
+            demo.set_format(file_format)
+        elif o in ('-r','--range'):
+            try:
+                start, end = [int(i) if i else None for i in a.split(':')]
+            except ValueError:
+                print('range must be START:END')
+                sys.exit(2)
+            demo.set_range(start, end)
     
     if (key is None and password is None) or (key is not None and password is not None):
         print('provide either key and iv or password')
         sys.exit(2)
-    elif key is not None and iv is None:
-        print('iv must be provided with key')
+    elif key is not None and iv is None and not decrypt and file_format == 1:
+        print('iv must be provided with key for format 1')
         sys.exit(2)
     elif key is not None:
         demo.set_key(key)
@@ -246,16 +474,25 @@ def main():
         print('Both input and output filenames are required')
         sys.exit(2)
     
+    if stats:
+        instrument.enable()
     start = time.time()
     if decrypt:
         print ('Decrypting', in_file, 'to', out_file)
-        demo.decrypt_file( in_file, out_file, password)
+        if not demo.decrypt_file( in_file, out_file, password):
+            sys.exit(2)
     else:
         print ('Encrypting', in_file, 'to', out_file)
         demo.encrypt_file( in_file, out_file, password)
     end = time.time()
     
     print('Time',end - start,'s')
+    if stats:
+        print(instrument.report(instrument.snapshot()))
+    if demo.pipeline_stats is not None:
+        stats = demo.pipeline_stats
+        print('Cipher %.3f s, waits: read %.3f s, cipher %.3f s, write %.3f s' %
+            (stats['cipher'], stats['read_wait'], stats['cipher_wait'], stats['write_wait']))
     
 if __name__ == "__main__":
     main()